@@ -5,11 +5,18 @@ import eth_account
 from eth_account.signers.local import LocalAccount
 from dotenv import load_dotenv
 import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable
 
-def get_account_data() -> tuple[LocalAccount, Exchange, Info]:
+from utils.tracing import TRACER
+
+def get_account_data(wallet_address: str | None = None, private_key: str | None = None) -> tuple[LocalAccount, Exchange, Info]:
+  # Defaults to the WALLET_ADDRESS / API_PRIVATE_KEY account from the environment
   load_dotenv()
-  account_adr = os.getenv("WALLET_ADDRESS")
-  agent_key = os.getenv("API_PRIVATE_KEY")
+  account_adr = wallet_address or os.getenv("WALLET_ADDRESS")
+  agent_key = private_key or os.getenv("API_PRIVATE_KEY")
   account: LocalAccount = eth_account.Account.from_key(agent_key)
   print("Running with agent address:", account.address)
   exchange = Exchange(account, constants.MAINNET_API_URL, account_address=account_adr)
@@ -17,22 +24,137 @@ def get_account_data() -> tuple[LocalAccount, Exchange, Info]:
 
   return account, exchange, info
 
-def get_account_details(info: Info) -> tuple[float, dict[str, float]]:
-  load_dotenv()
-  wallet_adr: str = os.getenv("WALLET_ADDRESS", "")
-  user_state = info.user_state(wallet_adr)
-
-  # Extract desired values
+def parse_user_state(user_state: dict, with_sizes: bool = False):
+  # Account value and signed USD positions; with_sizes also returns the signed position sizes in coins
   account_value = user_state["marginSummary"]["accountValue"]
   coin_and_position = {}
+  position_sizes = {}
   for asset_info in user_state["assetPositions"]:
     pos = asset_info.get("position", {})
     coin = pos.get("coin")
+    size = float(pos.get("szi"))
     position_usdt = float(pos.get("positionValue"))
-    if float(pos.get("szi")) < 0:
+    if size < 0:
       position_usdt *= -1
     if coin and position_usdt:
       coin_and_position[coin] = position_usdt
+    if coin and size:
+      position_sizes[coin] = size
   sorted_coin_and_position = {k: coin_and_position[k] for k in sorted(coin_and_position)}
   account_positions = sorted_coin_and_position
+  if with_sizes:
+    return float(account_value), account_positions, position_sizes
   return float(account_value), account_positions
+
+def get_account_details(info: Info) -> tuple[float, dict[str, float]]:
+  load_dotenv()
+  wallet_adr: str = os.getenv("WALLET_ADDRESS", "")
+  with TRACER.span('user_state'):
+    user_state = info.user_state(wallet_adr)
+  return parse_user_state(user_state)
+
+@dataclass
+class AccountSnapshot:
+  account_value: float
+  positions: dict[str, float]
+  fetched_at: float = field(default_factory=time.monotonic)
+
+  @property
+  def age(self) -> float:
+    return time.monotonic() - self.fetched_at
+
+class AccountService:
+  """
+  Owns one set of exchange clients and a cached snapshot of account value and positions.
+
+  `snapshot()` returns the cached state without touching the network; once it is older than `ttl` a
+  background refresh is kicked off and the stale snapshot is served meanwhile. `start()` keeps it fresh by
+  polling every `poll_interval` seconds. `fetch_user_state` can be swapped for a local stand-in or a
+  websocket-fed source; without it `info` is required.
+  """
+
+  def __init__(self, account: LocalAccount | None, exchange: Exchange | None, info: Info | None, wallet_address: str,
+               ttl: float = 30.0, poll_interval: float = 15.0, fetch_user_state: Callable[[str], dict] | None = None):
+    self.account = account
+    self.exchange = exchange
+    self.info = info
+    self.wallet_address = wallet_address
+    self.ttl = ttl
+    self.poll_interval = poll_interval
+    if fetch_user_state is None and info is None:
+      raise ValueError("AccountService needs an Info client or a fetch_user_state function")
+    self.fetch_user_state = fetch_user_state or info.user_state
+    self._snapshot: AccountSnapshot | None = None
+    self._refresh_lock = threading.Lock()
+    self._refreshing_lock = threading.Lock() # guards _refreshing, not held while fetching
+    self._refreshing = False
+    self._stop = threading.Event()
+    self._poller: threading.Thread | None = None
+
+  def refresh(self) -> AccountSnapshot:
+    """
+    Fetches the account state now, e.g. right after a rebalance, and replaces the cached snapshot.
+    """
+    with self._refresh_lock, TRACER.span('user_state'):
+      account_value, positions = parse_user_state(self.fetch_user_state(self.wallet_address))
+      self._snapshot = AccountSnapshot(account_value, positions)
+      return self._snapshot
+
+  def _refresh_in_background(self):
+    with self._refreshing_lock:
+      if self._refreshing:
+        return
+      self._refreshing = True
+    def run():
+      try:
+        self.refresh()
+      except Exception as e:
+        print(f"Account refresh failed: {type(e).__name__}: {e}")
+      finally:
+        with self._refreshing_lock:
+          self._refreshing = False
+    threading.Thread(target=run, daemon=True).start()
+
+  def snapshot(self) -> AccountSnapshot:
+    snapshot = self._snapshot
+    if snapshot is None:
+      return self.refresh()
+    if snapshot.age > self.ttl:
+      self._refresh_in_background()
+    return snapshot
+
+  def details(self) -> tuple[float, dict[str, float]]:
+    """Drop-in for `get_account_details` served from the snapshot."""
+    snapshot = self.snapshot()
+    return snapshot.account_value, snapshot.positions
+
+  def start(self):
+    if self._poller is not None and self._poller.is_alive():
+      return
+    self._stop.clear()
+    def poll():
+      while not self._stop.wait(self.poll_interval):
+        try:
+          self.refresh()
+        except Exception as e:
+          print(f"Account refresh failed: {type(e).__name__}: {e}")
+    self._poller = threading.Thread(target=poll, daemon=True)
+    self._poller.start()
+
+  def stop(self):
+    self._stop.set()
+
+_service: AccountService | None = None
+_service_lock = threading.Lock()
+
+def get_account_service() -> AccountService:
+  """
+  Process-wide AccountService, created with `get_account_data` clients on first use. It doesn't poll:
+  the dashboard shows the scheduler's snapshot and only reads the account on demand; call `start()` to poll.
+  """
+  global _service
+  with _service_lock:
+    if _service is None:
+      account, exchange, info = get_account_data()
+      _service = AccountService(account, exchange, info, os.getenv("WALLET_ADDRESS", ""))
+    return _service
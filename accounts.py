@@ -0,0 +1,137 @@
+"""
+Rebalances several accounts against the same target weights.
+
+The weights and the market data (mids, szDecimals) are computed once and shared; every account then
+gets its own allocations, order plan and execution. Accounts run concurrently on a bounded thread pool
+and a failing account is reported without stopping the others.
+
+accounts.json lists the accounts. Private keys are never stored in it, only the name of the environment
+variable that holds each one:
+
+  [{"name": "main", "wallet_address": "0x...", "private_key_env": "API_PRIVATE_KEY", "margin_mult": 1.2}]
+"""
+from __future__ import annotations
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable
+
+import pandas as pd
+
+from execution import LegExecution, TWAPExecutor
+from rebalance import MarketSnapshot, OrderReport, generate_target_allocations, plan_rebalance, rebalance_portfolio
+from utils.tracing import TRACER, submit
+
+if TYPE_CHECKING:
+    from hyperliquid.exchange import Exchange
+    from hyperliquid.info import Info
+
+ACCOUNTS_PATH = 'accounts.json'
+
+@dataclass
+class AccountConfig:
+    name: str
+    wallet_address: str
+    private_key_env: str = 'API_PRIVATE_KEY'    # environment variable holding the account's API key
+    margin_mult: float = 1.2
+
+@dataclass
+class AccountRebalanceResult:
+    name: str
+    status: str                 # 'done', 'planned' (not executed) or 'failed'
+    account_value: float = 0.0
+    target_allocations: dict[str, float] = field(default_factory=dict)
+    plan: dict[str, list] = field(default_factory=dict)
+    orders: list[OrderReport | LegExecution] = field(default_factory=list) # LegExecutions when sliced with TWAP
+    error: str | None = None
+    elapsed: float = 0.0
+
+def load_account_configs(path: str = ACCOUNTS_PATH) -> list[AccountConfig]:
+    """
+    Accounts listed in `path`, or the single WALLET_ADDRESS / API_PRIVATE_KEY account if the file doesn't exist.
+    """
+    if not os.path.exists(path):
+        from dotenv import load_dotenv
+        load_dotenv()
+        return [AccountConfig('default', os.getenv('WALLET_ADDRESS', ''))]
+    with open(path, 'r') as f:
+        configs = [AccountConfig(**entry) for entry in json.load(f)]
+    names = [config.name for config in configs]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate account names in {path}")
+    return configs
+
+def account_exchange(config: AccountConfig) -> Exchange:
+    from account import get_account_data
+    _, exchange, _ = get_account_data(config.wallet_address, os.getenv(config.private_key_env))
+    return exchange
+
+def rebalance_account(config: AccountConfig, weights_df: pd.DataFrame, info: Info, exchange_factory: Callable[[AccountConfig], Exchange],
+                      market: MarketSnapshot, execute: bool = True, twap_horizon: float = 0.0) -> AccountRebalanceResult:
+    """
+    Reads one account's state, sizes the shared weights to its equity and rebalances it with the shared market data,
+    sliced over `twap_horizon` seconds by a TWAPExecutor if it is positive.
+    """
+    from account import parse_user_state
+
+    start = time.perf_counter()
+    result = AccountRebalanceResult(config.name, 'failed')
+    try:
+        with TRACER.span('user_state'):
+            user_state = info.user_state(config.wallet_address)
+        result.account_value, positions, position_sizes = parse_user_state(user_state, with_sizes=True)
+        result.target_allocations = generate_target_allocations(result.account_value, weights_df, config.margin_mult)
+        result.plan = plan_rebalance(positions, result.target_allocations)
+        if execute:
+            snapshot = market.for_account(position_sizes)
+            if twap_horizon > 0:
+                executor = TWAPExecutor(info, exchange_factory(config), horizon=twap_horizon)
+                result.orders = asyncio.run(executor.execute(result.plan, snapshot))
+            else:
+                result.orders = rebalance_portfolio(info, exchange_factory(config), config.wallet_address, positions,
+                                                    result.target_allocations, snapshot=snapshot)
+        result.status = 'done' if execute else 'planned'
+    except Exception as e:
+        result.error = f'{type(e).__name__}: {e}'
+        print(f'Account {config.name} failed: {result.error}')
+    result.elapsed = time.perf_counter() - start
+    return result
+
+def rebalance_accounts(accounts: list[AccountConfig], weights_df: pd.DataFrame, info: Info,
+                       exchange_factory: Callable[[AccountConfig], Exchange] = account_exchange, max_workers: int = 4,
+                       execute: bool = True, twap_horizon: float = 0.0) -> dict[str, AccountRebalanceResult]:
+    """
+    Rebalances every account to `weights_df` (a 'clipped_weight' column indexed by coin), at most
+    `max_workers` at a time. Mids and szDecimals are fetched once for all of them. `exchange_factory`
+    returns the signed Exchange client of an account. With `execute=False` only the plans are made, with
+    `twap_horizon` > 0 every account's legs are sliced over that many seconds (see execution.py).
+    Returns each account's result by name, in the order of `accounts`.
+    """
+    if not accounts:
+        return {}
+    with TRACER.span('rebalance_accounts'):
+        market = MarketSnapshot.fetch(info)
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(accounts))) as executor:
+            futures = [
+                submit(executor, rebalance_account, config, weights_df, info, exchange_factory, market, execute, twap_horizon)
+                for config in accounts
+            ]
+            return {config.name: future.result() for config, future in zip(accounts, futures)}
+
+
+###### TESTING OR MANUALLY RUNNING FILE
+
+if __name__ == '__main__':
+    from account import get_account_data
+    from rebalance import generate_target_weights
+
+    with open('top_coins.json', 'r') as f:
+        top_coins = list(json.load(f))
+    _, _, info = get_account_data()
+    weights = generate_target_weights(top_coins, '1d')
+    for name, result in rebalance_accounts(load_account_configs(), weights, info, execute=False).items():
+        legs = sum(len(legs) for legs in result.plan.values())
+        print(f'{name}: {result.status} ${result.account_value:,.0f} {legs} legs {result.error or ""}')
@@ -0,0 +1,120 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from panel import load_panel, panel_signals, panel_volatility
+from utils.tracing import traced
+
+@dataclass
+class BacktestResult:
+    equity: pd.DataFrame     # per date: equity, returns, drawdown, turnover, gross_exposure, n_positions
+    positions: pd.DataFrame  # dates x coins, USD position held after each rebalance
+    pnl: pd.DataFrame        # dates x coins, USD P&L earned on each date
+    summary: dict = field(default_factory=dict)
+
+    @property
+    def attribution(self) -> pd.Series:
+        """Total P&L contributed by each coin, largest first."""
+        return self.pnl.sum().sort_values(ascending=False)
+
+def target_weight_panel(signal: pd.DataFrame, inv_vol: pd.DataFrame, clip: float = 0.2) -> pd.DataFrame:
+    """
+    `generate_target_weights` sizing for every date: normalized inverse volatility of the coins with a
+    signal, clipped to `clip` and signed by side. Coins without a signal get 0.
+    """
+    active = signal.isin([1, -1]) & np.isfinite(inv_vol)
+    sized = inv_vol.where(active)
+    normalized = sized.div(sized.sum(axis=1), axis=0)
+    return (normalized.clip(upper=clip) * signal).fillna(0.0)
+
+@traced('run_backtest')
+def run_backtest(close: pd.DataFrame, lookback: int = 5, channel: int = 20, vol_window: int = 20, clip: float = 0.2,
+                 margin_mult: float = 1.2, initial_equity: float = 3500, min_trade: float = 10, band: float = 0.10,
+                 fee_rate: float = 0.0) -> BacktestResult:
+    """
+    Replays `loose_pants_trend` with daily rebalancing on a dates x coins close panel.
+
+    At every close, target positions are sized like `generate_target_allocations` and traded with the
+    `rebalance_portfolio` rules: positions whose coin lost its signal are closed, new coins are opened,
+    and existing positions are only adjusted when the change is at least `min_trade` USD and `band`
+    percent. Positions then earn the next bar's return. `fee_rate` is charged on traded notional; it is 0
+    by default, e.g. 0.00045 for Hyperliquid's base taker fee.
+    A coin missing closes mid-history can't be traded during the gap, so its position is carried through it
+    and earns the return between the closes on either side when the price comes back. A coin whose history
+    has ended is closed at its last close.
+    Weights are computed for all dates in one vectorized pass; only the threshold logic, which depends on
+    the positions actually held, steps through the dates.
+    """
+    signal = panel_signals(close, lookback, channel)
+    inv_vol = 1 / panel_volatility(close, vol_window)
+    weights = target_weight_panel(signal, inv_vol, clip).to_numpy()
+
+    prices = close.to_numpy()
+    # Returns are taken from each coin's last valid close, so a move across a data gap isn't lost
+    last_close = close.ffill().to_numpy()
+    returns = np.nan_to_num(prices[1:] / last_close[:-1] - 1, nan=0.0, posinf=0.0, neginf=0.0)
+    ended = close.bfill().isna().to_numpy()
+    tradable = ~np.isnan(prices) | ended
+    weights[ended] = 0.0
+
+    n_dates, n_coins = prices.shape
+    positions = np.zeros((n_dates, n_coins))
+    pnl = np.zeros((n_dates, n_coins))
+    equity = np.full(n_dates, float(initial_equity))
+    traded = np.zeros(n_dates)
+    held = np.zeros(n_coins)
+    for t in range(n_dates):
+        if t > 0:
+            pnl[t] = held * returns[t - 1]
+            held = held + pnl[t]
+            equity[t] = equity[t - 1] + pnl[t].sum() - traded[t - 1] * fee_rate
+
+        target = weights[t] * equity[t] * margin_mult
+        is_open = held != 0
+        is_target = target != 0
+        change = target - held
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pct_change = np.abs(held - target) / np.abs((held + target) / 2)
+        adjust = is_open & is_target & (np.abs(change) >= min_trade) & (pct_change >= band)
+        trade = ((is_open & ~is_target) | (~is_open & is_target) | adjust) & tradable[t]
+        held = np.where(trade, target, held)
+        traded[t] = np.abs(change[trade]).sum()
+        positions[t] = held
+
+    equity_series = pd.Series(equity, index=close.index)
+    equity_df = pd.DataFrame({
+        'equity': equity_series,
+        'returns': equity_series.pct_change().fillna(0.0),
+        'drawdown': equity_series / equity_series.cummax() - 1,
+        'turnover': traded / equity,
+        'gross_exposure': np.abs(positions).sum(axis=1) / equity,
+        'n_positions': (positions != 0).sum(axis=1),
+    })
+    return BacktestResult(
+        equity=equity_df,
+        positions=pd.DataFrame(positions, index=close.index, columns=close.columns),
+        pnl=pd.DataFrame(pnl, index=close.index, columns=close.columns),
+        summary=summarize(equity_df),
+    )
+
+def summarize(equity_df: pd.DataFrame, periods_per_year: int = 365) -> dict:
+    returns = equity_df['returns']
+    years = len(equity_df) / periods_per_year
+    total_return = equity_df['equity'].iloc[-1] / equity_df['equity'].iloc[0] - 1
+    summary = {
+        'total_return': total_return,
+        'cagr': (1 + total_return) ** (1 / years) - 1 if years and total_return > -1 else np.nan,
+        'volatility': returns.std() * np.sqrt(periods_per_year),
+        'sharpe': returns.mean() / returns.std() * np.sqrt(periods_per_year) if returns.std() else np.nan,
+        'max_drawdown': equity_df['drawdown'].min(),
+        'avg_turnover': equity_df['turnover'].mean(),
+    }
+    return {k: float(v) for k, v in summary.items()}
+
+def backtest_universe(top_coins: list[str], timeframe: str = '1d', base_path='store', **kwargs) -> BacktestResult:
+    """
+    Backtests the strategy on the stored history of `top_coins`. Note the universe is today's, so the
+    result carries survivorship bias.
+    """
+    return run_backtest(load_panel(top_coins, timeframe, base_path=base_path), **kwargs)
@@ -0,0 +1,166 @@
+"""
+Benchmark of the load -> signal -> weight -> rebalance path on synthetic data.
+
+For every combination of coin count and history length, a synthetic candle store is built in a temporary
+directory and each stage is timed (best of --repeat runs) and profiled for peak Python memory (tracemalloc).
+The target weights are timed twice: cold, building every coin's persisted TrendState from the full history,
+and warm, folding a revised last bar into the saved states as a daily update does.
+Results are written as JSON so two runs can be compared:
+
+  python benchmarks/pipeline.py --coins 50 200 500 --years 1 5 10 --output bench_pipeline.json
+  python benchmarks/pipeline.py --quick --output new.json --compare bench_pipeline.json
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import numpy as np
+
+from benchmarks.synthetic import FakeExchange, FakeInfo, FakeOHLCVExchange, build_store
+from candle_store import CandleStore
+from data_fetcher import hyperliquid_update_ohlcv
+from dataframe_loader import generate_df, load_candles
+from rebalance import generate_target_allocations, generate_target_weights, plan_rebalance, rebalance_portfolio
+from strategy import loose_pants_trend
+from volatility_metrics import create_volatility_metrics
+
+def drop_trend_states(base_path: str):
+    for path in glob.glob(os.path.join(base_path, '**', 'trend_state.json'), recursive=True):
+        os.remove(path)
+
+def revise_last_bars(base_path: str, coins: list[str]):
+    # A still-forming daily bar moving, so the saved states re-apply one bar without growing the history
+    store = CandleStore(base_path)
+    for coin in coins:
+        last = store.read_columns(coin, '1d', tail=1)
+        store.write_candles(coin, '1d', [[last['date'][0], last['open'][0], last['high'][0], last['low'][0],
+                                          last['close'][0] * 1.0001, last['volume'][0]]])
+
+def pipeline_stages(base_path: str, coins: list[str]) -> dict:
+    """
+    Stage name -> zero-argument callable, or (setup, callable) with an untimed setup run before each call,
+    run in this order against the store at `base_path`.
+    """
+    frames = {coin: load_candles(coin, '1d', base_path) for coin in coins}
+    with_vol = {coin: create_volatility_metrics(df) for coin, df in frames.items()}
+    rng = np.random.default_rng(0)
+    weights = generate_target_weights(coins, '1d', base_path=base_path)
+    targets = generate_target_allocations(100_000, weights, 1.2)
+    held = {coin: float(rng.normal(0, 2000)) for coin in rng.choice(coins, size=len(coins) // 2, replace=False)}
+    info, exchange = FakeInfo(coins, held), FakeExchange()
+    return {
+        'load_candles': lambda: [load_candles(coin, '1d', base_path) for coin in coins],
+        'create_volatility_metrics': lambda: [create_volatility_metrics(df) for df in frames.values()],
+        'loose_pants_trend': lambda: [loose_pants_trend(df) for df in with_vol.values()],
+        'generate_df': lambda: [generate_df(coin, '1d', base_path) for coin in coins],
+        'generate_target_weights_cold': (
+            lambda: drop_trend_states(base_path), lambda: generate_target_weights(coins, '1d', base_path=base_path)
+        ),
+        'generate_target_weights_warm': (
+            lambda: revise_last_bars(base_path, coins), lambda: generate_target_weights(coins, '1d', base_path=base_path)
+        ),
+        'plan_rebalance': lambda: plan_rebalance(held, targets),
+        'rebalance_portfolio': lambda: rebalance_portfolio(info, exchange, '0xbench', held, targets),
+        'update_ohlcv': lambda: hyperliquid_update_ohlcv(
+            '1d', base_path=base_path, exchange=FakeOHLCVExchange(), requests_per_second=1e6,
+            top_coins={coin: i for i, coin in enumerate(coins)}
+        ),
+    }
+
+def measure(fn, repeat: int, setup=None) -> tuple[float, float]:
+    """Best wall time over `repeat` runs, and peak traced memory in MB of one more run, each after `setup`."""
+    best = float('inf')
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        if setup is not None:
+            setup()
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return best, peak / 1024 ** 2
+
+def run_benchmarks(coin_counts: list[int], years: list[int], repeat: int) -> list[dict]:
+    results = []
+    for n_coins in coin_counts:
+        for n_years in years:
+            n_bars = n_years * 365
+            with tempfile.TemporaryDirectory() as base_path:
+                coins = build_store(base_path, n_coins, n_bars)
+                for stage, fn in pipeline_stages(base_path, coins).items():
+                    setup, fn = fn if isinstance(fn, tuple) else (None, fn)
+                    # update_ohlcv appends bars, so it runs once to keep the history length fixed for the others
+                    wall_s, peak_mb = measure(fn, 1 if stage == 'update_ohlcv' else repeat, setup)
+                    results.append({
+                        'stage': stage, 'coins': n_coins, 'years': n_years, 'bars': n_bars,
+                        'wall_s': round(wall_s, 6), 'peak_mb': round(peak_mb, 3),
+                    })
+                    print(f'{stage:>28} {n_coins:>5} coins {n_years:>3}y  {wall_s * 1000:10.2f} ms  {peak_mb:9.2f} MB')
+    return results
+
+def compare(results: list[dict], baseline_path: str, threshold: float) -> list[dict]:
+    """
+    Prints wall time ratios against a previous results file and returns the cases slower by more than `threshold`.
+    """
+    with open(baseline_path, 'r') as f:
+        baseline = {(r['stage'], r['coins'], r['years']): r for r in json.load(f)['results']}
+    regressions = []
+    for r in results:
+        base = baseline.get((r['stage'], r['coins'], r['years']))
+        if base is None or not base['wall_s']:
+            continue
+        ratio = r['wall_s'] / base['wall_s']
+        flag = ' REGRESSION' if ratio > 1 + threshold else ''
+        print(f"{r['stage']:>28} {r['coins']:>5} coins {r['years']:>3}y  x{ratio:5.2f} time  "
+              f"x{r['peak_mb'] / base['peak_mb'] if base['peak_mb'] else float('nan'):5.2f} memory{flag}")
+        if flag:
+            regressions.append(r)
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--coins', type=int, nargs='+', default=[50, 200, 500])
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help='only 50 coins x 1 year, one repeat')
+    parser.add_argument('--output', default='bench_pipeline.json')
+    parser.add_argument('--compare', help='previous results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='slowdown ratio counted as a regression')
+    args = parser.parse_args()
+    if args.quick:
+        args.coins, args.years, args.repeat = [50], [1], 1
+
+    results = run_benchmarks(args.coins, args.years, args.repeat)
+    commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    with open(args.output, 'w') as f:
+        json.dump({
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'commit': commit or None,
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'repeat': args.repeat,
+            },
+            'results': results,
+        }, f, indent=2)
+    print(f'Wrote {args.output}')
+
+    if args.compare:
+        sys.exit(1 if compare(results, args.compare, args.threshold) else 0)
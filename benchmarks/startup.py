@@ -0,0 +1,112 @@
+"""
+Cold-start benchmark for dashboard.py.
+
+Measures, in a fresh interpreter, how long the dashboard's top-level imports take, and with Streamlit's
+AppTest how long the first script run takes until its first paint (the `dashboard_first_paint` span the
+dashboard records once the sidebar, account metric and coin chart are out) and until it completes. The
+account service is replaced by a stand-in with a configurable API latency, so no network or credentials
+are needed and a dashboard that starts reading the account while rendering shows up in the timings.
+
+Each run is appended as one JSON line to the output file; the exit code is 1 if a budget is exceeded.
+
+  python benchmarks/startup.py --api-latency 2 --output startup_benchmark.jsonl
+"""
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DASHBOARD_PATH = os.path.join(REPO_ROOT, 'dashboard.py')
+
+# Cold-start budget in seconds
+IMPORT_BUDGET_S = 2.0
+FIRST_RENDER_BUDGET_S = 3.0
+
+def dashboard_imports() -> list[str]:
+    with open(DASHBOARD_PATH, 'r') as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+def measure_import_time() -> float:
+    code = (
+        'import time; start = time.perf_counter()\n'
+        + ''.join(f'import {module}\n' for module in dashboard_imports())
+        + 'print(time.perf_counter() - start)'
+    )
+    out = subprocess.run([sys.executable, '-c', code], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+class SlowAccountService:
+    """Stand-in for account.AccountService whose every request takes `latency` seconds."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.account = self.exchange = self.info = None
+
+    def details(self):
+        time.sleep(self.latency)
+        return 3500.0, {}
+
+    def refresh(self):
+        pass
+
+def measure_render(api_latency: float) -> tuple[float, float]:
+    from streamlit.testing.v1 import AppTest
+    import account
+    from utils.tracing import TRACER
+
+    service = SlowAccountService(api_latency)
+    account.get_account_service = lambda: service
+    os.environ['TRACING'] = '1'
+    TRACER.reset()
+    app = AppTest.from_file(DASHBOARD_PATH, default_timeout=120)
+    start = time.perf_counter()
+    app.run()
+    full_render = time.perf_counter() - start
+    if app.exception:
+        raise RuntimeError(f'dashboard.py raised: {app.exception[0].message}')
+    first_paint, rerun = TRACER.histograms.get('dashboard_first_paint'), TRACER.histograms.get('dashboard_rerun')
+    if first_paint is None or rerun is None:
+        raise RuntimeError('dashboard.py recorded no first paint')
+    # Both spans start together inside the script, so first paint came (rerun - first paint) before the end
+    return full_render - (rerun.total - first_paint.total), full_render
+
+def git_commit() -> str | None:
+    out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True, text=True)
+    return out.stdout.strip() or None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--api-latency', type=float, default=2.0, help='simulated account API latency in seconds')
+    parser.add_argument('--output', default='startup_benchmark.jsonl')
+    args = parser.parse_args()
+
+    os.chdir(REPO_ROOT)
+    sys.path.insert(0, REPO_ROOT)
+    import_s = measure_import_time()
+    first_render_s, full_render_s = measure_render(args.api_latency)
+    result = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'api_latency_s': args.api_latency,
+        'import_s': round(import_s, 4),
+        'first_render_s': round(first_render_s, 4),
+        'full_render_s': round(full_render_s, 4),
+        'import_budget_s': IMPORT_BUDGET_S,
+        'first_render_budget_s': FIRST_RENDER_BUDGET_S,
+    }
+    result['within_budget'] = import_s <= IMPORT_BUDGET_S and first_render_s <= FIRST_RENDER_BUDGET_S
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result['within_budget'] else 1)
@@ -0,0 +1,205 @@
+"""
+Synthetic market data and local stand-ins for the exchange clients, shared by the benchmarks.
+"""
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from candle_store import CandleStore
+
+DAY_MS = 86_400_000
+
+def synthetic_ohlcv(n_bars: int, seed: int = 0, start: str = '2015-01-01', bar_ms: int = DAY_MS,
+                    vol: float = 0.04, drift: float = 0.0) -> pd.DataFrame:
+    """
+    Geometric random walk candles with trending regimes, indexed by date like CandleStore.load_df.
+    """
+    rng = np.random.default_rng(seed)
+    # Slowly switching drift so the breakout rule sees trends in both directions
+    regime = np.repeat(rng.normal(drift, vol / 4, n_bars // 50 + 1), 50)[:n_bars]
+    log_returns = regime + rng.normal(0, vol, n_bars)
+    close = 100 * np.exp(np.cumsum(log_returns))
+    open_ = np.concatenate([[100.0], close[:-1]])
+    wick = np.abs(rng.normal(0, vol / 2, (2, n_bars)))
+    start_ms = int(pd.Timestamp(start).value // 1_000_000)
+    index = pd.DatetimeIndex((start_ms + np.arange(n_bars) * bar_ms).view('datetime64[ms]'), name='date')
+    return pd.DataFrame({
+        'open': open_,
+        'high': np.maximum(open_, close) * (1 + wick[0]),
+        'low': np.minimum(open_, close) * (1 - wick[1]),
+        'close': close,
+        'volume': rng.lognormal(10, 1, n_bars),
+    }, index=index)
+
+def coin_names(n_coins: int) -> list[str]:
+    return [f'SYN{i:04d}' for i in range(n_coins)]
+
+def build_store(base_path: str, n_coins: int, n_bars: int, timeframe: str = '1d') -> list[str]:
+    """
+    Writes `n_coins` synthetic series into a CandleStore at `base_path` and returns their names.
+    """
+    store = CandleStore(base_path)
+    coins = coin_names(n_coins)
+    for i, coin in enumerate(coins):
+        store.replace(coin, timeframe, synthetic_ohlcv(n_bars, seed=i))
+    return coins
+
+class FakeOHLCVExchange:
+    """ccxt-style client whose fetch_ohlcv returns `new_bars` fresh candles after `since`, after `latency` seconds."""
+
+    def __init__(self, new_bars: int = 2, latency: float = 0.0, bar_ms: int = DAY_MS):
+        self.new_bars = new_bars
+        self.latency = latency
+        self.bar_ms = bar_ms
+
+    def fetch_ohlcv(self, symbol, timeframe, since=None, limit=None):
+        if self.latency:
+            time.sleep(self.latency)
+        since = since or 0
+        return [[since + i * self.bar_ms, 100.0, 101.0, 99.0, 100.5, 1000.0] for i in range(self.new_bars)]
+
+class FakeInfo:
+    """
+    Hyperliquid Info stand-in serving mids, meta, asset contexts and user_state for a fixed set of coins.
+    `accounts` maps wallet addresses to their own (account value, positions); any other address gets
+    `positions`. `volumes` sets the coins' 24h notional volume.
+    """
+
+    def __init__(self, coins: list[str], positions: dict[str, float] | None = None, price: float = 100.0,
+                 accounts: dict[str, tuple[float, dict[str, float]]] | None = None, volumes: dict[str, float] | None = None):
+        self.coins = coins
+        self.positions = positions or {}
+        self.price = price
+        self.accounts = accounts or {}
+        self.volumes = volumes or {}
+
+    def all_mids(self):
+        return {coin: str(self.price) for coin in self.coins}
+
+    def meta(self):
+        return {'universe': [{'name': coin, 'szDecimals': 2} for coin in self.coins]}
+
+    def meta_and_asset_ctxs(self):
+        return self.meta(), [{'dayNtlVlm': str(self.volumes.get(coin, 0.0))} for coin in self.coins]
+
+    def user_state(self, address):
+        account_value, positions = self.accounts.get(address, (100000, self.positions))
+        return {
+            'marginSummary': {'accountValue': str(account_value)},
+            'assetPositions': [
+                {'position': {'coin': coin, 'szi': str(usd / self.price), 'positionValue': str(abs(usd))}}
+                for coin, usd in positions.items()
+            ],
+        }
+
+class FakeExchange:
+    """Hyperliquid Exchange stand-in that fills every bulk order in full at its limit price."""
+
+    def __init__(self):
+        self.requests = 0
+
+    def bulk_orders(self, order_requests):
+        self.requests += 1
+        statuses = [
+            {'filled': {'oid': i, 'totalSz': str(order['sz']), 'avgPx': str(order['limit_px'])}}
+            for i, order in enumerate(order_requests)
+        ]
+        return {'status': 'ok', 'response': {'type': 'order', 'data': {'statuses': statuses}}}
+
+class SimulatedMarket:
+    """
+    Local matching stand-in serving both the Info and the Exchange calls of the rebalance and execution code.
+
+    Each coin's book has `levels` price levels per side of `depth_usd` each, `tick_bps` apart outside a
+    `spread_bps` spread around the mid. An IoC limit order walks the book up to its limit price and fills
+    partially when the book runs out. Fills push the mid by `impact_bps` per `depth_usd` traded, and that
+    impact decays with a half-life of `impact_halflife` seconds. The fair price follows a seeded random
+    walk of `vol_bps` per order and every order takes `latency` seconds.
+    """
+
+    def __init__(self, coins: list[str], price: float = 100.0, spread_bps: float = 2.0, tick_bps: float = 1.0,
+                 levels: int = 20, depth_usd: float = 5000.0, impact_bps: float = 5.0, impact_halflife: float = 5.0,
+                 vol_bps: float = 1.0, latency: float = 0.0, sz_decimals: int = 2, account_value: float = 100000.0,
+                 positions: dict[str, float] | None = None, seed: int = 0):
+        self.fair = {coin: price for coin in coins}
+        self.impact = {coin: 0.0 for coin in coins}            # bps over the fair price
+        self.impact_at = {coin: time.monotonic() for coin in coins}
+        self.spread_bps, self.tick_bps, self.levels, self.depth_usd = spread_bps, tick_bps, levels, depth_usd
+        self.impact_bps, self.impact_halflife, self.vol_bps = impact_bps, impact_halflife, vol_bps
+        self.latency = latency
+        self.sz_decimals = sz_decimals
+        self.account_value = account_value
+        self.positions = {coin: usd / price for coin, usd in (positions or {}).items()}  # coin -> signed size
+        self.fills: list[dict] = []
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+        self.next_oid = 0
+
+    def _mid(self, coin: str) -> float:
+        now = time.monotonic()
+        self.impact[coin] *= 0.5 ** ((now - self.impact_at[coin]) / self.impact_halflife)
+        self.impact_at[coin] = now
+        return self.fair[coin] * (1 + self.impact[coin] / 1e4)
+
+    def all_mids(self):
+        with self.lock:
+            return {coin: str(self._mid(coin)) for coin in self.fair}
+
+    def meta(self):
+        return {'universe': [{'name': coin, 'szDecimals': self.sz_decimals} for coin in self.fair]}
+
+    def user_state(self, address):
+        with self.lock:
+            mids = {coin: self._mid(coin) for coin in self.positions}
+            return {
+                'marginSummary': {'accountValue': str(self.account_value)},
+                'assetPositions': [
+                    {'position': {'coin': coin, 'szi': str(size), 'positionValue': str(abs(size) * mids[coin])}}
+                    for coin, size in self.positions.items() if size
+                ],
+            }
+
+    def order(self, name, is_buy, sz, limit_px, order_type=None, reduce_only=False, cloid=None, builder=None):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.fair[name] *= float(np.exp(self.rng.normal(0, self.vol_bps / 1e4)))
+            mid = self._mid(name)
+            position = self.positions.get(name, 0.0)
+            if reduce_only:
+                if (position > 0) == is_buy or not position:
+                    return self._response({'error': 'Reduce only order would increase position.'})
+                sz = min(sz, abs(position))
+
+            remaining, filled, notional = sz, 0.0, 0.0
+            for level in range(self.levels):
+                offset = (self.spread_bps / 2 + level * self.tick_bps) / 1e4
+                px = mid * (1 + offset) if is_buy else mid * (1 - offset)
+                if (is_buy and px > limit_px) or (not is_buy and px < limit_px) or remaining <= 0:
+                    break
+                take = min(remaining, self.depth_usd / px)
+                filled, notional, remaining = filled + take, notional + take * px, remaining - take
+            filled = float(np.floor(filled * 10 ** self.sz_decimals + 1e-9) / 10 ** self.sz_decimals)
+            if not filled:
+                return self._response({'error': f'Order could not immediately match against any resting orders. asset={name}'})
+
+            avg_px = notional / (sz - remaining) if sz - remaining else mid
+            sign = 1 if is_buy else -1
+            self.positions[name] = position + sign * filled
+            self.impact[name] += sign * self.impact_bps * filled * avg_px / self.depth_usd
+            self.next_oid += 1
+            self.fills.append({'coin': name, 'is_buy': is_buy, 'size': filled, 'price': avg_px, 'mid': mid})
+            return self._response({'filled': {'oid': self.next_oid, 'totalSz': str(filled), 'avgPx': str(avg_px)}})
+
+    def bulk_orders(self, order_requests):
+        statuses = [
+            self.order(o['coin'], o['is_buy'], o['sz'], o['limit_px'], o['order_type'], o['reduce_only'])['response']['data']['statuses'][0]
+            for o in order_requests
+        ]
+        return {'status': 'ok', 'response': {'type': 'order', 'data': {'statuses': statuses}}}
+
+    @staticmethod
+    def _response(status: dict) -> dict:
+        return {'status': 'ok', 'response': {'type': 'order', 'data': {'statuses': [status]}}}
@@ -0,0 +1,119 @@
+import sys
+import threading
+from dataclasses import fields, is_dataclass
+from collections import OrderedDict
+from typing import Callable
+
+import pandas as pd
+
+from candle_store import CandleStore
+from charts import MAX_CHART_BARS, build_coin_chart
+from dataframe_loader import generate_df, load_candles
+from timeframes import timeframe_version
+
+def estimate_size(value) -> int:
+  if isinstance(value, pd.DataFrame):
+    return int(value.memory_usage(deep=True).sum())
+  if isinstance(value, pd.Series):
+    return int(value.memory_usage(deep=True))
+  if is_dataclass(value):
+    return sum(estimate_size(getattr(value, f.name)) for f in fields(value))
+  return sys.getsizeof(value)
+
+class LRUCache:
+  """
+  Thread-safe LRU cache bounded by the estimated memory of its values, with hit/miss counters.
+  """
+
+  def __init__(self, max_bytes: int = 256 * 1024 ** 2):
+    self.max_bytes = max_bytes
+    self.entries: OrderedDict = OrderedDict() # key -> (value, size)
+    self.total_bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.lock = threading.Lock()
+
+  def get_or_compute(self, key, compute: Callable):
+    with self.lock:
+      if key in self.entries:
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return self.entries[key][0]
+      self.misses += 1
+    value = compute()
+    self.put(key, value)
+    return value
+
+  def put(self, key, value):
+    size = estimate_size(value)
+    with self.lock:
+      if key in self.entries:
+        self.total_bytes -= self.entries.pop(key)[1]
+      if size > self.max_bytes:
+        return
+      self.entries[key] = (value, size)
+      self.total_bytes += size
+      while self.total_bytes > self.max_bytes:
+        _, (_, evicted_size) = self.entries.popitem(last=False)
+        self.total_bytes -= evicted_size
+        self.evictions += 1
+
+  def invalidate(self, match: Callable[[tuple], bool] | None = None):
+    """
+    Drops every entry whose key satisfies `match`, or all entries if no predicate is given.
+    """
+    with self.lock:
+      for key in [key for key in self.entries if match is None or match(key)]:
+        self.total_bytes -= self.entries.pop(key)[1]
+
+  def stats(self) -> dict:
+    with self.lock:
+      lookups = self.hits + self.misses
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'hit_rate': self.hits / lookups if lookups else 0.0,
+        'entries': len(self.entries),
+        'bytes': self.total_bytes,
+        'evictions': self.evictions,
+      }
+
+# Module level so the cache survives Streamlit reruns, which re-execute dashboard.py but not its imports
+DATA_CACHE = LRUCache()
+
+def series_version(symbol: str, timeframe: str, base_path='store'):
+  store = CandleStore(base_path)
+  version = timeframe_version(store, symbol, timeframe)
+  if version is None:
+    load_candles(symbol, timeframe, base_path) # Migrates the legacy CSV so the key is stable from now on
+    version = timeframe_version(store, symbol, timeframe)
+  return version
+
+def cached_generate_df(symbol: str, timeframe: str, base_path='store', tail: int | None = None):
+  """
+  `generate_df` keyed by coin, timeframe, tail and the series' data version, so an update invalidates it.
+  """
+  key = ('df', symbol, timeframe, base_path, tail, series_version(symbol, timeframe, base_path))
+  return DATA_CACHE.get_or_compute(key, lambda: generate_df(symbol, timeframe, base_path, tail=tail))
+
+def cached_coin_chart(symbol: str, timeframe: str, window: int, max_bars: int = MAX_CHART_BARS, base_path='store'):
+  """
+  Downsampled candlestick figure of the last `window` bars, keyed by coin, timeframe, window and data version.
+  Only those bars and the signal warm-up before them are read from the store.
+  """
+  key = ('chart', symbol, timeframe, window, max_bars, base_path, series_version(symbol, timeframe, base_path))
+  return DATA_CACHE.get_or_compute(
+    key, lambda: build_coin_chart(cached_generate_df(symbol, timeframe, base_path, tail=window), symbol, max_bars)
+  )
+
+def invalidate_coins(coins: list[str], timeframe: str | None = None):
+  """
+  Frees entries built from any of `coins` (in every timeframe unless one is given, since coarser
+  timeframes are derived from the base series); stale entries would miss anyway once their data version changes.
+  """
+  coins = set(coins)
+  def built_from(key: tuple) -> bool:
+    symbols = key[1] if isinstance(key[1], tuple) else (key[1],)
+    return (timeframe is None or key[2] == timeframe) and not coins.isdisjoint(symbols)
+  DATA_CACHE.invalidate(built_from)
@@ -0,0 +1,236 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# One raw little-endian binary file per column, plus a tiny meta.json holding the
+# committed row count, a generation number that bumps on every write and the oldest
+# bar the last write touched.
+SCHEMA: dict[str, np.dtype] = {
+  "date": np.dtype("<i8"),    # candle open time, ms since epoch (UTC)
+  "open": np.dtype("<f8"),
+  "high": np.dtype("<f8"),
+  "low": np.dtype("<f8"),
+  "close": np.dtype("<f8"),
+  "volume": np.dtype("<f8"),
+}
+PRICE_COLUMNS = ["open", "high", "low", "close", "volume"]
+# Writes remembered in meta.json with the oldest bar each touched, for state derived from a series
+CHANGE_LOG_SIZE = 256
+
+class CandleStore:
+  """
+  Append-only columnar candle store.
+
+  Each (symbol, timeframe) series lives in `{base_path}/{symbol}_{timeframe}/` as one
+  binary file per column. Appends only write the new rows, revised bars are overwritten
+  in place, and reads are memory-mapped so loading a series does not copy or parse it.
+  """
+
+  def __init__(self, base_path: str = "store"):
+    self.base_path = base_path
+
+  def series_path(self, symbol: str, timeframe: str) -> str:
+    return os.path.join(self.base_path, f"{symbol}_{timeframe}")
+
+  def exists(self, symbol: str, timeframe: str) -> bool:
+    return os.path.exists(os.path.join(self.series_path(symbol, timeframe), "meta.json"))
+
+  def _read_meta(self, symbol: str, timeframe: str) -> dict:
+    meta_path = os.path.join(self.series_path(symbol, timeframe), "meta.json")
+    if not os.path.exists(meta_path):
+      return {"rows": 0, "generation": 0}
+    with open(meta_path, "r") as f:
+      return json.load(f)
+
+  def _write_meta(self, symbol: str, timeframe: str, meta: dict):
+    # Rows only become visible once meta.json is swapped in, so a crash mid-write
+    # leaves the previous committed state readable.
+    meta_path = os.path.join(self.series_path(symbol, timeframe), "meta.json")
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w") as f:
+      json.dump(meta, f)
+    os.replace(tmp_path, meta_path)
+
+  def length(self, symbol: str, timeframe: str) -> int:
+    return int(self._read_meta(symbol, timeframe)["rows"])
+
+  def generation(self, symbol: str, timeframe: str) -> int:
+    """Number of writes applied to a series, usable as a data version for caches."""
+    return int(self._read_meta(symbol, timeframe)["generation"])
+
+  def changed_from(self, symbol: str, timeframe: str) -> int | None:
+    """
+    Timestamp of the oldest bar touched by the last write, or None if the last write was a full rewrite.
+    """
+    return self._read_meta(symbol, timeframe).get("changed_from")
+
+  def oldest_change_since(self, symbol: str, timeframe: str, generation: int) -> int | None:
+    """
+    Timestamp of the oldest bar touched by any write after `generation`, or None if that is not known
+    (a full rewrite happened, or more writes than the change log keeps), meaning any bar may have changed.
+    """
+    meta = self._read_meta(symbol, timeframe)
+    changes = [(gen, changed) for gen, changed in meta.get("changes", []) if gen > generation]
+    if not changes and int(meta["generation"]) == generation + 1:
+      changes = [(int(meta["generation"]), meta.get("changed_from"))] # Series written before the log existed
+    if len(changes) != int(meta["generation"]) - generation or any(changed is None for _, changed in changes):
+      return None
+    return min(changed for _, changed in changes)
+
+  def version(self, symbol: str, timeframe: str) -> tuple[int, int] | None:
+    """
+    Data version of a series (meta.json mtime and write generation) that changes on every write,
+    including a re-migration. None if the series is not in the store.
+    """
+    meta_path = os.path.join(self.series_path(symbol, timeframe), "meta.json")
+    try:
+      mtime_ns = os.stat(meta_path).st_mtime_ns
+    except FileNotFoundError:
+      return None
+    return mtime_ns, self.generation(symbol, timeframe)
+
+  def read_columns(self, symbol: str, timeframe: str, tail: int | None = None) -> dict[str, np.ndarray]:
+    """
+    Returns read-only memory-mapped arrays for every column, optionally only the last `tail` rows.
+    """
+    rows = self.length(symbol, timeframe)
+    start = 0 if tail is None else max(rows - tail, 0)
+    series_dir = self.series_path(symbol, timeframe)
+    columns = {}
+    for col, dtype in SCHEMA.items():
+      if rows - start == 0:
+        columns[col] = np.empty(0, dtype=dtype)
+        continue
+      columns[col] = np.memmap(
+        os.path.join(series_dir, f"{col}.bin"),
+        dtype=dtype, mode="r", offset=start * dtype.itemsize, shape=(rows - start,)
+      )
+    return columns
+
+  def last_timestamp(self, symbol: str, timeframe: str) -> int | None:
+    dates = self.read_columns(symbol, timeframe, tail=1)["date"]
+    return int(dates[-1]) if len(dates) else None
+
+  def load_df(self, symbol: str, timeframe: str, tail: int | None = None) -> pd.DataFrame:
+    """
+    Builds an OHLCV DataFrame indexed by date on top of the memory-mapped columns without copying them.
+    """
+    columns = self.read_columns(symbol, timeframe, tail)
+    index = pd.DatetimeIndex(columns["date"].view("datetime64[ms]"), name="date")
+    return pd.DataFrame({col: columns[col] for col in PRICE_COLUMNS}, index=index, copy=False)
+
+  def write_candles(self, symbol: str, timeframe: str, candles) -> int:
+    """
+    Upserts candles given as rows of [timestamp_ms, open, high, low, close, volume].
+
+    Rows newer than the last stored bar are appended and rows matching an existing timestamp
+    are overwritten in place, so a daily update only touches the bytes of the bars it changes.
+    Rows that fall into a hole in the history force a rewrite of the series.
+    Returns the number of rows written.
+    """
+    arr = np.asarray(candles, dtype=np.float64).reshape(-1, len(SCHEMA))
+    if len(arr) == 0:
+      return 0
+    ts = arr[:, 0].astype(np.int64)
+    # Sort and keep the last occurrence of any duplicated timestamp
+    order = np.argsort(ts, kind="stable")
+    ts, arr = ts[order], arr[order]
+    keep = np.append(ts[1:] != ts[:-1], True)
+    ts, arr = ts[keep], arr[keep]
+
+    os.makedirs(self.series_path(symbol, timeframe), exist_ok=True)
+    meta = self._read_meta(symbol, timeframe)
+    rows = int(meta["rows"])
+    existing_ts = self.read_columns(symbol, timeframe)["date"]
+
+    is_new = ts > existing_ts[-1] if rows else np.ones(len(ts), dtype=bool)
+    pos = np.searchsorted(existing_ts, ts)
+    is_match = ~is_new & (pos < rows)
+    is_match[is_match] = existing_ts[pos[is_match]] == ts[is_match]
+    if not (is_new | is_match).all():
+      existing = self.load_df(symbol, timeframe)
+      incoming = _candles_to_df(ts, arr)
+      merged = pd.concat([existing[~existing.index.isin(incoming.index)], incoming]).sort_index()
+      self.replace(symbol, timeframe, merged)
+      return len(ts)
+
+    series_dir = self.series_path(symbol, timeframe)
+    for i, (col, dtype) in enumerate(SCHEMA.items()):
+      values = (ts if col == "date" else arr[:, i]).astype(dtype)
+      with open(os.path.join(series_dir, f"{col}.bin"), "r+b" if rows else "wb") as f:
+        for p, value in zip(pos[is_match], values[is_match]):
+          f.seek(int(p) * dtype.itemsize)
+          f.write(value.tobytes())
+        f.seek(rows * dtype.itemsize)
+        f.write(values[is_new].tobytes())
+        f.truncate()
+
+    meta["rows"] = rows + int(is_new.sum())
+    meta["generation"] = int(meta["generation"]) + 1
+    meta["changed_from"] = int(ts[0]) # Bars before this one are untouched by the write
+    meta["changes"] = (meta.get("changes", []) + [[meta["generation"], meta["changed_from"]]])[-CHANGE_LOG_SIZE:]
+    self._write_meta(symbol, timeframe, meta)
+    return len(ts)
+
+  def replace(self, symbol: str, timeframe: str, df: pd.DataFrame):
+    """
+    Rewrites a whole series from an OHLCV DataFrame indexed by date.
+    """
+    series_dir = self.series_path(symbol, timeframe)
+    os.makedirs(series_dir, exist_ok=True)
+    meta = self._read_meta(symbol, timeframe)
+    index = pd.DatetimeIndex(df.index)
+    if index.tz is not None:
+      index = index.tz_convert(None)
+    columns = {"date": index.as_unit("ms").asi8}
+    columns.update({col: df[col].to_numpy() for col in PRICE_COLUMNS})
+    for col, dtype in SCHEMA.items():
+      tmp_path = os.path.join(series_dir, f"{col}.bin.tmp")
+      np.ascontiguousarray(columns[col], dtype=dtype).tofile(tmp_path)
+      os.replace(tmp_path, os.path.join(series_dir, f"{col}.bin"))
+    # A rewrite may change any bar
+    generation = int(meta["generation"]) + 1
+    self._write_meta(symbol, timeframe, {"rows": len(df), "generation": generation, "changed_from": None, "changes": [[generation, None]]})
+
+def _candles_to_df(ts: np.ndarray, arr: np.ndarray) -> pd.DataFrame:
+  index = pd.DatetimeIndex(ts.view("datetime64[ms]"), name="date")
+  return pd.DataFrame(arr[:, 1:], columns=PRICE_COLUMNS, index=index)
+
+def read_csv_candles(filepath: str) -> pd.DataFrame:
+  df = pd.read_csv(filepath)
+  df["date"] = pd.to_datetime(df["date"])
+  df.set_index("date", inplace=True)
+  df = df[~df.index.duplicated(keep="last")].sort_index()
+  return df[PRICE_COLUMNS].astype(np.float64)
+
+def migrate_csv(symbol: str, timeframe: str, store: CandleStore, csv_path: str = "csv") -> bool:
+  """
+  Imports `{csv_path}/{symbol}_{timeframe}.csv` into the store. Returns False if there is no CSV.
+  """
+  filepath = os.path.join(csv_path, f"{symbol}_{timeframe}.csv")
+  if not os.path.exists(filepath):
+    return False
+  store.replace(symbol, timeframe, read_csv_candles(filepath))
+  return True
+
+def migrate_csv_dir(csv_path: str = "csv", store_path: str = "store") -> list[str]:
+  """
+  One-time migration of every `{symbol}_{timeframe}.csv` in `csv_path` into a CandleStore.
+  """
+  store = CandleStore(store_path)
+  migrated = []
+  for filename in sorted(os.listdir(csv_path)):
+    if not filename.endswith(".csv"):
+      continue
+    symbol, timeframe = filename.removesuffix(".csv").rsplit("_", 1)
+    migrate_csv(symbol, timeframe, store, csv_path)
+    migrated.append(filename)
+    print(f"Migrated {filename} to {store.series_path(symbol, timeframe)}")
+  return migrated
+
+
+###### TESTING OR MANUALLY RUNNING FILE
+
+if __name__ == "__main__":
+  migrate_csv_dir()
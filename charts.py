@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from utils.tracing import traced
+
+# Most candles sent to the browser per chart; longer windows are aggregated server-side
+MAX_CHART_BARS = 400
+
+def downsample_ohlc(df: pd.DataFrame, max_bars: int = MAX_CHART_BARS) -> pd.DataFrame:
+  """
+  Aggregates consecutive candles into at most `max_bars` display buckets (first open, max high, min low,
+  last close), each stamped with its first candle's date. Signal markers survive: `buy_close` and
+  `sell_close` hold the close of the last buy/sell candle in each bucket, NaN if it had none.
+  """
+  if len(df) <= max_bars:
+    out = df[['open', 'high', 'low', 'close', 'signal']].copy()
+    out['buy_close'] = df['close'].where(df['signal'] == 1)
+    out['sell_close'] = df['close'].where(df['signal'] == -1)
+    return out
+
+  bucket_size = -(-len(df) // max_bars)
+  starts = np.arange(0, len(df), bucket_size)
+  ends = np.append(starts[1:], len(df)) - 1
+  close = df['close'].to_numpy()
+  signal = df['signal'].to_numpy()
+
+  def last_close_where(mask: np.ndarray) -> np.ndarray:
+    # Close of the last marked candle in each bucket, NaN where there is none
+    marked = np.where(mask, np.arange(len(df)), -1)
+    last = np.maximum.reduceat(marked, starts)
+    return np.where(last >= 0, close[np.maximum(last, 0)], np.nan)
+
+  buy_close = last_close_where(signal == 1)
+  sell_close = last_close_where(signal == -1)
+  return pd.DataFrame({
+    'open': df['open'].to_numpy()[starts],
+    'high': np.maximum.reduceat(df['high'].to_numpy(), starts),
+    'low': np.minimum.reduceat(df['low'].to_numpy(), starts),
+    'close': close[ends],
+    'signal': np.where(~np.isnan(buy_close), 1, np.where(~np.isnan(sell_close), -1, 0)),
+    'buy_close': buy_close,
+    'sell_close': sell_close,
+  }, index=df.index[starts])
+
+@traced('build_coin_chart')
+def build_coin_chart(df: pd.DataFrame, coin: str, max_bars: int = MAX_CHART_BARS) -> go.Figure:
+  bars = downsample_ohlc(df, max_bars)
+  title = f"{coin} Price" if len(bars) == len(df) else f"{coin} Price ({len(df)} candles in {len(bars)} bars)"
+  price_chart = go.Figure(
+    data = [
+      go.Candlestick(
+        x=bars.index,
+        open=bars['open'], high=bars['high'],
+        low=bars['low'], close=bars['close'],
+        name="Price")
+    ],
+    layout = go.Layout(
+      title=title,
+      xaxis_rangeslider_visible=False
+    )
+  )
+
+  # Price Chart Long & Short Signals
+  buy_signals = bars[bars['buy_close'].notna()]
+  sell_signals = bars[bars['sell_close'].notna()]
+  price_chart.add_trace(go.Scatter(
+    x=buy_signals.index,
+    y=buy_signals['buy_close'],
+    mode='markers',
+    marker=dict(size=20,
+                color='MediumPurple',
+                symbol='triangle-up',
+                line=dict(
+                    color='LightSkyBlue',
+                    width=2
+                )
+            ),
+    name='Buy Signal'
+  ))
+
+  price_chart.add_trace(go.Scatter(
+      x=sell_signals.index,
+      y=sell_signals['sell_close'],
+      mode='markers',
+      marker=dict(size=20,
+                  color='Orange',
+                  symbol='triangle-down',
+                  line=dict(
+                      color='Black',
+                      width=2
+                  )
+              ),
+      name='Sell Signal'
+  ))
+
+  return price_chart
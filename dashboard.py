@@ -1,25 +1,19 @@
-from tkinter.constants import ARC
-from hyperliquid.info import Info
 import streamlit as st
-import json
+import os
+import time
+from dataclasses import asdict
 import pandas as pd
-import plotly.graph_objects as go
-from dataframe_loader import generate_df
-import account
 from millify import millify
-from rebalance import generate_target_weights, generate_target_allocations
-from rebalance import rebalance_portfolio
 from dotenv import load_dotenv
+from cache import DATA_CACHE, cached_coin_chart, invalidate_coins
+from rebalance import SIGNAL_SOURCES, SIZING_MODES, generate_target_allocations
+from rebalance import rebalance_portfolio
 from data_fetcher import update_top_coins, hyperliquid_update_ohlcv
-import os
-
-load_dotenv()
-WALLET_ADDRESS: str = os.getenv("WALLET_ADDRESS", "")
-INITIAL_POSITION = 3500
-ACCOUNT, EXCHANGE, INFO = account.get_account_data()
-ACCOUNT_VALUE, POSITIONS = account.get_account_details(INFO)
-MARGIN_MULTIPLIER = 1.2
-
+from integrity import backfill_gaps, health_table, scan_universe
+from scheduler import RESULTS_PATH, ResultsStore
+from universe import load_top_coins, read_changes
+from timeframes import BASE_TIMEFRAME, available_timeframes
+from utils.tracing import TRACER
 
 st.set_page_config(
   page_title="Trend Following Dashboard",
@@ -27,95 +21,95 @@ st.set_page_config(
   layout="wide",
   initial_sidebar_state="expanded"
 )
-with open('./top_coins.json', "r") as f:
-  top_coins: dict[str,int] = json.load(f)
+
+load_dotenv()
+WALLET_ADDRESS: str = os.getenv("WALLET_ADDRESS", "")
+INITIAL_POSITION = 3500
+MARGIN_MULTIPLIER = 1.2
+
+# Stage timings feed the sidebar Performance panel; TRACING=0 turns them off, TRACING_EXPORT=<path>
+# (.prom or .json) writes the histograms after every rerun and METRICS_PORT serves them to Prometheus
+TRACER.enabled = os.getenv("TRACING", "1") == "1"
+# Each session reruns on its own thread, so this run only collects the stages of this session's rerun
+trace_run = TRACER.start_run()
+rerun_started = time.perf_counter()
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_server(port: int):
+  return TRACER.serve(port)
+
+if TRACER.enabled and os.getenv("METRICS_PORT"):
+  start_metrics_server(int(os.getenv("METRICS_PORT")))
+
+@st.cache_resource(show_spinner=False)
+def get_account_service():
+  # One client set per server process, created on first use; the account is only read on demand.
+  # Imported here so the Hyperliquid SDK is not loaded before the first paint.
+  import account
+  return account.get_account_service()
+
+# Re-read only when the universe manager has rewritten the file
+top_coins: dict[str,int] = load_top_coins()
 
 def create_data_updaters():
   # Data candles
   if st.button("Update Data",
-    on_click=hyperliquid_update_ohlcv,
     type='secondary',
     icon='🖊️',
     use_container_width=True
   ):
-    st.success("✅ Updated candle data up to today!")
+    fetch_summary = hyperliquid_update_ohlcv(BASE_TIMEFRAME)
+    invalidate_coins(list(fetch_summary))
+    failed_coins = [coin for coin, result in fetch_summary.items() if result.status == 'failed']
+    if failed_coins:
+      st.warning(f"⚠️ Failed to update {', '.join(failed_coins)}")
+    st.success(f"✅ Updated {BASE_TIMEFRAME} candle data up to today for {len(fetch_summary) - len(failed_coins)} coins!")
 
   # Top coins
   if st.button("Update Top 50 Coins by Volume (on Hyperliquid)",
-    on_click=update_top_coins,
-    args=(ACCOUNT, EXCHANGE, INFO),
     type='secondary',
     icon='🗓️',
     use_container_width=True
   ) :
-    st.success("✅ Updated top 50 coins by volume! ")
+    service = get_account_service()
+    diff = update_top_coins(service.account, service.exchange, service.info)
+    if diff:
+      # Only the dropped coins' cached frames are freed, the rest of the universe stays warm
+      invalidate_coins(list(diff.removed))
+      st.success(f"✅ Top coins updated: added {', '.join(diff.added) or 'none'}, removed {', '.join(diff.removed) or 'none'}")
+    else:
+      st.success("✅ Top 50 coins by volume unchanged")
 
 
 with st.sidebar:
   st.title('🏂 Trend Following Dashboard')
 
-  st.metric("Account Value", millify(ACCOUNT_VALUE, 2), delta=f'{millify((ACCOUNT_VALUE - INITIAL_POSITION) / INITIAL_POSITION * 100, 3)}%')
+  # Filled in from the last pipeline run's account snapshot
+  account_value_placeholder = st.empty()
 
   coin_list = list(top_coins.keys())
   selected_coin = st.selectbox('Select a coin', coin_list)
-  timeframe_list = ["1d"]
-  selected_timeframe = st.selectbox('Select a timeframe', timeframe_list)
-  window_size_list = [x for x in range(1, 365)]
+  timeframe_list = available_timeframes(selected_coin) or ['1d']
+  selected_timeframe = st.selectbox('Select a timeframe', timeframe_list, index=timeframe_list.index('1d') if '1d' in timeframe_list else 0)
+  window_size_list = [x for x in range(1, 5 * 365 + 1)]
   selected_window_size = st.select_slider('Select a window size', window_size_list, 21)
+  selected_signal = st.selectbox('Signal', SIGNAL_SOURCES, format_func=lambda source: {
+    'breakout': 'Breakout (loose pants trend)',
+    'forecast': 'Combined forecast (breakout + EWMAC)',
+  }[source])
+  selected_sizing = st.selectbox('Position sizing', SIZING_MODES, format_func=lambda mode: {
+    'inverse_vol': 'Inverse volatility',
+    'target_vol': 'Target portfolio volatility',
+  }[mode])
+  weight_params = {'signal_source': selected_signal, 'sizing': selected_sizing}
+  if selected_sizing == 'target_vol':
+    weight_params['target_vol'] = st.slider('Target volatility (annualized)', 0.1, 1.5, 0.5, 0.05)
 
   create_data_updaters()
 
-df = generate_df(selected_coin, selected_timeframe, 'csv').tail(selected_window_size)
-
-def create_coin_chart():
-  price_chart = go.Figure(
-    data = [
-      go.Candlestick(
-        x=df.index,
-        open=df['open'], high=df['high'],
-        low=df['low'], close=df['close'],
-        name="Price")
-    ],
-    layout = go.Layout(
-      title=f"{selected_coin} Price",
-      xaxis_rangeslider_visible=False
-    )
-  )
-
-  # Price Chart Long & Short Signals
-  buy_signals = df[df['signal'] == 1]
-  sell_signals = df[df['signal'] == -1]
-  price_chart.add_trace(go.Scatter(
-    x=buy_signals.index,
-    y=buy_signals['close'],
-    mode='markers',
-    marker=dict(size=20,
-                color='MediumPurple',
-                symbol='triangle-up',
-                line=dict(
-                    color='LightSkyBlue',
-                    width=2
-                )
-            ),
-    name='Buy Signal'
-  ))
-
-  price_chart.add_trace(go.Scatter(
-      x=sell_signals.index,
-      y=sell_signals['close'],
-      mode='markers',
-      marker=dict(size=20,
-                  color='Orange',
-                  symbol='triangle-down',
-                  line=dict(
-                      color='Black',
-                      width=2
-                  )
-              ),
-      name='Sell Signal'
-  ))
-
-  return price_chart
+  # Filled in at the end of the script so the counters include this rerun
+  cache_stats_placeholder = st.empty()
+  performance_placeholder = st.empty()
 
 def create_view_positions(positions: dict):
   # build a DataFrame with coin, raw_value, abs_value, side
@@ -162,24 +156,250 @@ def create_view_rebalancing_stats( target_weights: pd.DataFrame | pd.Series, pos
 
 
 
-# def create_positions
-col = st.columns((3, 1), gap='medium')
+def run_rebalance(target_weights: pd.DataFrame | pd.Series):
+  # Only here, on click, is the account read live: the orders are sized from its current state
+  service = get_account_service()
+  service.refresh()
+  account_value, positions = service.details()
+  target_allocations = generate_target_allocations(account_value, target_weights, MARGIN_MULTIPLIER)
+  reports = rebalance_portfolio(service.info, service.exchange, WALLET_ADDRESS, positions, target_allocations)
+  st.session_state['rebalance_reports'] = [asdict(report) for report in reports]
+
+def create_view_backtest(run: dict | None):
+  stage = run['stages'].get('backtest') if run is not None else None
+  if stage is None or stage.status != 'done':
+    st.info("No backtest yet: it is computed by the scheduler (`python scheduler.py --once --dry-run`).")
+    return
+  fee_rate = run['config'].get('fee_rate', 0.0)
+  st.caption(
+    f"Backtest of pipeline run {run['run_id']} on the {run['config'].get('timeframe')} timeframe, "
+    + (f"fees of {fee_rate * 1e4:.1f}bps on traded notional" if fee_rate else "without fees")
+  )
+  summary = stage.result['summary']
+  equity = pd.DataFrame(
+    stage.result['equity']['data'], columns=stage.result['equity']['columns'],
+    index=pd.to_datetime(stage.result['equity']['index'], unit='ms'),
+  )
+  attribution = pd.Series(stage.result['attribution'], dtype=float)
+
+  metric_cols = st.columns(5)
+  metric_cols[0].metric("Total Return", f"{summary['total_return']:.0%}")
+  metric_cols[1].metric("CAGR", f"{summary['cagr']:.1%}")
+  metric_cols[2].metric("Sharpe", f"{summary['sharpe']:.2f}")
+  metric_cols[3].metric("Max Drawdown", f"{summary['max_drawdown']:.1%}")
+  metric_cols[4].metric("Avg Daily Turnover", f"{summary['avg_turnover']:.1%}")
+
+  st.markdown('#### Equity Curve')
+  st.line_chart(equity['equity'])
+  st.markdown('#### Drawdown')
+  st.area_chart(equity['drawdown'])
+  st.markdown('#### Turnover')
+  st.bar_chart(equity['turnover'])
+  st.markdown('#### P&L Attribution by Coin')
+  st.bar_chart(attribution)
+
+
+def pipeline_health(run: dict | None) -> pd.DataFrame | None:
+  # Health scan recorded by the scheduler's last run
+  stage = run['stages'].get('data_health') if run is not None else None
+  if stage is None or stage.status != 'done':
+    return None
+  health = pd.DataFrame(stage.result)
+  if health.empty:
+    return health
+  return health.assign(first=pd.to_datetime(health['first'], unit='ms'), last=pd.to_datetime(health['last'], unit='ms'))
+
+def create_view_data_health(run: dict | None):
+  if st.button("Backfill Missing Bars",
+    type='secondary',
+    icon='🩹',
+    help="Fetches only the missing ranges of every stored series, including bars after its last update"
+  ):
+    results = backfill_gaps(top_coins, include_behind=True)
+    invalidate_coins([coin for coin, _ in results])
+    filled = sum(result.rows for result in results.values())
+    remaining = sum(result.remaining_bars for result in results.values())
+    st.success(f"✅ Backfilled {filled} bars in {len(results)} series, {remaining} still missing")
+    # Rescanned only after a backfill, until the scheduler's next run; otherwise the scan is the scheduler's
+    st.session_state['health'] = (run and run['run_id'], health_table(scan_universe(list(top_coins.keys()))))
+
+  scanned_run, health = st.session_state.get('health', (None, None))
+  if health is None or scanned_run != (run and run['run_id']):
+    health = pipeline_health(run)
+  if health is None or health.empty:
+    st.info("No data health scan yet: it is computed by the scheduler (`python scheduler.py --once --dry-run`).")
+  else:
+    status_counts = health['status'].value_counts()
+    metric_cols = st.columns(5)
+    for metric_col, status in zip(metric_cols, ['ok', 'stale', 'gaps', 'corrupt', 'empty']):
+      metric_col.metric(status.capitalize(), int(status_counts.get(status, 0)))
+    st.dataframe(
+      health.sort_values(['status', 'missing_bars'], ascending=[True, False]),
+      column_config={
+        "first": st.column_config.DatetimeColumn("First Bar"),
+        "last": st.column_config.DatetimeColumn("Last Bar"),
+        "behind": st.column_config.NumberColumn("Bars Behind"),
+        "missing_bars": st.column_config.NumberColumn("Missing Bars"),
+      },
+      hide_index=True,
+    )
+
+  changes = read_changes()[-10:]
+  if changes:
+    st.markdown('#### Universe Changes')
+    st.dataframe(
+      pd.DataFrame([{
+        'time': pd.to_datetime(change['time'], unit='ms'),
+        'added': ', '.join(change['added']),
+        'removed': ', '.join(change['removed']),
+      } for change in reversed(changes)]),
+      hide_index=True,
+    )
+
+
+def load_pipeline_run() -> dict | None:
+  # Latest run of the headless scheduler, if it has ever run; reading it is a single local query
+  if not os.path.exists(RESULTS_PATH):
+    return None
+  return ResultsStore(RESULTS_PATH).latest_run()
+
+def pipeline_target_weights(run: dict | None, timeframe: str, params: dict) -> pd.DataFrame | None:
+  """
+  Target weights precomputed by the scheduler, if its last run computed them with the selected settings.
+  """
+  if run is None or 'target_weights' not in run['stages'] or run['stages']['target_weights'].status != 'done':
+    return None
+  config = run['config']
+  if config.get('timeframe') != timeframe or any(config.get(k) != v for k, v in params.items()):
+    return None
+  weights = pd.Series(run['stages']['target_weights'].result, dtype=float)
+  return weights.rename_axis('coin').to_frame('clipped_weight')
+
+def pipeline_account(run: dict | None) -> tuple[float, dict[str, float]] | None:
+  """
+  Account value and positions recorded by the scheduler's last run, after its rebalance if it made one.
+  """
+  if run is None:
+    return None
+  for stage_name, key in (('rebalance', 'account_after'), ('account', None)):
+    stage = run['stages'].get(stage_name)
+    if stage is not None and stage.status == 'done' and stage.result:
+      account = stage.result.get(key) if key else stage.result
+      if account:
+        return account['account_value'], account['positions']
+  return None
+
+def create_view_pipeline_run(run: dict):
+  finished = pd.to_datetime(run['finished_at'], unit='s').strftime('%Y-%m-%d %H:%M UTC') if run['finished_at'] else 'running'
+  with st.expander(f"Pipeline run {run['run_id']}: {run['status']} ({finished})"):
+    st.dataframe(
+      pd.DataFrame([asdict(stage) for stage in run['stages'].values()]).drop(columns='result'),
+      column_order=("stage", "status", "attempts", "elapsed", "error"),
+      column_config={"elapsed": st.column_config.NumberColumn("Elapsed (s)", format="%.2f")},
+      hide_index=True,
+    )
+    rebalance_stage = run['stages'].get('rebalance')
+    if rebalance_stage is not None and rebalance_stage.result and rebalance_stage.result.get('orders'):
+      st.dataframe(
+        pd.DataFrame(rebalance_stage.result['orders']),
+        column_order=("phase", "coin", "status", "size", "filled_size", "avg_price", "slippage_bps", "children", "error"),
+        column_config={"slippage_bps": st.column_config.NumberColumn("Slippage (bps)", format="%.1f")},
+        hide_index=True,
+      )
+    accounts_stage = run['stages'].get('rebalance_accounts')
+    if accounts_stage is not None and accounts_stage.result:
+      st.dataframe(
+        pd.DataFrame([
+          {**result, 'orders': len(result['orders']), 'filled': sum(o['status'] == 'filled' for o in result['orders'])}
+          for result in accounts_stage.result.values()
+        ]),
+        column_order=("name", "status", "account_value", "orders", "filled", "elapsed", "error"),
+        column_config={"account_value": st.column_config.NumberColumn("Account value", format="$%.0f")},
+        hide_index=True,
+      )
 
-with col[0]:
-  st.markdown('#### Position Viewer')
-  coin_chart = create_coin_chart()
-  st.plotly_chart(coin_chart, use_container_width=True)
-  ACCOUNT_VALUE, POSITIONS = account.get_account_details(INFO)
-  create_view_positions(POSITIONS)
 
-with col[1]:
-  st.markdown('#### Rebalancing Zone')
-  target_weights = generate_target_weights(list(top_coins.keys()), selected_timeframe)
-  target_allocations = generate_target_allocations(ACCOUNT_VALUE, target_weights, MARGIN_MULTIPLIER)
+def create_view_rebalancing(positions: dict[str, float], target_weights: pd.DataFrame | pd.Series):
   st.button("Rebalance Portfolio",
-    on_click=rebalance_portfolio, args=(INFO, EXCHANGE, WALLET_ADDRESS, POSITIONS, target_allocations),
+    on_click=run_rebalance, args=(target_weights,),
     type='secondary',
     icon='⚙️'
   )
+  if 'rebalance_reports' in st.session_state:
+    st.subheader("Last Rebalance Orders", divider='gray')
+    st.dataframe(
+      pd.DataFrame(st.session_state['rebalance_reports']),
+      column_order=("phase", "coin", "status", "size", "filled_size", "avg_price", "latency", "error"),
+      hide_index=True,
+    )
+
+  create_view_rebalancing_stats(target_weights, positions)
+
+
+# Every panel reads local data: the candle store and the scheduler's results, never the exchange
+pipeline_run = load_pipeline_run()
+target_weights = pipeline_target_weights(pipeline_run, selected_timeframe, weight_params)
+account_snapshot = pipeline_account(pipeline_run)
+live_tab, backtest_tab, health_tab = st.tabs(["Live", "Backtest", "Data Health"])
+
+if account_snapshot is None:
+  account_value_placeholder.metric("Account Value", "—")
+else:
+  ACCOUNT_VALUE, POSITIONS = account_snapshot
+  account_value_placeholder.metric("Account Value", millify(ACCOUNT_VALUE, 2), delta=f'{millify((ACCOUNT_VALUE - INITIAL_POSITION) / INITIAL_POSITION * 100, 3)}%')
+
+with live_tab:
+  col = st.columns((3, 1), gap='medium')
 
-  create_view_rebalancing_stats(target_weights, POSITIONS)
+  with col[0]:
+    st.markdown('#### Position Viewer')
+    coin_chart = cached_coin_chart(selected_coin, selected_timeframe, selected_window_size)
+    st.plotly_chart(coin_chart, use_container_width=True)
+    if TRACER.enabled:
+      # First paint: the sidebar, the account metric and the coin chart are on screen
+      TRACER.record('dashboard_first_paint', time.perf_counter() - rerun_started)
+    if account_snapshot is None:
+      st.info("No account snapshot yet: it is recorded by the scheduler's runs.")
+    else:
+      create_view_positions(POSITIONS)
+
+  with col[1]:
+    st.markdown('#### Rebalancing Zone')
+    if pipeline_run is not None:
+      create_view_pipeline_run(pipeline_run)
+    if target_weights is None:
+      st.info("No pipeline run yet for these settings: target weights are computed by the scheduler "
+              "(`python scheduler.py --once --dry-run` with the same `--timeframe`, `--signal-source`, `--sizing` "
+              "and `--target-vol`).")
+    elif account_snapshot is not None:
+      create_view_rebalancing(POSITIONS, target_weights)
+
+with backtest_tab:
+  create_view_backtest(pipeline_run)
+
+with health_tab:
+  create_view_data_health(pipeline_run)
+
+cache_stats = DATA_CACHE.stats()
+cache_stats_placeholder.caption(
+  f"Cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+  f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} entries, {millify(cache_stats['bytes'], 1)}B"
+)
+
+if TRACER.enabled:
+  TRACER.record('dashboard_rerun', time.perf_counter() - rerun_started)
+  with performance_placeholder.expander("Performance"):
+    st.caption("Slowest stages of this rerun (p50/p95 over all runs)")
+    st.dataframe(
+      pd.DataFrame(TRACER.slowest(run=trace_run)),
+      column_config={
+        "stage": st.column_config.TextColumn("Stage"),
+        "calls": st.column_config.NumberColumn("Calls"),
+        "total_ms": st.column_config.NumberColumn("Total (ms)", format="%.1f"),
+        "p50_ms": st.column_config.NumberColumn("p50 (ms)", format="%.1f"),
+        "p95_ms": st.column_config.NumberColumn("p95 (ms)", format="%.1f"),
+      },
+      hide_index=True,
+    )
+  if os.getenv("TRACING_EXPORT"):
+    TRACER.export(os.getenv("TRACING_EXPORT"))
@@ -1,110 +1,140 @@
-import json
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 import time
-import os
-import csv
-import pandas as pd
-from datetime import datetime
-
-from eth_account.signers.local import LocalAccount
-from hyperliquid.exchange import Exchange
-from hyperliquid.info import Info
-from hyperliquid.ccxt import hyperliquid as HyperliquidSync
-
-def update_top_coins(account: LocalAccount, exchange: Exchange, info: Info):
-  # fetch meta + contexts
-  meta, ctxs = info.meta_and_asset_ctxs()
-
-  # Zip them together safely
-  volume_data = []
-  for meta_item, ctx in zip(meta["universe"], ctxs):
-      coin = meta_item["name"]
-      volume = float(ctx.get("dayNtlVlm", 0))
-      volume_data.append((coin, volume))
-
-  # Sort and take top 50
-  top_50 = sorted(volume_data, key=lambda x: x[1], reverse=True)[:50]
-
-  # build name→perpetual-ID map
-  perp_id_map = {
-    meta_item["name"]: idx
-    for idx, meta_item in enumerate(meta["universe"])
-  }
-
-  # assume `top_50` is your list of [(coin, volume),…]
-  top_50_names = [coin for coin, _ in top_50]
-
-  # filter down to just the top-50 coins
-  top50_perp_ids = { coin: perp_id_map[coin] for coin in top_50_names }
-
-  with open("top_coins.json", "w") as f:
-    json.dump(top50_perp_ids, f, indent=2)
-
-def hyperliquid_update_ohlcv(timeframe: str = '1d', limit: int = 1000):
-
-  # Initialize exchange
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+if TYPE_CHECKING:
+  # Only needed for annotations; the SDKs are slow to import
+  from eth_account.signers.local import LocalAccount
+  from hyperliquid.exchange import Exchange
+  from hyperliquid.info import Info
+
+from candle_store import CandleStore, migrate_csv
+from timeframes import SUPPORTED_TIMEFRAMES, timeframe_ms
+from utils.rate_limiter import TokenBucket
+from utils.tracing import TRACER, submit
+from universe import MembershipDiff, UniverseManager, drop_coin_state, load_top_coins
+
+def update_top_coins(account: 'LocalAccount', exchange: 'Exchange', info: 'Info', base_path: str = 'store') -> MembershipDiff:
+  # Top 50 by average volume with hysteresis, top_coins.json is only rewritten when membership changes
+  manager = UniverseManager(base_path=base_path)
+  manager.subscribe(lambda diff: drop_coin_state(diff, base_path))
+  return manager.update(info)
+
+def create_ohlcv_exchange():
+  """ccxt Hyperliquid client with markets loaded, the default candle source."""
+  from hyperliquid.ccxt import hyperliquid as HyperliquidSync
   exchange = HyperliquidSync()
   exchange.load_markets()
-
-  def update_csv(asset_id: str, asset_name: str):
-    csv_filename = f'csv/{asset_name}_{timeframe}.csv'
-
-    last_updated = 0
-    if os.path.exists(csv_filename):
-      df = pd.read_csv(csv_filename)
-      last_date = df["date"].iat[-1]
-      ts = pd.to_datetime(last_date, utc=True)
-      ms = int(ts.timestamp() * 1_000)             # seconds → milliseconds
-      last_updated = ms
-    else:
-      # create parent dir if needed
-      os.makedirs(os.path.dirname(csv_filename), exist_ok=True)
-      # empty DataFrame with the right columns
-      df = pd.DataFrame(columns=["date","open","high","low","close","volume"])
-      # write it out (this creates the file with just a header)
-      df.to_csv(csv_filename, index=False)
-
-
+  return exchange
+
+@dataclass
+class FetchResult:
+  coin: str
+  status: str             # 'updated', 'no_data' or 'failed'
+  rows: int = 0
+  attempts: int = 0
+  elapsed: float = 0.0
+  error: str | None = None
+
+def update_coin_candles(exchange, store: CandleStore, asset_id: str, asset_name: str,
+                        timeframe: str = '1d', limit: int = 1000, csv_path: str = 'csv') -> int:
+  """
+  Fetches candles since the last stored bar for one coin and upserts them. Returns rows written.
+  """
+  if not store.exists(asset_name, timeframe):
+    migrate_csv(asset_name, timeframe, store, csv_path)
+
+  last_updated = store.last_timestamp(asset_name, timeframe)
+  if last_updated is None:
+    # New series: start `limit` bars back so the most recent history is fetched
+    last_updated = int(time.time() * 1000) - limit * timeframe_ms(timeframe)
+  with TRACER.span('fetch_ohlcv'):
     ohlcv = exchange.fetch_ohlcv(asset_id, timeframe, since=last_updated, limit=limit)
-    if not ohlcv:
-      print(f'No new data for {asset_name}')
-
-    # Prepare updated rows (replacing recent ones)
-    new_rows_dict = {}
-    for candle in ohlcv:
-        timestamp, o, h, l, c, v = candle
-        date_str = datetime.fromtimestamp(timestamp / 1000).strftime('%Y-%m-%d')
-        new_rows_dict[date_str] = [date_str, round(o, 6), round(h, 6), round(l, 6), round(c, 6), round(v, 6)]
-
-    updated_rows = []
-    if os.path.exists(csv_filename):
-        with open(csv_filename, 'r') as f:
-            reader = csv.reader(f)
-            header = next(reader)
-            for row in reader:
-                if row[0] not in new_rows_dict:
-                    updated_rows.append(row)
-    else:
-        header = ["date", "open", "high", "low", "close", "volume"]
-
-    # Append/replace recent rows
-    updated_rows.extend(new_rows_dict[date] for date in sorted(new_rows_dict))
-
-    # Write to file
-    with open(csv_filename, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(header)
-        for row in updated_rows:
-            writer.writerow(row)
-
-    print(f"Updated {csv_filename} with {len(new_rows_dict)} recent rows.")
+  if not ohlcv:
+    print(f'No new data for {asset_name}')
+    return 0
+
+  # Appends new bars and replaces the still-forming last bar in place
+  candles = [[timestamp, round(o, 6), round(h, 6), round(l, 6), round(c, 6), round(v, 6)]
+             for timestamp, o, h, l, c, v in ohlcv]
+  with TRACER.span('write_candles'):
+    written = store.write_candles(asset_name, timeframe, candles)
+
+  print(f"Updated {store.series_path(asset_name, timeframe)} with {written} recent rows.")
+  return written
+
+def legacy_timeframes(store: CandleStore, asset_name: str, timeframe: str, csv_path: str = 'csv') -> list[str]:
+  """
+  Coarser series of a coin (stored, or still in a legacy CSV) that reach further back than its `timeframe`
+  series. `load_timeframe` stitches them in front of the bars derived from `timeframe`, so they are kept
+  up to date until the finer history covers them; otherwise the stitched series would have a hole.
+  """
+  base_dates = store.read_columns(asset_name, timeframe)['date'] if store.exists(asset_name, timeframe) else []
+  coarser = []
+  for tf in SUPPORTED_TIMEFRAMES:
+    if timeframe_ms(tf) <= timeframe_ms(timeframe) or timeframe_ms(tf) % timeframe_ms(timeframe):
+      continue
+    if not store.exists(asset_name, tf) and not migrate_csv(asset_name, tf, store, csv_path):
+      continue
+    dates = store.read_columns(asset_name, tf)['date']
+    if len(dates) and (not len(base_dates) or dates[0] < base_dates[0]):
+      coarser.append(tf)
+  return coarser
+
+def hyperliquid_update_ohlcv(timeframe: str = '1d', limit: int = 1000, base_path: str = 'store', csv_path: str = 'csv',
+                             exchange=None, max_workers: int = 8, requests_per_second: float = 10.0,
+                             max_retries: int = 3, backoff: float = 1.0,
+                             top_coins: dict[str, int] | None = None) -> dict[str, FetchResult]:
+  """
+  Updates candles for every coin in `top_coins` (default: top_coins.json) concurrently on a bounded thread pool.
+
+  Requests share one token bucket so the pool never exceeds `requests_per_second`, and each coin
+  is retried with exponential backoff. A coin that keeps failing is reported in the returned
+  summary instead of aborting the rest of the universe. `exchange` can be any client exposing
+  `fetch_ohlcv`; by default a ccxt Hyperliquid client is created. Older, coarser series of a coin that
+  the `timeframe` history doesn't cover yet are updated along with it (see `legacy_timeframes`).
+  """
+
+  # Initialize exchange
+  if exchange is None:
+    exchange = create_ohlcv_exchange()
+  store = CandleStore(base_path)
+  limiter = TokenBucket(requests_per_second)
+
+  def update_with_retries(asset_id: str, asset_name: str) -> FetchResult:
+    start = time.perf_counter()
+    result = FetchResult(asset_name, 'failed')
+    for attempt in range(1, max_retries + 1):
+      result.attempts = attempt
+      limiter.acquire()
+      try:
+        result.rows = update_coin_candles(exchange, store, asset_id, asset_name, timeframe, limit, csv_path)
+        for legacy_timeframe in legacy_timeframes(store, asset_name, timeframe, csv_path):
+          limiter.acquire()
+          result.rows += update_coin_candles(exchange, store, asset_id, asset_name, legacy_timeframe, limit, csv_path)
+        result.status = 'updated' if result.rows else 'no_data'
+        result.error = None
+        break
+      except Exception as e:
+        result.error = f'{type(e).__name__}: {e}'
+        print(f'Error fetching {asset_name} (attempt {attempt}/{max_retries}): {result.error}')
+        if attempt < max_retries:
+          time.sleep(backoff * 2 ** (attempt - 1))
+    result.elapsed = time.perf_counter() - start
+    return result
 
   # Load your JSON with assets
-  with open("top_coins.json", "r") as f:
-    top_coins: dict[str,int]  = json.load(f)
+  if top_coins is None:
+    top_coins = load_top_coins()
+
+  with ThreadPoolExecutor(max_workers=max_workers) as pool:
+    futures = {coin: submit(pool, update_with_retries, str(asset_id), coin) for coin, asset_id in top_coins.items()}
+    summary = {coin: future.result() for coin, future in futures.items()}
 
-  for coin, asset_id in top_coins.items():
-    update_csv(str(asset_id), coin)
+  failed = [coin for coin, result in summary.items() if result.status == 'failed']
+  print(f"Updated {len(summary) - len(failed)}/{len(summary)} coins" + (f", failed: {', '.join(failed)}" if failed else ""))
+  return summary
 
 
 ###### TESTING OR MANUALLY RUNNING FILE
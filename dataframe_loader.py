@@ -1,18 +1,93 @@
 import os
+import numpy as np
 import pandas as pd
 
+from candle_store import CandleStore, migrate_csv
+from timeframes import bars_since, changed_since, load_timeframe, source_generations, source_timeframes
+from utils.incremental_indicators import TrendState
+from utils.tracing import traced
 from volatility_metrics import create_volatility_metrics
 from strategy import loose_pants_trend
 
-def generate_df(symbol: str, timeframe: str, base_path='csv'):
-  filename = f"{symbol}_{timeframe}.csv"
-  filepath = os.path.join(base_path, filename)
-  if not os.path.exists(filepath):
-    raise FileNotFoundError(f"File {filepath} not found.")
-  df = pd.read_csv(filepath)
-  df.set_index('date', inplace=True)
-  df = df.sort_index()
+@traced('load_candles')
+def load_candles(symbol: str, timeframe: str, base_path='store', csv_path='csv', tail: int | None = None) -> pd.DataFrame:
+  """
+  Returns the raw OHLCV frame for a coin, sorted by date. Stored timeframes are memory-mapped from the
+  candle store, coarser ones are resampled from the finest stored series that divides them.
+  `tail` limits it to the last `tail` bars, read without touching the rest of the history.
+  """
+  store = CandleStore(base_path)
+  if not source_timeframes(store, symbol, timeframe):
+    # Series not in the store yet, pull it in from the legacy CSV directory once
+    if not migrate_csv(symbol, timeframe, store, csv_path):
+      raise FileNotFoundError(f"File {os.path.join(csv_path, f'{symbol}_{timeframe}.csv')} not found.")
+  return load_timeframe(store, symbol, timeframe, tail)
+
+# Earlier bars a bar's 20-bar channel and volatility windows reach back to
+SIGNAL_WARMUP = 20
+
+def generate_df(symbol: str, timeframe: str, base_path='store', csv_path='csv', tail: int | None = None):
+  """
+  Candles with the volatility metrics and the strategy signal. With `tail`, only the last `tail` bars are
+  returned, computed from those and the SIGNAL_WARMUP bars before them instead of the whole history: the
+  signals are identical to the full history's, the volatility agrees to ~1e-14 relative (pandas' rolling
+  std carries rounding from every earlier bar).
+  """
+  df = load_candles(symbol, timeframe, base_path, csv_path, None if tail is None else tail + SIGNAL_WARMUP)
   df = create_volatility_metrics(df) # Create risk metrics
   df = loose_pants_trend(df) # Apply strategy
 
-  return df
+  return df if tail is None else df.iloc[-tail:]
+
+def load_trend_state(symbol: str, timeframe: str, lookback: int = 5, base_path='store', csv_path='csv') -> TrendState:
+  """
+  Returns the coin's incremental TrendState, folding in only the bars stored since it was last saved.
+  The state is persisted next to the candles with the generations of the series it was built from, and
+  rebuilt from the full history when a write since then changed a bar before its last one (a backfill
+  or a rewrite). When nothing was written the candles aren't read at all.
+  """
+  store = CandleStore(base_path)
+  if not source_timeframes(store, symbol, timeframe):
+    load_candles(symbol, timeframe, base_path, csv_path, tail=1) # Migrates the CSV or raises FileNotFoundError
+  os.makedirs(store.series_path(symbol, timeframe), exist_ok=True)
+  state_path = os.path.join(store.series_path(symbol, timeframe), 'trend_state.json')
+  state = TrendState.load(state_path) if os.path.exists(state_path) else None
+  # Taken before reading, so bars written meanwhile are picked up by the next call
+  generations = source_generations(store, symbol, timeframe)
+
+  tail = None
+  if state is not None and state.lookback == lookback and state.last_timestamp is not None:
+    changed = changed_since(store, symbol, timeframe, state.sources)
+    if changed is None:
+      return state
+    if changed < state.last_timestamp:
+      state = None
+    else:
+      tail = bars_since(store, symbol, timeframe, state.last_timestamp)
+  else:
+    state = None
+  if state is None:
+    state = TrendState(lookback=lookback)
+
+  df = load_candles(symbol, timeframe, base_path, csv_path, tail)
+  dates = df.index.as_unit('ms').asi8
+  # Resume from the last bar the state has seen so a revised last candle is re-applied
+  start = 0 if state.last_timestamp is None else int(np.searchsorted(dates, state.last_timestamp))
+  for timestamp, close in zip(dates[start:].tolist(), df['close'].to_numpy()[start:].tolist()):
+    state.update(timestamp, close)
+  state.sources = generations
+  state.save(state_path)
+  return state
+
+@traced('trend_state_signals')
+def trend_state_signals(coins: list[str], timeframe: str, lookback: int = 5, base_path='store', csv_path='csv') -> pd.DataFrame:
+  """
+  Current 'signal' and 'inv_vol' of every coin from its persisted TrendState, indexed by coin and equal to
+  the last bar of `generate_df` on the full history. Coins with no candles are dropped.
+  """
+  rows = {}
+  for coin in coins:
+    state = load_trend_state(coin, timeframe, lookback, base_path, csv_path)
+    if state.count:
+      rows[coin] = (state.inverse_volatility, state.signal)
+  return pd.DataFrame.from_dict(rows, orient='index', columns=['inv_vol', 'signal'], dtype=float)
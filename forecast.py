@@ -0,0 +1,150 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from utils.tracing import traced
+
+FORECAST_TARGET = 10    # average absolute forecast after scaling
+FORECAST_CAP = 20       # forecasts are clipped to +-FORECAST_CAP
+MAX_FDM = 2.5           # cap on the forecast diversification multiplier
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    A trading rule producing a continuous forecast. `kind` is 'ewmac' (fast EWMA minus slow EWMA of the
+    close, over `fast` and `slow` bar spans) or 'breakout' (position of the close inside its `fast`-bar range).
+    """
+    kind: str
+    fast: int
+    slow: int | None = None
+
+    @property
+    def name(self) -> str:
+        return f'ewmac_{self.fast}_{self.slow}' if self.kind == 'ewmac' else f'{self.kind}_{self.fast}'
+
+DEFAULT_RULES = [
+    Rule('breakout', 20), Rule('breakout', 40), Rule('breakout', 80),
+    Rule('ewmac', 8, 32), Rule('ewmac', 16, 64), Rule('ewmac', 32, 128),
+]
+
+class _PanelFeatures:
+    """
+    Intermediate panels shared by the rules: log returns and their EW volatility, and EWMAs and rolling
+    extremes memoized by window, so a rule that reuses a window costs no further pass over the history.
+    """
+
+    def __init__(self, close: pd.DataFrame, vol_span: int):
+        self.close = close
+        log_returns = np.log(close / close.shift(1))
+        self.volatility = log_returns.ewm(span=vol_span, min_periods=vol_span, adjust=False).std()
+        self._ewma: dict[int, pd.DataFrame] = {}
+        self._high: dict[int, pd.DataFrame] = {}
+        self._low: dict[int, pd.DataFrame] = {}
+
+    def ewma(self, span: int) -> pd.DataFrame:
+        if span not in self._ewma:
+            self._ewma[span] = self.close.ewm(span=span, min_periods=span, adjust=False).mean()
+        return self._ewma[span]
+
+    def high(self, window: int) -> pd.DataFrame:
+        if window not in self._high:
+            self._high[window] = self.close.rolling(window).max()
+        return self._high[window]
+
+    def low(self, window: int) -> pd.DataFrame:
+        if window not in self._low:
+            self._low[window] = self.close.rolling(window).min()
+        return self._low[window]
+
+def raw_forecast(features: _PanelFeatures, rule: Rule) -> pd.DataFrame:
+    if rule.kind == 'ewmac':
+        # EWMA spread in return units, standardized by the EW volatility of log returns
+        spread = (features.ewma(rule.fast) - features.ewma(rule.slow)) / features.close
+        return spread / features.volatility
+    if rule.kind == 'breakout':
+        # Already scale-free: the channel range stands in for the volatility standardization
+        high, low = features.high(rule.fast), features.low(rule.fast)
+        return (features.close - (high + low) / 2) / (high - low)
+    raise ValueError(f"Unknown rule kind {rule.kind!r}")
+
+def scale_forecast(raw: pd.DataFrame, min_periods: int = 100) -> pd.DataFrame:
+    """
+    Forecast scalar to an average absolute forecast of FORECAST_TARGET, then clipped to +-FORECAST_CAP.
+    The average is pooled over every coin and expanding over the dates, so each date is scaled only with
+    what was known on it; dates before `min_periods` pooled values exist have no forecast.
+    """
+    values = raw.to_numpy()
+    finite = np.isfinite(values)
+    count = np.cumsum(finite.sum(axis=1))
+    total = np.cumsum(np.where(finite, np.abs(values), 0.0).sum(axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scalar = np.where((count >= max(min_periods, 1)) & (total > 0), FORECAST_TARGET * count / total, np.nan)
+    return raw.mul(scalar, axis=0).clip(-FORECAST_CAP, FORECAST_CAP)
+
+@traced('rule_forecasts')
+def rule_forecasts(close: pd.DataFrame, rules: list[Rule] = DEFAULT_RULES, vol_span: int = 35) -> dict[str, pd.DataFrame]:
+    """
+    Scaled and clipped forecast of every rule for every coin of a dates x coins close panel. Each rule is
+    one vectorized expression over the whole panel on top of the shared intermediates.
+    """
+    features = _PanelFeatures(close, vol_span)
+    return {rule.name: scale_forecast(raw_forecast(features, rule).replace([np.inf, -np.inf], np.nan)) for rule in rules}
+
+def combine_forecasts(forecasts: dict[str, pd.DataFrame], weights: dict[str, float] | None = None) -> pd.DataFrame:
+    """
+    Weighted average of rule forecasts (equal weights by default), rescaled by the forecast diversification
+    multiplier 1 / sqrt(w' C w) with C the correlation of the rules, pooled over the coins and expanding
+    over the dates like the forecast scalars, and clipped to +-FORECAST_CAP. Rules not yet defined on a
+    bar (e.g. slow ones early in a coin's history) are left out of its average.
+    """
+    names = list(forecasts)
+    w = np.array([1.0 if weights is None else weights.get(name, 0.0) for name in names])
+    w = w / w.sum()
+    stacked = np.stack([forecasts[name].to_numpy() for name in names])  # rules x dates x coins
+
+    defined = np.isfinite(stacked)
+    total = np.einsum('r,rdc->dc', w, np.where(defined, stacked, 0.0))
+    weight_defined = np.einsum('r,rdc->dc', w, defined.astype(float))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        combined = np.where(weight_defined > 0, total / weight_defined, np.nan)
+
+    fdm = np.ones(len(combined))
+    if len(names) > 1:
+        # Running sums of the bars where every rule is defined give the correlation known on each date
+        all_defined = defined.all(axis=0)
+        x = np.where(all_defined, stacked, 0.0)
+        n = np.cumsum(all_defined.sum(axis=1))
+        sums = np.cumsum(x.sum(axis=2).T, axis=0)                               # dates x rules
+        products = np.cumsum(np.einsum('rdc,sdc->drs', x, x), axis=0)          # dates x rules x rules
+        with np.errstate(divide='ignore', invalid='ignore'):
+            covariance = products / n[:, None, None] - sums[:, :, None] * sums[:, None, :] / (n ** 2)[:, None, None]
+            sd = np.sqrt(np.einsum('drr->dr', covariance))
+            # Negative correlations are floored at 0 so the multiplier can't explode
+            correlation = np.clip(covariance / (sd[:, :, None] * sd[:, None, :]), 0, 1)
+            fdm = np.minimum(1 / np.sqrt(np.einsum('r,drs,s->d', w, correlation, w)), MAX_FDM)
+        fdm = np.where((n > 1) & np.isfinite(fdm), fdm, 1.0)
+    combined = np.clip(combined * fdm[:, None], -FORECAST_CAP, FORECAST_CAP)
+    first = forecasts[names[0]]
+    return pd.DataFrame(combined, index=first.index, columns=first.columns)
+
+def panel_forecast(close: pd.DataFrame, rules: list[Rule] = DEFAULT_RULES, weights: dict[str, float] | None = None,
+                   vol_span: int = 35) -> pd.DataFrame:
+    """
+    Combined forecast between -20 and 20 for every coin, shifted one bar like `panel_signals` so it can be
+    traded on the next close.
+    """
+    combined = combine_forecasts(rule_forecasts(close, rules, vol_span), weights)
+    return combined.shift(1).where(close.shift(1).notna())
+
+def forecast_weights(forecast: pd.Series, inv_vol: pd.Series, clip: float = 0.2, max_gross: float = 1.0) -> pd.Series:
+    """
+    Sizes coins from their forecasts: normalized inverse volatility times forecast / FORECAST_TARGET, so an
+    average-strength forecast gets today's inverse volatility weight. Each weight is clipped to `clip` and
+    the book is scaled down if its gross weight exceeds `max_gross`. Coins without a forecast are dropped.
+    """
+    active = forecast.notna() & (forecast != 0) & np.isfinite(inv_vol.reindex(forecast.index))
+    forecast, inv_vol = forecast[active], inv_vol.reindex(forecast.index)[active]
+    weights = (inv_vol / inv_vol.sum() * forecast / FORECAST_TARGET).clip(-clip, clip)
+    gross = weights.abs().sum()
+    return weights * (max_gross / gross) if gross > max_gross else weights
@@ -0,0 +1,201 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from candle_store import CandleStore
+from timeframes import BUCKET_ORIGIN_MS, SUPPORTED_TIMEFRAMES, timeframe_ms
+from utils.rate_limiter import TokenBucket
+from utils.tracing import TRACER, submit, traced
+
+@dataclass
+class SeriesHealth:
+  coin: str
+  timeframe: str
+  rows: int = 0
+  first: int | None = None        # ms of the first and last stored bar
+  last: int | None = None
+  missing_bars: int = 0           # bars missing between the first and last stored bar
+  duplicates: int = 0             # extra copies of an already stored timestamp
+  out_of_order: int = 0           # bars older than the bar stored before them
+  misaligned: int = 0             # bars not starting on a timeframe boundary
+  behind: int = 0                 # bars between the last stored bar and now
+  gaps: list[tuple[int, int]] = field(default_factory=list) # (first missing ms, last missing ms)
+
+  @property
+  def status(self) -> str:
+    if not self.rows:
+      return 'empty'
+    if self.duplicates or self.out_of_order:
+      return 'corrupt'
+    if self.missing_bars:
+      return 'gaps'
+    if self.behind:
+      return 'stale'
+    return 'ok'
+
+def scan_series(store: CandleStore, symbol: str, timeframe: str, now_ms: int | None = None) -> SeriesHealth:
+  """
+  Checks one stored series for missing, duplicated, out-of-order and misaligned bars in a single
+  vectorized pass over its memory-mapped timestamps.
+  """
+  health = SeriesHealth(symbol, timeframe)
+  dates = store.read_columns(symbol, timeframe)['date']
+  health.rows = len(dates)
+  if not len(dates):
+    return health
+  interval = timeframe_ms(timeframe)
+  health.first, health.last = int(dates.min()), int(dates.max())
+  health.misaligned = int(np.count_nonzero((dates - BUCKET_ORIGIN_MS) % interval))
+
+  steps = np.diff(dates)
+  health.out_of_order = int(np.count_nonzero(steps < 0))
+  # Gaps are measured on the sorted, distinct timestamps so disorder doesn't hide or invent them
+  distinct = np.unique(dates) if health.out_of_order or np.any(steps == 0) else dates
+  health.duplicates = len(dates) - len(distinct)
+  distinct_steps = np.diff(distinct)
+  at = np.flatnonzero(distinct_steps > interval)
+  health.missing_bars = int((distinct_steps[at] // interval - 1).sum())
+  health.gaps = [(int(distinct[i]) + interval, int(distinct[i + 1]) - interval) for i in at]
+
+  now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+  current_bar = (now_ms - BUCKET_ORIGIN_MS) // interval * interval + BUCKET_ORIGIN_MS
+  health.behind = max(int((current_bar - health.last) // interval), 0)
+  return health
+
+@traced('scan_universe')
+def scan_universe(coins: list[str], timeframes: list[str] | None = None, base_path='store') -> list[SeriesHealth]:
+  """
+  Scans every stored series of `coins`, in all supported timeframes unless `timeframes` is given.
+  """
+  store = CandleStore(base_path)
+  now_ms = int(time.time() * 1000)
+  return [
+    scan_series(store, coin, tf, now_ms)
+    for coin in coins for tf in (timeframes or SUPPORTED_TIMEFRAMES) if store.exists(coin, tf)
+  ]
+
+def health_table(report: list[SeriesHealth]) -> pd.DataFrame:
+  """One row per series with its status, counters and data range, for display."""
+  return pd.DataFrame([{
+    'coin': h.coin,
+    'timeframe': h.timeframe,
+    'status': h.status,
+    'rows': h.rows,
+    'missing_bars': h.missing_bars,
+    'gaps': len(h.gaps),
+    'duplicates': h.duplicates,
+    'out_of_order': h.out_of_order,
+    'misaligned': h.misaligned,
+    'behind': h.behind,
+    'first': pd.to_datetime(h.first, unit='ms') if h.first is not None else pd.NaT,
+    'last': pd.to_datetime(h.last, unit='ms') if h.last is not None else pd.NaT,
+  } for h in report])
+
+def repair_order(store: CandleStore, symbol: str, timeframe: str):
+  """Rewrites a series sorted by date with duplicates dropped, keeping the last copy of each bar."""
+  df = store.load_df(symbol, timeframe)
+  store.replace(symbol, timeframe, df[~df.index.duplicated(keep='last')].sort_index())
+
+@dataclass
+class BackfillResult:
+  coin: str
+  timeframe: str
+  requested_bars: int = 0
+  rows: int = 0
+  requests: int = 0
+  reordered: bool = False         # duplicated or out-of-order bars were fixed by a sorted rewrite
+  errors: list[str] = field(default_factory=list)
+  remaining_bars: int = 0         # still missing after the backfill, e.g. bars the exchange doesn't have
+
+def backfill_ranges(health: SeriesHealth, include_behind: bool = False, limit: int = 1000) -> list[tuple[int, int]]:
+  """
+  Splits a series' missing ranges into (since_ms, bars) fetches of at most `limit` bars each.
+  """
+  interval = timeframe_ms(health.timeframe)
+  ranges = list(health.gaps)
+  if include_behind and health.behind:
+    ranges.append((health.last + interval, health.last + health.behind * interval))
+  fetches = []
+  for start, end in ranges:
+    bars = (end - start) // interval + 1
+    for offset in range(0, bars, limit):
+      fetches.append((start + offset * interval, min(limit, bars - offset)))
+  return fetches
+
+def backfill_gaps(coins: dict[str, int], timeframes: list[str] | None = None, base_path: str = 'store',
+                  exchange=None, include_behind: bool = False, limit: int = 1000, max_workers: int = 8,
+                  requests_per_second: float = 10.0, max_retries: int = 3, backoff: float = 1.0) -> dict[tuple, BackfillResult]:
+  """
+  Scans `coins` (name -> asset id) and fetches exactly the missing ranges of every stored series, as
+  parallel requests under one token bucket. Series with duplicated or out-of-order bars are rewritten in
+  order first. `include_behind` also fetches everything after the last stored bar, e.g. for a coin
+  that rejoined the universe after months away. Returns a result per (coin, timeframe) that needed work.
+  """
+  store = CandleStore(base_path)
+  results: dict[tuple, BackfillResult] = {}
+  fetches = []
+  for health in scan_universe(list(coins), timeframes, base_path):
+    key = (health.coin, health.timeframe)
+    if health.duplicates or health.out_of_order:
+      repair_order(store, health.coin, health.timeframe)
+      results[key] = BackfillResult(health.coin, health.timeframe, reordered=True)
+      health = scan_series(store, health.coin, health.timeframe)
+    ranges = backfill_ranges(health, include_behind, limit)
+    if ranges:
+      results.setdefault(key, BackfillResult(health.coin, health.timeframe)).requested_bars = sum(bars for _, bars in ranges)
+      fetches.extend((health.coin, health.timeframe, since, bars) for since, bars in ranges)
+  if not fetches:
+    return results
+
+  if exchange is None:
+    from data_fetcher import create_ohlcv_exchange
+    exchange = create_ohlcv_exchange()
+  limiter = TokenBucket(requests_per_second)
+
+  def fetch_range(coin: str, timeframe: str, since: int, bars: int):
+    result = results[(coin, timeframe)]
+    for attempt in range(1, max_retries + 1):
+      limiter.acquire()
+      result.requests += 1
+      try:
+        with TRACER.span('backfill_fetch'):
+          ohlcv = exchange.fetch_ohlcv(str(coins[coin]), timeframe, since=since, limit=bars)
+        # The exchange may return bars past the range; only the requested ones are written
+        end = since + bars * timeframe_ms(timeframe)
+        return [row for row in ohlcv if since <= row[0] < end]
+      except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+        print(f'Error backfilling {coin} {timeframe} from {since} (attempt {attempt}/{max_retries}): {error}')
+        if attempt == max_retries:
+          result.errors.append(error)
+        else:
+          time.sleep(backoff * 2 ** (attempt - 1))
+    return []
+
+  with ThreadPoolExecutor(max_workers=max_workers) as pool:
+    futures = [((coin, tf), submit(pool, fetch_range, coin, tf, since, bars)) for coin, tf, since, bars in fetches]
+    fetched: dict[tuple, list] = {}
+    for key, future in futures:
+      fetched.setdefault(key, []).extend(future.result())
+
+  # One write per series, so its file is only rewritten once however many gaps it had
+  for (coin, timeframe), candles in fetched.items():
+    result = results[(coin, timeframe)]
+    if candles:
+      result.rows = store.write_candles(coin, timeframe, candles)
+    health = scan_series(store, coin, timeframe)
+    result.remaining_bars = health.missing_bars + (health.behind if include_behind else 0)
+    print(f'Backfilled {coin} {timeframe}: {result.rows}/{result.requested_bars} bars, {result.remaining_bars} still missing')
+  return results
+
+
+###### TESTING OR MANUALLY RUNNING FILE
+
+if __name__ == '__main__':
+  import json
+  with open('top_coins.json', 'r') as f:
+    top_coins: dict[str, int] = json.load(f)
+  print(health_table(scan_universe(list(top_coins))).to_string(index=False))
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from dataframe_loader import load_candles
+from utils.tracing import traced
+
+@traced('load_panel')
+def load_panel(coins: list[str], timeframe: str, column: str = 'close', base_path='store', csv_path='csv',
+               tail: int | None = None) -> pd.DataFrame:
+    """
+    Aligns one OHLCV column of every coin into a dates x coins matrix. Coins with no candles are dropped,
+    dates a coin has no bar for are NaN. With `tail`, only each coin's last `tail` bars are read.
+    """
+    series = {}
+    for coin in coins:
+        df_coin = load_candles(coin, timeframe, base_path, csv_path, tail)
+        if not df_coin.empty:
+            series[coin] = df_coin[column]
+    if not series:
+        return pd.DataFrame(dtype=float)
+    return pd.concat(series, axis=1).sort_index()
+
+def per_coin(close: pd.DataFrame, compute) -> pd.DataFrame:
+    """
+    Applies `compute` (a function of a close panel) so every coin's windows run over its own bars, like
+    in the coin's own frame, and not over the panel's rows. Only coins with a missing bar inside their
+    history need it; the others are computed on the whole panel at once, which gives the same values.
+    Dates a coin has no bar for are NaN.
+    """
+    has_bar = close.notna()
+    result = compute(close).where(has_bar)
+    inside = has_bar.cummax() & has_bar[::-1].cummax()[::-1]
+    for coin in close.columns[(inside & ~has_bar).any()]:
+        result[coin] = compute(close[[coin]].dropna())[coin].reindex(close.index)
+    return result
+
+def panel_volatility(close: pd.DataFrame, window: int = 20) -> pd.DataFrame:
+    """
+    Annualized rolling volatility of daily returns for every coin, same as `create_volatility_metrics`.
+    """
+    def volatility(close: pd.DataFrame) -> pd.DataFrame:
+        returns = close / close.shift(1) - 1
+        return returns.rolling(window).std() * np.sqrt(365)
+    return per_coin(close, volatility)
+
+def panel_signals(close: pd.DataFrame, lookback: int = 5, channel: int = 20) -> pd.DataFrame:
+    """
+    `loose_pants_trend` for every coin at once: 1 if the `lookback` high reached the `channel` high,
+    -1 if the `lookback` low reached the `channel` low, shifted one bar so it can be traded on the next close.
+    """
+    def signals(close: pd.DataFrame) -> pd.DataFrame:
+        long_signal = (close.rolling(lookback).max() >= close.rolling(channel).max()).astype(int)
+        short_signal = (close.rolling(lookback).min() <= close.rolling(channel).min()).astype(int) * -1
+        # Bars with no previous close have no signal, like the first row of a single-coin frame
+        return (long_signal + short_signal).shift(1).where(close.shift(1).notna())
+    return per_coin(close, signals)
+
+def last_valid(values: pd.DataFrame, close: pd.DataFrame) -> pd.Series:
+    """
+    Picks every coin's value on its own last bar, so coins whose history ends early are read like `iloc[-1]`.
+    """
+    has_bar = close.notna().to_numpy()
+    last_row = len(close) - 1 - np.argmax(has_bar[::-1], axis=0)
+    picked = values.to_numpy()[last_row, np.arange(values.shape[1])]
+    return pd.Series(picked, index=values.columns)[has_bar.any(axis=0)]
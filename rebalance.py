@@ -1,9 +1,19 @@
+from __future__ import annotations
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
 import pandas as pd
-from dataframe_loader import generate_df
+from forecast import forecast_weights, panel_forecast
+from dataframe_loader import trend_state_signals
+from panel import last_valid, load_panel
+from risk import DEFAULT_TARGET_VOL, load_risk_model
+from utils.tracing import traced
 from decimal import Decimal, ROUND_DOWN, getcontext
 
-from hyperliquid.exchange import Exchange
-from hyperliquid.info import Info
+if TYPE_CHECKING:
+    # Only needed for annotations; the SDK is slow to import and the caller already holds the clients
+    from hyperliquid.exchange import Exchange
+    from hyperliquid.info import Info
 
 def percent_difference(val1, val2):
     avg = (val1 + val2) / 2
@@ -12,7 +22,8 @@ def percent_difference(val1, val2):
 def round_to_sz_decimals(value: float, sz_decimals: int):
     getcontext().prec = 20
     quant = Decimal('1') / (Decimal('10') ** sz_decimals)
-    return float(Decimal(value).quantize(quant, rounding=ROUND_DOWN))
+    # From the float's shortest repr, so 4.8 (stored as 4.7999...) rounds down to 4.8 and not 4.79
+    return float(Decimal(repr(float(value))).quantize(quant, rounding=ROUND_DOWN))
 
 def generate_target_allocations(account_value: float, clipped_weights, margin_mult: float):
   # Multiply weights to account val to get position sizes
@@ -22,17 +33,33 @@ def generate_target_allocations(account_value: float, clipped_weights, margin_mu
   # convert to dict and return
   return df['position_size'].to_dict()
 
-def generate_target_weights(top_coins: list[str], timeframe: str) -> pd.DataFrame | pd.Series:
-  signal_coins = [] # List of (coin: str, inv_vol: float, is_long: bool)
-  for coin in top_coins:
-    df_coin = generate_df(coin, timeframe)
-    if df_coin.empty:
-      continue
-
-    # Get current coin inv_vol and signal
-    inv_vol = df_coin['inverse_volatility'].iloc[-1]
-    signal = df_coin['signal'].iloc[-1]
+# 'inverse_vol' sizes every coin on its own volatility; 'target_vol' then scales the whole book with the
+# EWMA covariance so correlated positions don't add up to more risk than DEFAULT_TARGET_VOL
+SIZING_MODES = ['inverse_vol', 'target_vol']
+# 'breakout' is the binary loose_pants_trend signal; 'forecast' the combined continuous forecast of forecast.py
+SIGNAL_SOURCES = ['breakout', 'forecast']
+
+@traced('generate_target_weights')
+def generate_target_weights(top_coins: list[str], timeframe: str, lookback: int = 5, base_path='store',
+                            sizing: str = 'inverse_vol', target_vol: float = DEFAULT_TARGET_VOL,
+                            signal_source: str = 'breakout') -> pd.DataFrame | pd.Series:
+  if signal_source == 'forecast':
+    # EWMAs and the expanding forecast scalars depend on the whole history, so no tail read reproduces them
+    close = load_panel(top_coins, timeframe, base_path=base_path)
+    forecast = last_valid(panel_forecast(close), close)
+    # The persisted TrendStates give the full history's inv_vol bit for bit, reading only the new bars
+    latest = trend_state_signals(top_coins, timeframe, lookback, base_path)
+    signal_coins_df = forecast_weights(forecast, latest['inv_vol']).rename_axis('coin').to_frame('clipped_weight')
+    return scale_weights(signal_coins_df, top_coins, timeframe, base_path, sizing, target_vol)
+  elif signal_source != 'breakout':
+    raise ValueError(f"Unknown signal source {signal_source!r}, expected one of {SIGNAL_SOURCES}")
+
+  # Current signal and inv_vol of every coin from its persisted TrendState; only bars stored since the
+  # last call are read from the store
+  latest = trend_state_signals(top_coins, timeframe, lookback, base_path)
 
+  signal_coins = [] # List of (coin: str, inv_vol: float, is_long: bool)
+  for coin, inv_vol, signal in zip(latest.index, latest['inv_vol'], latest['signal']):
     if signal == 1:
       signal_coins.append((coin, inv_vol, True))
     elif signal == -1:
@@ -48,68 +75,82 @@ def generate_target_weights(top_coins: list[str], timeframe: str) -> pd.DataFram
   signal_coins_df['clipped_weight'] = signal_coins_df['normalized_weight'].clip(upper=0.2)
   signal_coins_df.loc[~signal_coins_df['is_long'], 'clipped_weight'] *= -1
 
-  return signal_coins_df[['clipped_weight']]
-
-def close_position(exchange: Exchange, coin: str):
-    print(f"Closing position in {coin}...")
-    order_result = exchange.market_close(coin)
-    if order_result["status"] == "ok":
-        for status in order_result["response"]["data"]["statuses"]:
-            try:
-                filled = status["filled"]
-                print(f'Order #{filled["oid"]} filled {filled["totalSz"]} @{filled["avgPx"]}')
-            except KeyError:
-                print(f'Error: {status["error"]}')
-
-    return order_result
-
-def open_position(info: Info, exchange: Exchange, coin: str, position_usd: float):
-    is_buy = position_usd > 0
-    position_usd = abs(position_usd)
-    price = float(info.all_mids()[coin])
-    universe = info.meta()['universe']
-    sz_decimals = next(asset['szDecimals'] for asset in universe if asset['name'] == coin)
-    target_size = round_to_sz_decimals(position_usd / price, sz_decimals)
-
-    order_result = exchange.market_open(coin, is_buy, target_size)
-
-    if order_result["status"] == "ok":
-        for status in order_result["response"]["data"]["statuses"]:
-            try:
-                filled = status["filled"]
-                print(f'Order #{filled["oid"]} filled {filled["totalSz"]} @{filled["avgPx"]}')
-            except KeyError:
-                print(f'Error: {status["error"]}')
-
-    print(f"Opening {'Long' if is_buy else 'Short'} position in {coin}, target size: {target_size}")
-    return order_result
-
-def adjust_position(info: Info, exchange: Exchange, wallet_address: str, coin: str, new_position_usd: float, old_position_usd: float):
-
-    if abs(new_position_usd - old_position_usd) < 10:
-        print(f'Position size is less than 10, not sending {coin} order to market')
-        return
-    elif abs(percent_difference(new_position_usd, old_position_usd)) < 0.10:
-        print(f'Position size change is less than 10%, not sending {coin} order to market ')
-        return
-    return open_position(info, exchange, coin, new_position_usd - old_position_usd)
-
-def rebalance_portfolio(info: Info, exchange: Exchange, wallet_address: str, cur_positions: dict, target_positions: dict):
-    cur_positions = cur_positions.copy()
-    target_positions = target_positions.copy()
-
-    # First, close all positions not in target positions and remove them from cur_positions
-    only_in_cur_positions = set(cur_positions.keys()) - set(target_positions.keys())
-    for coin in only_in_cur_positions:
-        removed_suffix_coin = coin.removesuffix('-USD')
-        close_position(exchange, coin)
-        del cur_positions[coin]
-
-    # Find all the coins that increase capital when the trade is executed (so that I can buy coins later),
-    for coin, cur_position in list(cur_positions.items()):
+  return scale_weights(signal_coins_df[['clipped_weight']], top_coins, timeframe, base_path, sizing, target_vol)
+
+def scale_weights(weights_df: pd.DataFrame, top_coins: list[str], timeframe: str, base_path: str,
+                  sizing: str, target_vol: float) -> pd.DataFrame:
+  # Applies the portfolio-level sizing mode on top of the per-coin weights
+  if sizing == 'target_vol':
+    risk_model = load_risk_model(top_coins, timeframe, base_path=base_path)
+    weights_df = weights_df.assign(clipped_weight=risk_model.scale_to_target_volatility(weights_df['clipped_weight'], target_vol))
+  elif sizing != 'inverse_vol':
+    raise ValueError(f"Unknown sizing mode {sizing!r}, expected one of {SIZING_MODES}")
+  return weights_df
+
+class MarketSnapshot:
+    """
+    Mids, szDecimals and current position sizes fetched once per rebalance and indexed by coin,
+    instead of an `all_mids`/`meta` round trip for every order.
+    """
+
+    def __init__(self, mids: dict[str, float], sz_decimals: dict[str, int], position_sizes: dict[str, float] | None = None):
+        self.mids = mids
+        self.sz_decimals = sz_decimals
+        self.position_sizes = position_sizes or {}
+
+    @classmethod
+    @traced('market_snapshot')
+    def fetch(cls, info: Info, wallet_address: str | None = None) -> 'MarketSnapshot':
+        mids = {coin: float(px) for coin, px in info.all_mids().items()}
+        sz_decimals = {asset['name']: asset['szDecimals'] for asset in info.meta()['universe']}
+        position_sizes = {}
+        if wallet_address:
+            from account import parse_user_state
+            _, _, position_sizes = parse_user_state(info.user_state(wallet_address), with_sizes=True)
+        return cls(mids, sz_decimals, position_sizes)
+
+    def for_account(self, position_sizes: dict[str, float]) -> 'MarketSnapshot':
+        """The same market data with another account's position sizes, without fetching anything."""
+        return MarketSnapshot(self.mids, self.sz_decimals, position_sizes)
+
+    def has_market(self, coin: str) -> bool:
+        """Whether the snapshot can price and size orders for `coin` (a delisted coin has no mid)."""
+        return coin in self.mids and coin in self.sz_decimals
+
+    def size_for_usd(self, coin: str, position_usd: float) -> float:
+        return round_to_sz_decimals(abs(position_usd) / self.mids[coin], self.sz_decimals[coin])
+
+    def slippage_price(self, coin: str, is_buy: bool, slippage: float = 0.05) -> float:
+        # Same aggressive IoC limit price the SDK's market_open uses: 5 significant figures, 6 - szDecimals decimals
+        px = self.mids[coin] * ((1 + slippage) if is_buy else (1 - slippage))
+        return round(float(f"{px:.5g}"), 6 - self.sz_decimals[coin])
+
+@dataclass
+class OrderReport:
+    coin: str
+    phase: str
+    is_buy: bool
+    size: float
+    status: str               # 'filled', 'resting', 'error' or 'skipped'
+    filled_size: float = 0.0
+    avg_price: float | None = None
+    oid: int | None = None
+    error: str | None = None
+    latency: float = 0.0      # seconds for the batched request the order was sent in
+
+REBALANCE_PHASES = ['close', 'reduce', 'increase', 'open']
+
+def plan_rebalance(cur_positions: dict, target_positions: dict, min_trade: float = 10, band: float = 0.10) -> dict[str, list[tuple[str, float]]]:
+    """
+    Splits a rebalance into phases of (coin, usd_change) legs. Closes and reductions come first so they free
+    margin before increases and new opens. Adjustments below `min_trade` USD or `band` percent are skipped.
+    """
+    plan = {phase: [] for phase in REBALANCE_PHASES}
+    for coin, cur_position in cur_positions.items():
         removed_suffix_coin = coin.removesuffix('-USD')
         target_position = target_positions.get(coin)
         if target_position is None:
+            plan['close'].append((removed_suffix_coin, -cur_position))
             continue
 
         # Check if this is a reduction (not just smaller absolute value!)
@@ -117,31 +158,95 @@ def rebalance_portfolio(info: Info, exchange: Exchange, wallet_address: str, cur
             (cur_position > 0 and target_position < cur_position) or
             (cur_position < 0 and target_position > cur_position)
         )
+        if abs(target_position - cur_position) < min_trade:
+            print(f'Position size is less than {min_trade}, not sending {removed_suffix_coin} order to market')
+        elif abs(percent_difference(target_position, cur_position)) < band:
+            print(f'Position size change is less than {band:.0%}, not sending {removed_suffix_coin} order to market ')
+        else:
+            plan['reduce' if reducing_position else 'increase'].append((removed_suffix_coin, target_position - cur_position))
 
-        # if they reduce capital, adjust them and remove them from cur and target positions
-        if reducing_position:
-            print('REDUCING POSITION:', coin)
-            adjust_position(info, exchange, wallet_address, removed_suffix_coin, target_position, cur_position)
-            del cur_positions[coin]
-            del target_positions[coin]
-            # capital_freed = abs(cur_position) - abs(target_position)
-            # if abs(percent_difference(cur_position, target_position)) > 0.10 and capital_freed > 11:
-            #     adjustments.append(coin)
-    ####
-
-    # Go through cur_positions again but this buy adjust the ones that will lower capital, then remove them
-    for coin, cur_position in list(cur_positions.items()):
-        removed_suffix_coin = coin.removesuffix('-USD')
-        target_position = target_positions.get(coin)
-        if target_position is None:
-            continue
-        adjust_position(info, exchange,  wallet_address, removed_suffix_coin, target_position, cur_position)
-        del cur_positions[coin]
-        del target_positions[coin]
-
-    # Go through the rest of the target_weights that didn't have a position before and buy/sell them
     for coin, target_position in target_positions.items():
-        removed_suffix_coin = coin.removesuffix('-USD')
-        open_position(info, exchange, removed_suffix_coin, target_position)
-
-    return
+        if coin not in cur_positions:
+            plan['open'].append((coin.removesuffix('-USD'), target_position))
+    return plan
+
+@traced('submit_phase')
+def submit_phase(exchange: Exchange, snapshot: MarketSnapshot, phase: str, legs: list[tuple[str, float]], slippage: float = 0.05) -> list[OrderReport]:
+    """
+    Sends every leg of a phase as one `bulk_orders` request of IoC limit orders and reports each order's fill.
+    """
+    reports, sent, order_requests = [], [], []
+    for coin, position_usd in legs:
+        is_buy = position_usd > 0
+        if phase == 'close' and coin in snapshot.position_sizes:
+            size = abs(snapshot.position_sizes[coin])
+            is_buy = snapshot.position_sizes[coin] < 0
+        else:
+            size = snapshot.size_for_usd(coin, position_usd)
+        report = OrderReport(coin, phase, is_buy, size, 'skipped')
+        reports.append(report)
+        if size == 0:
+            report.error = 'Size rounds to 0'
+            continue
+        sent.append(report)
+        order_requests.append({
+            'coin': coin,
+            'is_buy': is_buy,
+            'sz': size,
+            'limit_px': snapshot.slippage_price(coin, is_buy, slippage),
+            'order_type': {'limit': {'tif': 'Ioc'}},
+            'reduce_only': phase == 'close',
+        })
+    if not order_requests:
+        return reports
+
+    start = time.perf_counter()
+    try:
+        order_result = exchange.bulk_orders(order_requests)
+    except Exception as e:
+        order_result = {'status': 'err', 'response': f'{type(e).__name__}: {e}'}
+    latency = time.perf_counter() - start
+
+    statuses = order_result['response']['data']['statuses'] if order_result['status'] == 'ok' else []
+    for i, report in enumerate(sent):
+        report.latency = latency
+        status = statuses[i] if i < len(statuses) else {'error': str(order_result.get('response'))}
+        if 'filled' in status:
+            filled = status['filled']
+            report.status, report.oid = 'filled', filled['oid']
+            report.filled_size, report.avg_price = float(filled['totalSz']), float(filled['avgPx'])
+            print(f'Order #{filled["oid"]} filled {filled["totalSz"]} @{filled["avgPx"]}')
+        elif 'resting' in status:
+            report.status, report.oid = 'resting', status['resting']['oid']
+        else:
+            report.status, report.error = 'error', status.get('error')
+            print(f'Error: {report.error}')
+    return reports
+
+def rebalance_portfolio(info: Info, exchange: Exchange, wallet_address: str, cur_positions: dict, target_positions: dict,
+                        snapshot: MarketSnapshot | None = None) -> list[OrderReport]:
+    """
+    Takes one market snapshot and submits the rebalance phase by phase (closes, reductions, increases,
+    new opens), each phase as a single batched order request. Returns a report per order.
+    A `snapshot` that already holds the account's position sizes can be passed in to skip the fetch.
+    """
+    plan = plan_rebalance(cur_positions, target_positions)
+    if not any(plan.values()):
+        return []
+    if snapshot is None:
+        snapshot = MarketSnapshot.fetch(info, wallet_address if plan['close'] else None)
+
+    # Every planned coin is checked before the first phase is sent, so a coin the snapshot can't price
+    # fails on its own instead of aborting the rebalance after the closes went out
+    reports = []
+    for phase in REBALANCE_PHASES:
+        for coin, position_usd in plan[phase]:
+            if not snapshot.has_market(coin):
+                reports.append(OrderReport(coin, phase, position_usd > 0, 0.0, 'error', error=f'No mid or szDecimals for {coin}'))
+        plan[phase] = [(coin, position_usd) for coin, position_usd in plan[phase] if snapshot.has_market(coin)]
+
+    for phase in REBALANCE_PHASES:
+        if plan[phase]:
+            print(f'{phase.upper()}: {", ".join(coin for coin, _ in plan[phase])}')
+            reports.extend(submit_phase(exchange, snapshot, phase, plan[phase]))
+    return reports
@@ -0,0 +1,270 @@
+import glob
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from candle_store import CandleStore
+from panel import load_panel
+from timeframes import bars_since, changed_since, source_generations, timeframe_ms
+from utils.tracing import traced
+
+DEFAULT_HALFLIFE = 30       # bars
+DEFAULT_TARGET_VOL = 0.5    # annualized portfolio volatility
+
+class EWMACovariance:
+    """
+    Exponentially weighted covariance of the bar returns of a coin universe, updated one bar at a time.
+
+    Each bar costs one rank-1 update of the N x N matrix instead of recomputing it over the whole history.
+    Returns are assumed zero-mean, and every pair carries its own weight normalization so coins that
+    listed late or have gaps are not biased towards zero. Pairs never observed together count as
+    uncorrelated. Like TrendState, `update` revises the last bar when called again with its timestamp.
+    """
+
+    def __init__(self, coins: list[str], halflife: float = DEFAULT_HALFLIFE, periods_per_year: float = 365):
+        self.coins = list(coins)
+        self.halflife = halflife
+        self.periods_per_year = periods_per_year
+        self.decay = 0.5 ** (1 / halflife)
+        n = len(self.coins)
+        self.weighted = np.zeros((n, n))  # decayed sum of r_i * r_j
+        self.norm = np.zeros((n, n))      # decayed sum of the weights of bars where i and j both had a return
+        self._outer = np.empty((n, n))
+        self.nobs = np.zeros(n, dtype=np.int64)
+        self.last_close = np.full(n, np.nan)
+        self.last_timestamp = None
+        self.sources = {}   # coin -> generations of the stored series folded in, set by the loader
+        self._before_last_bar = None
+
+    def _state(self) -> dict:
+        return {
+            'weighted': self.weighted.copy(), 'norm': self.norm.copy(), 'nobs': self.nobs.copy(),
+            'last_close': self.last_close.copy(), 'last_timestamp': self.last_timestamp,
+        }
+
+    def _restore(self, state: dict):
+        self.weighted, self.norm, self.nobs = state['weighted'].copy(), state['norm'].copy(), state['nobs'].copy()
+        self.last_close, self.last_timestamp = state['last_close'].copy(), state['last_timestamp']
+
+    def _apply(self, timestamp: int, closes: np.ndarray, keep_revision: bool):
+        if self.last_timestamp is not None and timestamp == self.last_timestamp:
+            self._restore(self._before_last_bar)
+        elif self.last_timestamp is not None and timestamp < self.last_timestamp:
+            raise ValueError(f"Bar at {timestamp} is older than the last bar at {self.last_timestamp}")
+        if keep_revision:
+            self._before_last_bar = self._state()
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = closes / self.last_close - 1
+        observed = np.isfinite(returns)
+        self.last_close = np.array(closes, dtype=np.float64)
+        self.last_timestamp = timestamp
+        if observed.all():
+            # In place so a bar allocates nothing of size N x N
+            scaled = returns * np.sqrt(1 - self.decay)
+            self.weighted *= self.decay
+            self.weighted += np.multiply.outer(scaled, scaled, out=self._outer)
+            self.norm *= self.decay
+            self.norm += 1 - self.decay
+        elif observed.any():
+            block = np.ix_(observed, observed)
+            r = returns[observed]
+            self.weighted[block] = self.decay * self.weighted[block] + (1 - self.decay) * np.multiply.outer(r, r)
+            self.norm[block] = self.decay * self.norm[block] + (1 - self.decay)
+        self.nobs += observed
+
+    def add_coins(self, close: pd.DataFrame):
+        """
+        Adds the coins of a dates x coins close panel the model doesn't have yet, replaying only their
+        pairs over the panel's rows up to the model's last bar. `close` must hold the model's coins too.
+        A pair's sums depend only on its own two coins' returns, so this equals a rebuild (to rounding, and
+        as long as the new coins add no dates the others all lack) at O(new x N) per bar instead of O(N^2).
+        """
+        new = [coin for coin in close.columns if coin not in self.coins]
+        if not new:
+            return
+        n_old, coins = len(self.coins), self.coins + new
+        if self.last_timestamp is not None:
+            close = close[close.index.as_unit('ms').asi8 <= self.last_timestamp]
+        else:
+            close = close.iloc[:0]
+        values = close.reindex(columns=coins).to_numpy(dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = values[1:] / values[:-1] - 1
+        observed = np.isfinite(returns)
+
+        weighted, norm = np.zeros((len(new), len(coins))), np.zeros((len(new), len(coins)))
+        before = (weighted, norm)
+        for t in range(len(returns)):
+            if t == len(returns) - 1:
+                before = (weighted.copy(), norm.copy())
+            both = observed[t, n_old:, None] & observed[t, None, :]
+            with np.errstate(invalid='ignore'):
+                update = self.decay * weighted + (1 - self.decay) * np.multiply.outer(returns[t, n_old:], returns[t])
+            weighted = np.where(both, update, weighted)
+            norm = np.where(both, self.decay * norm + (1 - self.decay), norm)
+
+        def grow(state: dict, new_weighted: np.ndarray, new_norm: np.ndarray, rows: int) -> dict:
+            # `rows` is how many panel rows the state has folded in
+            grown = dict(state)
+            for name, block in (('weighted', new_weighted), ('norm', new_norm)):
+                matrix = np.zeros((len(coins), len(coins)))
+                matrix[:n_old, :n_old] = state[name]
+                matrix[n_old:, :] = block
+                matrix[:, n_old:] = block.T
+                grown[name] = matrix
+            grown['nobs'] = np.concatenate([state['nobs'], observed[:max(rows - 1, 0), n_old:].sum(axis=0)])
+            last_close = values[rows - 1, n_old:] if rows else np.full(len(new), np.nan)
+            grown['last_close'] = np.concatenate([state['last_close'], last_close])
+            return grown
+
+        rows = len(values)
+        if self._before_last_bar is not None:
+            self._before_last_bar = grow(self._before_last_bar, *before, max(rows - 1, 0))
+        self._restore(grow(self._state(), weighted, norm, rows))
+        self.coins = coins
+        self._outer = np.empty((len(coins), len(coins)))
+
+    def remove_coins(self, coins: list[str]):
+        """Drops `coins` from the model. The pairs of the remaining coins don't depend on them."""
+        keep = np.array([coin not in set(coins) for coin in self.coins], dtype=bool)
+        if keep.all():
+            return
+        def select(state: dict) -> dict:
+            return {
+                'weighted': state['weighted'][np.ix_(keep, keep)], 'norm': state['norm'][np.ix_(keep, keep)],
+                'nobs': state['nobs'][keep], 'last_close': state['last_close'][keep], 'last_timestamp': state['last_timestamp'],
+            }
+        if self._before_last_bar is not None:
+            self._before_last_bar = select(self._before_last_bar)
+        self._restore(select(self._state()))
+        self.coins = [coin for coin, kept in zip(self.coins, keep) if kept]
+        self.sources = {coin: generations for coin, generations in self.sources.items() if coin in self.coins}
+        self._outer = np.empty((len(self.coins), len(self.coins)))
+
+    def update(self, timestamp: int, closes: np.ndarray):
+        """Folds in one bar of closes, ordered like `coins`. NaN marks a coin without a bar."""
+        self._apply(timestamp, np.asarray(closes, dtype=np.float64), keep_revision=True)
+
+    def update_panel(self, close: pd.DataFrame):
+        """
+        Folds in every row of a dates x coins close panel. Only the last row keeps a revision snapshot,
+        so replaying a long history does not copy the matrices per bar.
+        """
+        values = close.reindex(columns=self.coins).to_numpy(dtype=np.float64)
+        dates = close.index.as_unit('ms').asi8
+        for i in range(len(values)):
+            self._apply(int(dates[i]), values[i], keep_revision=i == len(values) - 1)
+
+    def _per_bar_covariance(self) -> np.ndarray:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.norm > 0, self.weighted / self.norm, 0.0)
+
+    def covariance(self) -> pd.DataFrame:
+        """Annualized covariance matrix of the coins' returns."""
+        return pd.DataFrame(self._per_bar_covariance() * self.periods_per_year, index=self.coins, columns=self.coins)
+
+    def correlation(self) -> pd.DataFrame:
+        cov = self.covariance()
+        vol = np.sqrt(np.diag(cov.to_numpy()))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return cov / np.outer(vol, vol)
+
+    def portfolio_volatility(self, weights: pd.Series) -> float:
+        """Annualized volatility of a portfolio given as coin -> weight (fraction of equity)."""
+        w = weights.reindex(self.coins, fill_value=0.0).to_numpy(dtype=np.float64)
+        return float(np.sqrt(max(w @ self._per_bar_covariance() @ w, 0.0) * self.periods_per_year))
+
+    def scale_to_target_volatility(self, weights: pd.Series, target_vol: float = DEFAULT_TARGET_VOL,
+                                   max_gross: float = 1.0) -> pd.Series:
+        """
+        Scales all weights by one factor so the portfolio's estimated volatility hits `target_vol`,
+        without the gross weight exceeding `max_gross`. A book of correlated coins is shrunk, a diversified
+        one may be levered up to the cap.
+        """
+        vol = self.portfolio_volatility(weights)
+        gross = weights.abs().sum()
+        if not vol or not gross:
+            return weights
+        return weights * min(target_vol / vol, max_gross / gross)
+
+    def save(self, path: str):
+        state = self._state()
+        if self._before_last_bar is not None:
+            state.update({f'before_{k}': v for k, v in self._before_last_bar.items()})
+        # Temp file per writer, the dashboard and the scheduler may save the same model at once
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, coins=np.array(self.coins), halflife=self.halflife, periods_per_year=self.periods_per_year,
+                     sources=np.array(json.dumps(self.sources)), **{k: np.nan if v is None else v for k, v in state.items()})
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'EWMACovariance':
+        with np.load(path) as data:
+            model = cls(data['coins'].tolist(), float(data['halflife']), float(data['periods_per_year']))
+            def timestamp(value):
+                return None if np.isnan(value) else int(value)
+            model._restore({'weighted': data['weighted'], 'norm': data['norm'], 'nobs': data['nobs'],
+                            'last_close': data['last_close'], 'last_timestamp': timestamp(data['last_timestamp'])})
+            if 'before_weighted' in data:
+                model._before_last_bar = {
+                    'weighted': data['before_weighted'], 'norm': data['before_norm'], 'nobs': data['before_nobs'],
+                    'last_close': data['before_last_close'], 'last_timestamp': timestamp(data['before_last_timestamp']),
+                }
+            if 'sources' in data:
+                model.sources = json.loads(str(data['sources']))
+        return model
+
+@traced('load_risk_model')
+def load_risk_model(coins: list[str], timeframe: str, halflife: float = DEFAULT_HALFLIFE, base_path='store') -> EWMACovariance:
+    """
+    Returns the universe's EWMA covariance, folding in only the bars stored since it was last saved.
+    The model is persisted in the store with the generations of every coin's series, and rebuilt from the
+    full history when a write since then changed a bar before its last one (a backfill). Coins that joined
+    the universe are added by replaying only their own pairs; `drop_risk_coins` removes the ones that left.
+    """
+    store = CandleStore(base_path)
+    path = os.path.join(base_path, f'risk_{timeframe}_hl{halflife:g}.npz')
+    model = EWMACovariance.load(path) if os.path.exists(path) else None
+    if model is None or model.last_timestamp is None:
+        model = EWMACovariance(coins, halflife, periods_per_year=365 * 86_400_000 / timeframe_ms(timeframe))
+    added = [coin for coin in coins if coin not in model.coins]
+    # Taken before reading, so bars written meanwhile are picked up by the next call
+    generations = {coin: source_generations(store, coin, timeframe) for coin in model.coins + added}
+
+    tail = None
+    if model.last_timestamp is not None:
+        changes = [changed_since(store, coin, timeframe, model.sources[coin]) if coin in model.sources else 0
+                   for coin in model.coins]
+        if any(changed is not None and changed < model.last_timestamp for changed in changes):
+            model = EWMACovariance(model.coins + added, halflife, model.periods_per_year)
+        else:
+            if added:
+                model.add_coins(load_panel(model.coins + added, timeframe, base_path=base_path))
+            elif all(changed is None for changed in changes):
+                return model
+            # Resume from the last bar the model has seen so a revised last candle is re-applied; only the
+            # bars since then, counted on each coin's stored rows, are read
+            tails = [bars_since(store, coin, timeframe, model.last_timestamp) for coin in model.coins]
+            tail = None if any(t is None for t in tails) else max(tails + [1])
+
+    close = load_panel(model.coins, timeframe, base_path=base_path, tail=tail)
+    if model.last_timestamp is not None:
+        close = close.iloc[int(np.searchsorted(close.index.as_unit('ms').asi8, model.last_timestamp)):]
+    model.update_panel(close)
+    model.sources = generations
+    os.makedirs(base_path, exist_ok=True)
+    model.save(path)
+    return model
+
+def drop_risk_coins(coins: list[str], base_path='store'):
+    """Removes `coins` from every risk model saved in `base_path`, e.g. when they leave the universe."""
+    for path in glob.glob(os.path.join(base_path, 'risk_*.npz')):
+        model = EWMACovariance.load(path)
+        if not set(coins).isdisjoint(model.coins):
+            model.remove_coins(coins)
+            model.save(path)
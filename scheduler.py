@@ -0,0 +1,485 @@
+"""
+Headless daily job: fetch -> compute -> rebalance, outside of Streamlit.
+
+  python scheduler.py --once            # run today's job now (resumes it if it partly ran already)
+  python scheduler.py --at 00:05        # run every day at 00:05 UTC
+  python scheduler.py --once --dry-run  # everything but sending orders
+  python scheduler.py --once --accounts accounts.json  # rebalance every account listed in accounts.json
+  python scheduler.py --once --twap 600  # execute large legs as child orders spread over 10 minutes
+
+Stages run on a thread pool as soon as their dependencies are done, each with its own retries. Every
+stage's status, timing and result is written to a SQLite results store, and a lock file keeps two jobs
+from running at once. The dashboard only reads that store: the target weights, account snapshot,
+backtest and data health scan it shows are the ones computed by the last run.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta, timezone
+from functools import cache
+from typing import Any, Callable
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from utils.tracing import TRACER, submit
+
+RESULTS_PATH = 'pipeline_results.sqlite'
+LOCK_PATH = 'pipeline.lock'
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable[[dict[str, Any]], Any]    # takes the results of `deps` by name, returns a JSON-serializable result
+    deps: list[str] = field(default_factory=list)
+    max_retries: int = 3
+    backoff: float = 5.0
+
+@dataclass
+class StageResult:
+    stage: str
+    status: str                 # 'done', 'failed' or 'skipped'
+    attempts: int = 0
+    started_at: float | None = None
+    elapsed: float = 0.0
+    error: str | None = None
+    result: Any = None
+
+class ResultsStore:
+    """
+    SQLite store of pipeline runs and the status, timing and JSON result of each of their stages.
+    """
+
+    def __init__(self, path: str = RESULTS_PATH):
+        self.path = path
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS runs (run_id TEXT PRIMARY KEY, started_at REAL, finished_at REAL, status TEXT, config TEXT)')
+            db.execute('CREATE TABLE IF NOT EXISTS stages (run_id TEXT, stage TEXT, status TEXT, attempts INTEGER, started_at REAL, '
+                       'elapsed REAL, error TEXT, result TEXT, PRIMARY KEY (run_id, stage))')
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call, so stages recording from worker threads and dashboard reads don't share one
+        return sqlite3.connect(self.path, timeout=30)
+
+    def start_run(self, run_id: str, config: dict):
+        with self._connect() as db:
+            db.execute('INSERT INTO runs (run_id, started_at, status, config) VALUES (?, ?, ?, ?) '
+                       'ON CONFLICT (run_id) DO UPDATE SET started_at = excluded.started_at, status = excluded.status, config = excluded.config',
+                       (run_id, time.time(), 'running', json.dumps(config)))
+
+    def run_config(self, run_id: str) -> dict | None:
+        with self._connect() as db:
+            row = db.execute('SELECT config FROM runs WHERE run_id = ?', (run_id,)).fetchone()
+        return json.loads(row[0] or '{}') if row is not None else None
+
+    def clear_stages(self, run_id: str):
+        with self._connect() as db:
+            db.execute('DELETE FROM stages WHERE run_id = ?', (run_id,))
+
+    def finish_run(self, run_id: str, status: str):
+        with self._connect() as db:
+            db.execute('UPDATE runs SET finished_at = ?, status = ? WHERE run_id = ?', (time.time(), status, run_id))
+
+    def record_stage(self, run_id: str, result: StageResult):
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (
+                run_id, result.stage, result.status, result.attempts, result.started_at,
+                result.elapsed, result.error, json.dumps(result.result, default=str),
+            ))
+
+    def stage_results(self, run_id: str) -> dict[str, StageResult]:
+        with self._connect() as db:
+            rows = db.execute('SELECT stage, status, attempts, started_at, elapsed, error, result FROM stages WHERE run_id = ?', (run_id,)).fetchall()
+        return {row[0]: StageResult(*row[:6], result=json.loads(row[6])) for row in rows}
+
+    def latest_run(self, status: str | None = None) -> dict | None:
+        """
+        The most recent run (optionally only one with `status`) as a dict with its stages, or None.
+        """
+        query = 'SELECT run_id, started_at, finished_at, status, config FROM runs'
+        params = ()
+        if status is not None:
+            query += ' WHERE status = ?'
+            params = (status,)
+        with self._connect() as db:
+            row = db.execute(query + ' ORDER BY started_at DESC LIMIT 1', params).fetchone()
+        if row is None:
+            return None
+        run_id, started_at, finished_at, run_status, config = row
+        return {
+            'run_id': run_id, 'started_at': started_at, 'finished_at': finished_at, 'status': run_status,
+            'config': json.loads(config or '{}'), 'stages': self.stage_results(run_id),
+        }
+
+class PipelineLocked(RuntimeError):
+    pass
+
+class PipelineLock:
+    """
+    Lock file holding the owner's pid and a token unique to this lock. A lock left by a process that no
+    longer exists, or not refreshed for `stale_after` seconds, is taken over. While held, the file's
+    mtime is refreshed every `heartbeat` seconds so a long run is never mistaken for a stale one.
+    """
+
+    def __init__(self, path: str = LOCK_PATH, stale_after: float = 6 * 3600, heartbeat: float = 60.0):
+        self.path = path
+        self.stale_after = stale_after
+        self.heartbeat = heartbeat
+        self.token = f'{os.getpid()} {uuid.uuid4().hex}'
+        self._stop = threading.Event()
+        self._heartbeat_thread = None
+
+    def _read(self, path: str) -> str | None:
+        try:
+            with open(path, 'r') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def _is_stale(self, content: str, mtime: float) -> bool:
+        if time.time() - mtime > self.stale_after:
+            return True
+        try:
+            pid = int(content.split()[0]) if content else 0
+        except ValueError:
+            return True
+        if os.name == 'posix' and pid:
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+        return False
+
+    def _take_over(self, stat: os.stat_result) -> bool:
+        # Moves the stale lock aside under a name of our own: only one contender's rename succeeds. If the
+        # file moved is no longer the one judged stale (a new owner replaced it meanwhile), it is put back.
+        aside = f'{self.path}.{uuid.uuid4().hex}.stale'
+        try:
+            os.rename(self.path, aside)
+        except FileNotFoundError:
+            return False
+        moved = os.stat(aside)
+        if (moved.st_ino, moved.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+            try:
+                os.link(aside, self.path)
+            except FileExistsError:
+                pass
+            os.remove(aside)
+            raise PipelineLocked(f'Another pipeline run holds {self.path}')
+        os.remove(aside)
+        return True
+
+    def owned(self) -> bool:
+        return self._read(self.path) == self.token
+
+    def _keep_alive(self):
+        while not self._stop.wait(self.heartbeat):
+            if self.owned():
+                os.utime(self.path)
+
+    def __enter__(self):
+        for _ in range(3):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    stat = os.stat(self.path)
+                except FileNotFoundError:
+                    continue
+                if not self._is_stale(self._read(self.path) or '', stat.st_mtime):
+                    raise PipelineLocked(f'Another pipeline run holds {self.path}')
+                self._take_over(stat)
+                continue
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.token)
+            self._stop.clear()
+            self._heartbeat_thread = threading.Thread(target=self._keep_alive, name='pipeline-lock-heartbeat', daemon=True)
+            self._heartbeat_thread.start()
+            return self
+        raise PipelineLocked(f'Could not acquire {self.path}')
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join()
+        # A lock taken over after this run was judged stale belongs to the new owner
+        if self.owned():
+            os.remove(self.path)
+        else:
+            print(f'{self.path} is held by another run, leaving it in place')
+        return False
+
+def attempt_stage(stage: Stage, inputs: dict[str, Any]) -> StageResult:
+    result = StageResult(stage.name, 'failed', started_at=time.time())
+    start = time.perf_counter()
+    for attempt in range(1, stage.max_retries + 1):
+        result.attempts = attempt
+        try:
+            result.result = stage.run(inputs)
+            result.status, result.error = 'done', None
+            break
+        except Exception as e:
+            result.error = f'{type(e).__name__}: {e}'
+            print(f'Stage {stage.name} failed (attempt {attempt}/{stage.max_retries}): {result.error}')
+            if attempt < stage.max_retries:
+                time.sleep(stage.backoff * 2 ** (attempt - 1))
+    result.elapsed = time.perf_counter() - start
+    return result
+
+def run_stages(stages: list[Stage], store: ResultsStore, run_id: str, max_workers: int = 4) -> dict[str, StageResult]:
+    """
+    Runs `stages` on a thread pool, each as soon as all of its dependencies are done. A stage whose
+    dependency failed is skipped. Stages already done for `run_id` are not run again and their stored
+    results are handed to their dependents, so rerunning a failed job only redoes what is missing.
+    """
+    results = {name: r for name, r in store.stage_results(run_id).items() if r.status == 'done'}
+    pending = [stage for stage in stages if stage.name not in results]
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for stage in list(pending):
+                dep_status = [results[dep].status if dep in results else None for dep in stage.deps]
+                if any(status in ('failed', 'skipped') for status in dep_status):
+                    pending.remove(stage)
+                    results[stage.name] = StageResult(stage.name, 'skipped', error='A dependency did not complete')
+                    store.record_stage(run_id, results[stage.name])
+                elif all(status == 'done' for status in dep_status):
+                    pending.remove(stage)
+                    inputs = {dep: results[dep].result for dep in stage.deps}
+                    running[submit(pool, attempt_stage, stage, inputs)] = stage
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                results[stage.name] = future.result()
+                store.record_stage(run_id, results[stage.name])
+                print(f'Stage {stage.name}: {results[stage.name].status} in {results[stage.name].elapsed:.1f}s')
+    for stage in pending:
+        # Depends on a stage that isn't part of the job
+        results[stage.name] = StageResult(stage.name, 'skipped', error=f'Unknown dependency in {stage.deps}')
+        store.record_stage(run_id, results[stage.name])
+    return results
+
+@dataclass
+class PipelineConfig:
+    timeframe: str = '1d'               # timeframe the signals are computed on
+    lookback: int = 5
+    signal_source: str = 'breakout'
+    sizing: str = 'inverse_vol'
+    target_vol: float = 0.5
+    margin_mult: float = 1.2
+    dry_run: bool = False               # plan the rebalance without sending orders
+    base_path: str = 'store'
+    accounts_path: str | None = None    # accounts.json to rebalance every listed account instead of WALLET_ADDRESS
+    twap_horizon: float = 0.0           # seconds to spread large legs over as sliced child orders, 0 sends each phase at once
+    initial_equity: float = 3500        # starting equity of the backtest
+    fee_rate: float = 0.0               # backtest fee on traded notional, e.g. 0.00045 for the base taker fee
+
+def daily_stages(config: PipelineConfig, get_clients: Callable[[], tuple] | None = None, ohlcv_exchange=None) -> list[Stage]:
+    """
+    The daily job: refresh the universe, fetch its candles and the account state in parallel, compute target
+    weights, plan the rebalance and execute it. `get_clients` returns (account, exchange, info) and defaults
+    to `get_account_data`; `ohlcv_exchange` is the candle source passed to `hyperliquid_update_ohlcv`.
+
+    A backtest and a data health scan of the universe run alongside for the dashboard. The rebalance stage re-reads the positions
+    right before trading, so retrying it after a partial execution only sends what is still missing
+    instead of repeating orders. With `config.accounts_path`,
+    account/plan/rebalance are replaced by one stage rebalancing every listed account (see accounts.py).
+    """
+    from account import get_account_data, parse_user_state
+    from backtest import backtest_universe
+    from integrity import health_table, scan_universe
+    from data_fetcher import hyperliquid_update_ohlcv
+    from execution import execute_rebalance
+    from rebalance import generate_target_allocations, generate_target_weights, plan_rebalance, rebalance_portfolio
+    from timeframes import BASE_TIMEFRAME
+    from universe import UniverseManager, drop_coin_state
+
+    get_clients = cache(get_clients or get_account_data)
+
+    @cache
+    def wallet_address() -> str:
+        # Read when a stage first needs it, after .env is loaded, so a missing address fails that stage
+        load_dotenv()
+        address = os.getenv('WALLET_ADDRESS', '')
+        if not address:
+            raise RuntimeError('WALLET_ADDRESS is not set')
+        return address
+
+    def account_state() -> dict:
+        address = wallet_address()
+        _, _, info = get_clients()
+        account_value, positions = parse_user_state(info.user_state(address))
+        return {'account_value': account_value, 'positions': positions}
+
+    def update_universe(inputs):
+        _, _, info = get_clients()
+        manager = UniverseManager(base_path=config.base_path)
+        # Coins that left lose their trend states and risk model rows; the ones that joined are added
+        # to the risk model pair by pair when the weights are computed, after their candles are fetched
+        manager.subscribe(lambda diff: drop_coin_state(diff, config.base_path))
+        diff = manager.update(info)
+        return {'members': diff.members, 'added': list(diff.added), 'removed': list(diff.removed)}
+
+    def fetch_candles(inputs):
+        summary = hyperliquid_update_ohlcv(
+            BASE_TIMEFRAME, base_path=config.base_path, exchange=ohlcv_exchange, top_coins=inputs['update_universe']['members']
+        )
+        if summary and all(result.status == 'failed' for result in summary.values()):
+            raise RuntimeError('Every coin failed to update')
+        return {coin: asdict(result) for coin, result in summary.items()}
+
+    def target_weights(inputs):
+        weights = generate_target_weights(
+            list(inputs['update_universe']['members']), config.timeframe, config.lookback, config.base_path,
+            sizing=config.sizing, target_vol=config.target_vol, signal_source=config.signal_source,
+        )
+        return weights['clipped_weight'].to_dict()
+
+    def backtest(inputs):
+        result = backtest_universe(
+            list(inputs['update_universe']['members']), config.timeframe, config.base_path,
+            lookback=config.lookback, margin_mult=config.margin_mult, initial_equity=config.initial_equity,
+            fee_rate=config.fee_rate,
+        )
+        return {
+            'summary': result.summary,
+            'equity': json.loads(result.equity.to_json(orient='split')),  # dates as epoch ms
+            'attribution': result.attribution.to_dict(),
+        }
+
+    def data_health(inputs):
+        health = health_table(scan_universe(list(inputs['update_universe']['members']), base_path=config.base_path))
+        return json.loads(health.to_json(orient='records'))  # first/last bars as epoch ms
+
+    def plan(inputs):
+        account = inputs['account']
+        weights = pd.DataFrame({'clipped_weight': pd.Series(inputs['target_weights'], dtype=float)})
+        target_allocations = generate_target_allocations(account['account_value'], weights, config.margin_mult)
+        return {'target_allocations': target_allocations, 'plan': plan_rebalance(account['positions'], target_allocations)}
+
+    def rebalance(inputs):
+        if config.dry_run:
+            return {'orders': [], 'dry_run': True}
+        _, exchange, info = get_clients()
+        positions = account_state()['positions']
+        target_allocations = inputs['plan']['target_allocations']
+        if config.twap_horizon > 0:
+            legs = execute_rebalance(info, exchange, wallet_address(), positions, target_allocations, horizon=config.twap_horizon)
+            orders = [leg.stats() for leg in legs]
+        else:
+            orders = [asdict(report) for report in rebalance_portfolio(info, exchange, wallet_address(), positions, target_allocations)]
+        return {'orders': orders, 'account_after': account_state()}
+
+    accounts_done = {} # results of the accounts an earlier attempt of rebalance_accounts completed
+
+    def rebalance_all(inputs):
+        from accounts import load_account_configs, rebalance_accounts
+        _, _, info = get_clients()
+        weights = pd.DataFrame({'clipped_weight': pd.Series(inputs['target_weights'], dtype=float)})
+        configs = load_account_configs(config.accounts_path)
+        # A retry only rebalances the accounts that failed, re-planned from their fresh positions
+        results = rebalance_accounts([account for account in configs if account.name not in accounts_done], weights, info,
+                                     execute=not config.dry_run, twap_horizon=config.twap_horizon)
+        accounts_done.update({name: asdict(result) for name, result in results.items() if result.status != 'failed'})
+        failed = [name for name, result in results.items() if result.status == 'failed']
+        if failed:
+            raise RuntimeError(f"Accounts failed: {', '.join(failed)}")
+        return {account.name: accounts_done[account.name] for account in configs}
+
+    stages = [
+        Stage('update_universe', update_universe),
+        Stage('fetch_candles', fetch_candles, deps=['update_universe']),
+        Stage('target_weights', target_weights, deps=['update_universe', 'fetch_candles']),
+        Stage('backtest', backtest, deps=['update_universe', 'fetch_candles'], max_retries=1),
+        Stage('data_health', data_health, deps=['update_universe', 'fetch_candles'], max_retries=1),
+    ]
+    if config.accounts_path:
+        return stages + [Stage('rebalance_accounts', rebalance_all, deps=['target_weights'], max_retries=2)]
+    return stages + [
+        Stage('account', lambda inputs: account_state()),
+        Stage('plan', plan, deps=['target_weights', 'account']),
+        # Orders are not blindly resent on failure; a retry re-plans from fresh positions
+        Stage('rebalance', rebalance, deps=['plan'], max_retries=2),
+    ]
+
+def run_job(run_id: str, config: PipelineConfig, results_path: str = RESULTS_PATH, lock_path: str = LOCK_PATH,
+            stages: list[Stage] | None = None) -> dict[str, StageResult]:
+    """
+    Runs one job under the lock and records it as `run_id`, e.g. the date of a daily run. Rerunning a
+    `run_id` resumes it only with the same config; with another one every stage runs again.
+    """
+    store = ResultsStore(results_path)
+    # Its own trace run, so the stage totals printed below are this job's even next to a dashboard
+    trace = TRACER.start_run()
+    with PipelineLock(lock_path):
+        previous = store.run_config(run_id)
+        if previous is not None and previous != json.loads(json.dumps(asdict(config))):
+            # Its stages were computed with other settings, so none of them can be resumed
+            print(f'Run {run_id} was started with another config, rerunning every stage')
+            store.clear_stages(run_id)
+        store.start_run(run_id, asdict(config))
+        results = run_stages(stages if stages is not None else daily_stages(config), store, run_id)
+        status = 'done' if all(r.status == 'done' for r in results.values()) else 'failed'
+        store.finish_run(run_id, status)
+    print(f'Run {run_id}: {status}')
+    for row in TRACER.slowest(run=trace):
+        print(f"  {row['stage']}: {row['calls']} calls, {row['total_ms']:.0f}ms")
+    return results
+
+def seconds_until(at: str, now: datetime | None = None) -> float:
+    """Seconds until the next HH:MM UTC."""
+    now = now or datetime.now(timezone.utc)
+    hour, minute = map(int, at.split(':'))
+    next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+###### TESTING OR MANUALLY RUNNING FILE
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--once', action='store_true', help='run one job now and exit')
+    parser.add_argument('--at', default='00:05', help='daily run time, HH:MM UTC')
+    parser.add_argument('--run-id', help='defaults to the UTC date, so a rerun the same day resumes that run')
+    parser.add_argument('--dry-run', action='store_true', help='plan the rebalance without sending orders')
+    parser.add_argument('--timeframe', default='1d')
+    parser.add_argument('--signal-source', default='breakout')
+    parser.add_argument('--sizing', default='inverse_vol')
+    parser.add_argument('--target-vol', type=float, default=0.5, help='annualized target with --sizing target_vol')
+    parser.add_argument('--lookback', type=int, default=5)
+    parser.add_argument('--margin-mult', type=float, default=1.2)
+    parser.add_argument('--results', default=RESULTS_PATH)
+    parser.add_argument('--accounts', help='accounts.json listing the accounts to rebalance, see accounts.py')
+    parser.add_argument('--twap', type=float, default=0.0, metavar='SECONDS', help='slice large legs over this many seconds')
+    parser.add_argument('--fee-rate', type=float, default=0.0, help='backtest fee on traded notional, e.g. 0.00045')
+    args = parser.parse_args()
+    config = PipelineConfig(timeframe=args.timeframe, signal_source=args.signal_source, sizing=args.sizing,
+                            target_vol=args.target_vol, lookback=args.lookback, margin_mult=args.margin_mult,
+                            dry_run=args.dry_run, accounts_path=args.accounts, twap_horizon=args.twap,
+                            fee_rate=args.fee_rate)
+
+    while True:
+        if not args.once:
+            wait_s = seconds_until(args.at)
+            print(f'Next run in {wait_s / 3600:.1f}h')
+            time.sleep(wait_s)
+        # A dry run gets its own id so it never marks the day's real rebalance as done
+        run_id = args.run_id or datetime.now(timezone.utc).strftime('%Y-%m-%d') + ('-dry' if args.dry_run else '')
+        try:
+            run_job(run_id, config, args.results)
+        except PipelineLocked as e:
+            print(e)
+        if args.once:
+            break
@@ -1,16 +1,31 @@
 import pandas as pd
-# import numpy as np
+
 from utils.indicators import twenty_day_high_within_lookback, twenty_day_low_within_lookback
+from utils.incremental_indicators import TrendState
+from utils.tracing import traced
 
 # Must return a df with a col called signal in my framework !!
-def loose_pants_trend(df: pd.DataFrame, lookback: int = 5) -> pd.DataFrame:
+@traced('loose_pants_trend')
+def loose_pants_trend(df: pd.DataFrame, lookback: int = 5, backend: str = 'pandas') -> pd.DataFrame:
     """
     Strategy: Enter position when close is highest in `lookback` period.
     Must return a DataFrame with a 'signal' column.
+    `backend='incremental'` replays the bars through a fresh TrendState instead of pandas rolling windows,
+    a check that the incremental rule matches; it is O(n) per call. The live path keeps each coin's state
+    on disk instead and only folds in new bars, see `dataframe_loader.load_trend_state`.
     """
 
     df = df.copy()
 
+    if backend == 'incremental':
+        state = TrendState(lookback=lookback)
+        signals = []
+        for i, close in enumerate(df['close'].to_numpy()):
+            state.update(i, close)
+            signals.append(state.signal)
+        df['signal'] = pd.Series(signals, index=df.index, dtype=float)
+        return df
+
     # Compute 20 day high signals
     long_signal = twenty_day_high_within_lookback(df, lookback)
     short_signal = twenty_day_low_within_lookback(df, lookback)
@@ -18,18 +33,3 @@ def loose_pants_trend(df: pd.DataFrame, lookback: int = 5) -> pd.DataFrame:
 
     return df
 
-
-
-    # # Step 3: Compute log returns and EW volatility
-    # df['log_return'] = np.log(df['close'] / df['close'].shift(1))
-    # df['recent_volatility'] = df['log_return'].ewm(span=recent_sd_daily_returns, adjust=False).std()
-
-    # # Step 4: Volatility-standardize
-    # df['volatility_standardized_forecast'] = df['raw_forecast'] / df['recent_volatility']
-
-    # # Step 5: Forecast scalar to target E[|x|] = 10
-    # forecast_scalar = 10 / df['volatility_standardized_forecast'].abs().mean()
-    # df['volatility_standardized_forecast'] *= forecast_scalar
-
-    # # # Step 6: Clip extreme values
-    # df['volatility_standardized_forecast'] = np.clip(df['volatility_standardized_forecast'], -20, 20)
@@ -0,0 +1,114 @@
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from backtest import run_backtest
+from panel import load_panel
+
+# Parameters of run_backtest a sweep can vary, with today's fixed values
+DEFAULT_GRID = {
+    'lookback': [5],
+    'channel': [20],
+    'vol_window': [20],
+    'clip': [0.2],
+}
+
+# Set in each worker by _attach_close: the price panel backed by the parent's shared memory
+_worker_close: pd.DataFrame | None = None
+_worker_shm: shared_memory.SharedMemory | None = None
+
+def _attach_close(shm_name: str, shape: tuple, index: np.ndarray, columns: list[str]):
+    global _worker_close, _worker_shm
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    values = np.ndarray(shape, dtype=np.float64, buffer=_worker_shm.buf)
+    values.flags.writeable = False
+    _worker_close = pd.DataFrame(values, index=pd.DatetimeIndex(index, name='date'), columns=columns, copy=False)
+
+def _run_params(params: dict, backtest_kwargs: dict) -> dict:
+    result = run_backtest(_worker_close, **params, **backtest_kwargs)
+    return {**params, **result.summary}
+
+def parameter_grid(grid: dict[str, list]) -> list[dict]:
+    """
+    Expands {'lookback': [3, 5], ...} into every combination, filling unswept parameters from DEFAULT_GRID.
+    """
+    grid = {**DEFAULT_GRID, **grid}
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+def sweep_key(close: pd.DataFrame, backtest_kwargs: dict) -> str:
+    """
+    Short hash of what a sweep's results depend on besides the swept parameters: the fixed backtest
+    kwargs, the universe and the panel's shape and date range.
+    """
+    config = {
+        'backtest_kwargs': backtest_kwargs,
+        'coins': list(map(str, close.columns)),
+        'shape': list(close.shape),
+        'dates': [str(close.index[0]), str(close.index[-1])] if len(close) else [],
+    }
+    return hashlib.sha1(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+def run_sweep(close: pd.DataFrame, grid: dict[str, list], results_path: str = 'sweep_results.csv',
+              rank_by: list[str] | None = None, ascending: bool | list[bool] = False,
+              max_workers: int | None = None, **backtest_kwargs) -> pd.DataFrame:
+    """
+    Backtests every parameter combination in `grid` on a process pool and returns the results ranked by `rank_by`.
+
+    The close panel is copied once into shared memory that every worker maps read-only, so no frames are
+    pickled per task. Each finished combination is appended straight away to a results file per configuration,
+    `results_path` suffixed with its `sweep_key` (e.g. sweep_results_1a2b3c4d5e6f.csv), and combinations already
+    in that file are skipped, so an interrupted sweep resumes where it stopped. Another universe, date range or
+    fixed backtest kwargs write to another file instead of reusing results computed for them.
+    """
+    root, ext = os.path.splitext(results_path)
+    results_path = f'{root}_{sweep_key(close, backtest_kwargs)}{ext}'
+    combos = parameter_grid(grid)
+    param_names = list(combos[0])
+    done = pd.read_csv(results_path) if os.path.exists(results_path) else pd.DataFrame(columns=param_names)
+    done_keys = set(done[param_names].itertuples(index=False, name=None))
+    todo = [params for params in combos if tuple(params.values()) not in done_keys]
+    print(f'Sweep: {len(combos)} combinations, {len(combos) - len(todo)} already done in {results_path}')
+
+    if todo:
+        values = np.ascontiguousarray(close.to_numpy(dtype=np.float64))
+        shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+        try:
+            np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)[:] = values
+            init_args = (shm.name, values.shape, close.index.to_numpy(), list(close.columns))
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_attach_close, initargs=init_args) as pool:
+                futures = [pool.submit(_run_params, params, backtest_kwargs) for params in todo]
+                for i, future in enumerate(as_completed(futures), 1):
+                    row = pd.DataFrame([future.result()])
+                    row.to_csv(results_path, mode='a', header=not os.path.exists(results_path), index=False)
+                    print(f'Sweep: {i}/{len(todo)} done')
+        finally:
+            shm.close()
+            shm.unlink()
+
+    results = pd.read_csv(results_path).merge(pd.DataFrame(combos), on=param_names)
+    return results.sort_values(rank_by or ['sharpe'], ascending=ascending).reset_index(drop=True)
+
+def sweep_universe(top_coins: list[str], grid: dict[str, list], timeframe: str = '1d', base_path='store', **kwargs) -> pd.DataFrame:
+    return run_sweep(load_panel(top_coins, timeframe, base_path=base_path), grid, **kwargs)
+
+
+###### TESTING OR MANUALLY RUNNING FILE
+
+if __name__ == '__main__':
+    import json
+    with open('top_coins.json', 'r') as f:
+        top_coins: dict[str, int] = json.load(f)
+    ranked = sweep_universe(list(top_coins), {
+        'lookback': [3, 5, 7, 10],
+        'channel': [10, 20, 40, 60],
+        'vol_window': [10, 20, 40],
+        'clip': [0.1, 0.2, 0.3],
+    })
+    print(ranked.head(20).to_string())
@@ -0,0 +1,38 @@
+import threading
+import time
+
+import pytest
+
+from account import AccountService
+
+def user_state(value: float) -> dict:
+    return {'marginSummary': {'accountValue': str(value)}, 'assetPositions': []}
+
+def test_stale_snapshot_triggers_a_single_background_refresh():
+    calls = []
+    release = threading.Event()
+
+    def fetch(address):
+        calls.append(address)
+        if len(calls) > 1:
+            release.wait(5)
+        return user_state(100.0 * len(calls))
+
+    service = AccountService(None, None, None, '0xwallet', ttl=0.0, fetch_user_state=fetch)
+    assert service.snapshot().account_value == 100.0
+    # Concurrent stale reads keep serving the cached snapshot while one refresh runs
+    threads = [threading.Thread(target=service.snapshot) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    release.set()
+    deadline = time.monotonic() + 5
+    while service._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(calls) == 2
+    assert service.snapshot().account_value == 200.0
+
+def test_service_without_info_or_fetcher_fails_early():
+    with pytest.raises(ValueError, match='Info client'):
+        AccountService(None, None, None, '0xwallet')
@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+from account import parse_user_state
+from accounts import AccountConfig, rebalance_accounts
+from benchmarks.synthetic import FakeExchange, FakeInfo
+
+WEIGHTS = pd.DataFrame({'clipped_weight': {'AAA': 0.2, 'BBB': -0.1}})
+
+def test_fake_info_serves_each_wallets_state():
+    info = FakeInfo(['AAA', 'BBB'], positions={'AAA': 500.0}, accounts={'0x2': (2500.0, {'BBB': -300.0})})
+    assert parse_user_state(info.user_state('0x1'), with_sizes=True) == (100000.0, {'AAA': 500.0}, {'AAA': 5.0})
+    assert parse_user_state(info.user_state('0x2'), with_sizes=True) == (2500.0, {'BBB': -300.0}, {'BBB': -3.0})
+
+def test_each_account_is_sized_to_its_own_equity_and_failures_are_isolated():
+    info = FakeInfo(['AAA', 'BBB'], accounts={'0x1': (10000.0, {}), '0x2': (2500.0, {'BBB': -300.0}), '0x3': (5000.0, {})})
+    accounts = [AccountConfig('main', '0x1'), AccountConfig('small', '0x2', margin_mult=1.0), AccountConfig('broken', '0x3')]
+
+    def exchange_factory(config):
+        if config.name == 'broken':
+            raise KeyError(config.private_key_env)
+        return FakeExchange()
+
+    results = rebalance_accounts(accounts, WEIGHTS, info, exchange_factory)
+    assert list(results) == ['main', 'small', 'broken']
+    assert results['main'].status == 'done'
+    assert results['main'].target_allocations == pytest.approx({'AAA': 2400.0, 'BBB': -1200.0})
+    assert results['small'].status == 'done'
+    assert results['small'].target_allocations == pytest.approx({'AAA': 500.0, 'BBB': -250.0})
+    assert results['small'].plan['reduce'] == [('BBB', pytest.approx(50.0))]
+    assert results['broken'].status == 'failed' and 'KeyError' in results['broken'].error
+    # The broken account still got its plan; only sending it failed
+    assert results['broken'].plan['open'] == [('AAA', pytest.approx(1200.0)), ('BBB', pytest.approx(-600.0))]
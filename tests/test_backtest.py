@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest import run_backtest
+from benchmarks.synthetic import synthetic_ohlcv
+
+def test_fees_are_opt_in_and_charged_on_traded_notional():
+    close = pd.concat({f'C{i}': synthetic_ohlcv(300, seed=i)['close'] for i in range(4)}, axis=1)
+    free, charged = run_backtest(close), run_backtest(close, fee_rate=0.001)
+    pd.testing.assert_frame_equal(free.equity, run_backtest(close, fee_rate=0.0).equity)
+    assert charged.equity['equity'].iloc[-1] < free.equity['equity'].iloc[-1]
+    # The first trades are sized before any fee was paid, so their fee is exactly 10bps of the turnover
+    first = np.flatnonzero(free.equity['turnover'].to_numpy())[0]
+    traded = free.equity['turnover'].iloc[first] * free.equity['equity'].iloc[first]
+    assert charged.equity['equity'].iloc[first + 1] == pytest.approx(free.equity['equity'].iloc[first + 1] - traded * 0.001)
+
+def test_positions_are_carried_through_a_data_gap_and_closed_when_history_ends():
+    close = pd.concat({f'C{i}': synthetic_ohlcv(300, seed=i)['close'] for i in range(4)}, axis=1)
+    held = run_backtest(close).positions['C0']
+    gap = int(np.flatnonzero(held.to_numpy()[:240])[-1])
+    close.iloc[gap + 1:gap + 4, 0] = np.nan
+    close.iloc[250:, 1] = np.nan
+
+    result = run_backtest(close)
+    carried = result.positions['C0'].iloc[gap]
+    assert carried != 0
+    assert (result.positions['C0'].iloc[gap + 1:gap + 4] == carried).all()
+    assert (result.pnl['C0'].iloc[gap + 1:gap + 4] == 0).all()
+    assert result.pnl['C0'].iloc[gap + 4] == pytest.approx(carried * (close['C0'].iloc[gap + 4] / close['C0'].iloc[gap] - 1))
+    assert (result.positions['C1'].iloc[250:] == 0).all() and (result.pnl['C1'].iloc[250:] == 0).all()
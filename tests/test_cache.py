@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_ohlcv
+from cache import DATA_CACHE, LRUCache, cached_generate_df, estimate_size, invalidate_coins
+from candle_store import PRICE_COLUMNS, CandleStore
+
+def test_lru_evicts_the_least_recently_used_entries_past_its_memory_bound():
+    frames = {key: pd.DataFrame({'x': np.zeros(1000)}) for key in 'abcd'}
+    cache = LRUCache(max_bytes=3 * estimate_size(frames['a']))
+    for key in 'abc':
+        cache.put(key, frames[key])
+    assert cache.get_or_compute('a', lambda: None) is frames['a']
+    cache.put('d', frames['d'])
+    assert list(cache.entries) == ['c', 'a', 'd']
+    assert cache.stats()['evictions'] == 1 and cache.total_bytes <= cache.max_bytes
+    # A value larger than the whole cache is returned but not kept
+    huge = pd.DataFrame({'x': np.zeros(10_000)})
+    assert cache.get_or_compute('huge', lambda: huge) is huge
+    assert 'huge' not in cache.entries and cache.stats()['hits'] == 1
+
+def test_generate_df_is_recomputed_after_a_write_and_freed_by_coin(tmp_path):
+    base_path = str(tmp_path / 'store')
+    store = CandleStore(base_path)
+    df = synthetic_ohlcv(120, seed=4)
+    for coin in ['AAA', 'BBB']:
+        store.replace(coin, '1d', df.iloc[:100])
+    DATA_CACHE.invalidate()
+
+    first = cached_generate_df('AAA', '1d', base_path)
+    assert cached_generate_df('AAA', '1d', base_path) is first
+    new = df.iloc[100:]
+    store.write_candles('AAA', '1d', np.column_stack([new.index.as_unit('ms').asi8, new[PRICE_COLUMNS].to_numpy()]))
+    updated = cached_generate_df('AAA', '1d', base_path)
+    assert len(updated) == 120 and len(first) == 100
+
+    cached_generate_df('BBB', '1d', base_path)
+    invalidate_coins(['AAA'])
+    assert [key[1] for key in DATA_CACHE.entries] == ['BBB']
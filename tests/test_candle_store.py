@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_ohlcv
+from candle_store import PRICE_COLUMNS, CandleStore, migrate_csv_dir
+
+def candle_rows(df: pd.DataFrame) -> np.ndarray:
+    return np.column_stack([df.index.as_unit('ms').asi8, df[PRICE_COLUMNS].to_numpy()])
+
+def test_writes_upsert_bars_and_record_the_oldest_change(tmp_path):
+    df = synthetic_ohlcv(100, seed=1)
+    store = CandleStore(str(tmp_path))
+    # Out of order, with a duplicated bar whose last occurrence wins
+    rows = candle_rows(df.iloc[:60])[::-1]
+    stale = rows[:1].copy()
+    stale[0, 1:] = 0.0
+    assert store.write_candles('AAA', '1d', np.vstack([stale, rows])) == 60
+    pd.testing.assert_frame_equal(store.load_df('AAA', '1d'), df.iloc[:60], check_freq=False)
+    generation = store.generation('AAA', '1d')
+
+    # Revise the last bar and append new ones: bars before the revision are untouched
+    revised = df.iloc[59:80].copy()
+    revised['close'] *= 1.1
+    store.write_candles('AAA', '1d', candle_rows(revised))
+    assert store.length('AAA', '1d') == 80
+    assert store.changed_from('AAA', '1d') == df.index.as_unit('ms').asi8[59]
+    assert store.load_df('AAA', '1d', tail=21)['close'].tolist() == revised['close'].tolist()
+    assert store.last_timestamp('AAA', '1d') == df.index.as_unit('ms').asi8[79]
+
+    # A bar filling a hole rewrites the series, after which any bar may have changed
+    holed = df.drop(df.index[90])
+    store.write_candles('AAA', '1d', candle_rows(holed.iloc[80:]))
+    assert store.oldest_change_since('AAA', '1d', generation) == df.index.as_unit('ms').asi8[59]
+    store.write_candles('AAA', '1d', candle_rows(df.iloc[[90]]))
+    assert store.length('AAA', '1d') == 100
+    assert store.oldest_change_since('AAA', '1d', generation) is None
+    assert store.load_df('AAA', '1d').index.equals(df.index)
+
+def test_csv_migration_round_trips(tmp_path):
+    csv_path = tmp_path / 'csv'
+    csv_path.mkdir()
+    df = synthetic_ohlcv(50, seed=2)
+    df.to_csv(csv_path / 'AAA_1d.csv')
+    assert migrate_csv_dir(str(csv_path), str(tmp_path / 'store')) == ['AAA_1d.csv']
+    store = CandleStore(str(tmp_path / 'store'))
+    pd.testing.assert_frame_equal(store.load_df('AAA', '1d'), df[PRICE_COLUMNS], check_freq=False)
+    assert store.version('AAA', '1d')[1] == 1 and store.version('BBB', '1d') is None
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_ohlcv
+from charts import downsample_ohlc
+
+def test_downsample_aggregates_candles_and_keeps_the_last_signal():
+    df = synthetic_ohlcv(1000, seed=3)
+    df['signal'] = 0
+    df.iloc[[5, 7], df.columns.get_loc('signal')] = [1, -1]
+    df.iloc[12, df.columns.get_loc('signal')] = 1
+
+    out = downsample_ohlc(df, max_bars=100)
+    assert len(out) == 100
+    first = df.iloc[:10]
+    assert out.index[0] == first.index[0]
+    assert out.iloc[0][['open', 'high', 'low', 'close']].tolist() == [
+        first['open'].iloc[0], first['high'].max(), first['low'].min(), first['close'].iloc[-1]]
+    assert out['high'].max() == df['high'].max() and out['low'].min() == df['low'].min()
+    # Both markers of the first bucket survive; the second bucket only bought
+    assert out['buy_close'].iloc[0] == df['close'].iloc[5] and out['sell_close'].iloc[0] == df['close'].iloc[7]
+    assert out['buy_close'].iloc[1] == df['close'].iloc[12] and np.isnan(out['sell_close'].iloc[1])
+    assert out['buy_close'].iloc[2:].isna().all() and (out['signal'].iloc[2:] == 0).all()
+
+    short = downsample_ohlc(df.iloc[:50], max_bars=100)
+    pd.testing.assert_frame_equal(short[['open', 'high', 'low', 'close']], df.iloc[:50][['open', 'high', 'low', 'close']])
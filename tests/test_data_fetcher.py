@@ -0,0 +1,29 @@
+from benchmarks.synthetic import FakeOHLCVExchange, synthetic_ohlcv
+from candle_store import CandleStore
+from data_fetcher import hyperliquid_update_ohlcv
+
+class FlakyExchange(FakeOHLCVExchange):
+    """Fails every request for BBB."""
+
+    def fetch_ohlcv(self, symbol, timeframe, since=None, limit=None):
+        if symbol == 'BBB':
+            raise ConnectionError('timed out')
+        return super().fetch_ohlcv(symbol, timeframe, since, limit)
+
+def test_update_appends_new_bars_and_isolates_failing_coins(tmp_path):
+    base_path = str(tmp_path / 'store')
+    store = CandleStore(base_path)
+    for coin in ['AAA', 'BBB']:
+        store.replace(coin, '1d', synthetic_ohlcv(10, seed=1))
+    last = store.last_timestamp('AAA', '1d')
+
+    summary = hyperliquid_update_ohlcv('1d', base_path=base_path, csv_path=str(tmp_path / 'csv'), exchange=FlakyExchange(new_bars=3),
+                                       top_coins={'AAA': 'AAA', 'BBB': 'BBB'}, max_retries=2, backoff=0)
+    assert summary['AAA'].status == 'updated' and summary['AAA'].rows == 3
+    # The last stored bar is revised in place and two bars are appended
+    assert store.length('AAA', '1d') == 12
+    assert store.load_df('AAA', '1d').loc[:, 'close'].iloc[-3:].tolist() == [100.5] * 3
+    assert store.last_timestamp('AAA', '1d') == last + 2 * 86_400_000
+    assert summary['BBB'].status == 'failed' and summary['BBB'].attempts == 2
+    assert 'timed out' in summary['BBB'].error
+    assert store.length('BBB', '1d') == 10
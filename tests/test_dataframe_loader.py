@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import synthetic_ohlcv
+from candle_store import PRICE_COLUMNS, CandleStore
+from dataframe_loader import generate_df, load_candles, load_trend_state
+from utils.incremental_indicators import TrendState
+
+def candle_rows(df: pd.DataFrame) -> np.ndarray:
+    return np.column_stack([df.index.as_unit('ms').asi8, df[PRICE_COLUMNS].to_numpy()])
+
+def rebuilt(store: CandleStore) -> dict:
+    state = TrendState()
+    df = store.load_df('AAA', '1d')
+    for timestamp, close in zip(df.index.as_unit('ms').asi8.tolist(), df['close'].tolist()):
+        state.update(timestamp, close)
+    return state.to_dict(include_revision=False)
+
+@pytest.fixture
+def paths(tmp_path) -> dict:
+    return {'base_path': str(tmp_path / 'store'), 'csv_path': str(tmp_path / 'csv')}
+
+def test_trend_state_follows_appends_revisions_and_backfills(paths):
+    df = synthetic_ohlcv(260, seed=2)
+    store = CandleStore(paths['base_path'])
+    store.replace('AAA', '1d', df.iloc[:200])
+    assert load_trend_state('AAA', '1d', **paths).to_dict(include_revision=False) == rebuilt(store)
+
+    # New bars, plus a revision of the last stored one, are folded into the saved state
+    revised = df.iloc[199:230].copy()
+    revised.iloc[0, revised.columns.get_loc('close')] *= 1.05
+    store.write_candles('AAA', '1d', candle_rows(revised))
+    state = load_trend_state('AAA', '1d', **paths)
+    assert state.count == 230
+    assert state.to_dict(include_revision=False) == rebuilt(store)
+
+    # Nothing written: the saved state is returned as is
+    assert load_trend_state('AAA', '1d', **paths).to_dict() == state.to_dict()
+
+    # Rewriting a bar before the last one forces a rebuild
+    backfill = df.iloc[[220]].copy()
+    backfill['close'] *= 2
+    store.write_candles('AAA', '1d', candle_rows(backfill))
+    backfilled = load_trend_state('AAA', '1d', **paths)
+    assert backfilled.volatility != state.volatility
+    assert backfilled.to_dict(include_revision=False) == rebuilt(store)
+
+@pytest.mark.parametrize('timeframe', ['1d', '1w'])
+def test_tail_equals_the_end_of_the_full_history(paths, timeframe):
+    CandleStore(paths['base_path']).replace('AAA', '1d', synthetic_ohlcv(300, seed=1))
+    full = load_candles('AAA', timeframe, **paths)
+    pd.testing.assert_frame_equal(load_candles('AAA', timeframe, tail=7, **paths), full.iloc[-7:], check_freq=False)
+
+@pytest.mark.parametrize('tail', [1, 21, 150, 1000])
+def test_generate_df_tail_matches_the_full_history(paths, tail):
+    CandleStore(paths['base_path']).replace('AAA', '1d', synthetic_ohlcv(300, seed=3))
+    full = generate_df('AAA', '1d', **paths).iloc[-tail:]
+    tailed = generate_df('AAA', '1d', tail=tail, **paths)
+    pd.testing.assert_index_equal(tailed.index, full.index)
+    pd.testing.assert_series_equal(tailed['signal'], full['signal'], check_exact=True)
+    np.testing.assert_allclose(tailed['volatility'], full['volatility'], rtol=1e-12)
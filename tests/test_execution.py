@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+
+from accounts import AccountConfig, rebalance_accounts
+from benchmarks.synthetic import SimulatedMarket
+from execution import LegExecution, TWAPExecutor, execute_rebalance
+from rebalance import MarketSnapshot, plan_rebalance
+
+class RecordingMarket(SimulatedMarket):
+    """SimulatedMarket that logs every order and can fill only part of the first `partial_orders` ones."""
+
+    def __init__(self, *args, partial_orders: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.partial_orders = partial_orders
+        self.orders = []
+
+    def order(self, name, is_buy, sz, limit_px, order_type=None, reduce_only=False, cloid=None, builder=None):
+        self.orders.append({'coin': name, 'is_buy': is_buy, 'size': sz, 'reduce_only': reduce_only, 'time': time.monotonic()})
+        if len(self.orders) <= self.partial_orders:
+            sz = round(sz / 2, self.sz_decimals)
+        return super().order(name, is_buy, sz, limit_px, order_type, reduce_only)
+
+def quiet_market(coins, **kwargs) -> RecordingMarket:
+    # No random walk and deep books, so every fill is deterministic
+    return RecordingMarket(coins, vol_bps=0.0, depth_usd=1e9, **kwargs)
+
+def test_partial_fill_rolls_into_later_children():
+    market = quiet_market(['AAA'], partial_orders=1)
+    legs = execute_rebalance(market, market, '', {}, {'AAA': 3000.0}, horizon=0.3, max_slices=3, child_usd=1000,
+                             requests_per_second=100)
+    leg, = legs
+    assert leg.status == 'filled'
+    assert leg.filled_size == pytest.approx(leg.target_size)
+    assert [child.size for child in leg.children] == [10.0, 12.5, 12.5]
+    assert market.positions['AAA'] == pytest.approx(30.0)
+
+def test_close_orders_are_reduce_only_and_end_flat():
+    market = quiet_market(['AAA', 'BBB'], positions={'AAA': 2500.0, 'BBB': -1500.0})
+    legs = execute_rebalance(market, market, '0xwallet', {'AAA': 2500.0, 'BBB': -1500.0}, {}, horizon=0.2,
+                             max_slices=2, child_usd=1000, requests_per_second=100)
+    assert {leg.coin: leg.status for leg in legs} == {'AAA': 'filled', 'BBB': 'filled'}
+    assert all(order['reduce_only'] for order in market.orders)
+    assert market.positions == {'AAA': 0.0, 'BBB': 0.0}
+
+def test_reduce_only_close_without_position_fails():
+    market = quiet_market(['AAA'])
+    snapshot = MarketSnapshot.fetch(market)
+    legs = asyncio.run(TWAPExecutor(market, market, horizon=0).execute({'close': [('AAA', -2000.0)], 'reduce': [],
+                                                                        'increase': [], 'open': []}, snapshot))
+    assert legs[0].status == 'failed'
+    assert 'Reduce only' in legs[0].error
+    assert market.positions.get('AAA', 0.0) == 0.0
+
+@pytest.mark.parametrize('horizon', [0.0, 0.6])
+def test_opening_slices_wait_for_the_closing_slices(horizon):
+    market = quiet_market(['AAA', 'BBB'], positions={'AAA': 3000.0}, latency=0.05)
+    execute_rebalance(market, market, '0xwallet', {'AAA': 3000.0}, {'BBB': 3000.0}, horizon=horizon, max_slices=3,
+                      child_usd=1000, requests_per_second=100)
+    closes = [order['time'] for order in market.orders if order['coin'] == 'AAA']
+    opens = [order['time'] for order in market.orders if order['coin'] == 'BBB']
+    assert len(closes) == len(opens) == 3
+    # Each open child is sent only after the close child of its slice came back, even with no horizon
+    for close_time, open_time in zip(closes, opens):
+        assert open_time - close_time >= 0.05 - 0.005
+
+def test_child_orders_are_paced_by_the_rate_limit():
+    coins = [f'C{i}' for i in range(10)]
+    market = quiet_market(coins)
+    start = time.monotonic()
+    execute_rebalance(market, market, '', {}, {coin: 500.0 for coin in coins}, horizon=0, max_slices=1,
+                      requests_per_second=5)
+    times = sorted(order['time'] - start for order in market.orders)
+    assert len(times) == 10
+    # A burst of one bucket (5 orders), then one order per 1/5 s
+    assert sum(t < 0.1 for t in times) == 5
+    assert times[-1] >= 5 / 5 - 0.05
+
+def test_leg_without_mid_is_skipped_and_others_run():
+    market = quiet_market(['AAA'])
+    legs = execute_rebalance(market, market, '', {}, {'AAA': 1000.0, 'GONE': 1000.0}, horizon=0)
+    by_coin = {leg.coin: leg for leg in legs}
+    assert by_coin['GONE'].status == 'skipped'
+    assert 'GONE' in by_coin['GONE'].error
+    assert by_coin['AAA'].status == 'filled'
+
+def test_accounts_are_sliced_with_twap():
+    market = quiet_market(['AAA', 'BBB'])
+    weights = pd.DataFrame({'clipped_weight': {'AAA': 0.02, 'BBB': -0.01}})
+    results = rebalance_accounts([AccountConfig('one', '0x1'), AccountConfig('two', '0x2')], weights, market,
+                                 exchange_factory=lambda config: market, twap_horizon=0.1)
+    for result in results.values():
+        assert result.status == 'done'
+        assert all(isinstance(leg, LegExecution) and leg.status == 'filled' for leg in result.orders)
+    assert plan_rebalance({}, results['one'].target_allocations)['open']
@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_ohlcv
+from forecast import FORECAST_CAP, FORECAST_TARGET, panel_forecast, scale_forecast
+
+def synthetic_close(coins: int = 5, bars: int = 400) -> pd.DataFrame:
+    close = pd.concat({f'C{i}': synthetic_ohlcv(bars, seed=i)['close'] for i in range(coins)}, axis=1)
+    close.index.freq = None
+    return close
+
+def test_forecast_does_not_look_ahead():
+    close = synthetic_close()
+    full, cut = panel_forecast(close), panel_forecast(close.iloc[:250])
+    np.testing.assert_allclose(full.iloc[:250].to_numpy(), cut.to_numpy(), rtol=1e-12, equal_nan=True)
+    assert full.iloc[-1].notna().all()
+
+def test_scale_forecast_uses_the_expanding_average():
+    raw = pd.DataFrame({'A': [1.0, 2.0, np.nan, 4.0], 'B': [3.0, -2.0, 1.0, np.nan]})
+    scaled = scale_forecast(raw, min_periods=3)
+    assert scaled.iloc[0].isna().all()
+    # 4 values by the second row with a mean |raw| of 2, 6 by the last with a mean of 13 / 6
+    np.testing.assert_allclose(scaled.iloc[1], [2.0 * FORECAST_TARGET / 2, -2.0 * FORECAST_TARGET / 2])
+    assert scaled.loc[3, 'A'] == min(4.0 * FORECAST_TARGET * 6 / 13, FORECAST_CAP)
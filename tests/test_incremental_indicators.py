@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_ohlcv
+from strategy import loose_pants_trend
+from utils.incremental_indicators import TrendState
+from volatility_metrics import create_volatility_metrics
+
+def replay(df: pd.DataFrame, state: TrendState | None = None) -> pd.DataFrame:
+    state = state or TrendState()
+    rows = []
+    for timestamp, close in zip(df.index.as_unit('ms').asi8.tolist(), df['close'].tolist()):
+        state.update(timestamp, close)
+        rows.append((state.signal, state.volatility, state.inverse_volatility))
+    return pd.DataFrame(rows, index=df.index, columns=['signal', 'volatility', 'inverse_volatility'])
+
+def test_trend_state_matches_pandas_on_every_bar():
+    df = synthetic_ohlcv(400, seed=7)
+    # A flat stretch, where the rolling std must come out as exactly 0
+    df.iloc[150:180, df.columns.get_loc('close')] = 123.0
+    expected = loose_pants_trend(create_volatility_metrics(df))
+    replayed = replay(df)
+    for column in ['signal', 'volatility', 'inverse_volatility']:
+        np.testing.assert_array_equal(replayed[column].to_numpy(), expected[column].to_numpy(), err_msg=column)
+
+def test_revising_the_last_bar_equals_receiving_it_once():
+    df = synthetic_ohlcv(100, seed=3)
+    revised = TrendState()
+    replay(df.iloc[:-1], revised)
+    last = int(df.index.as_unit('ms').asi8[-1])
+    for close in [90.0, 110.0, float(df['close'].iloc[-1])]:
+        revised.update(last, close)
+    once = TrendState()
+    replay(df, once)
+    assert revised.to_dict(include_revision=False) == once.to_dict(include_revision=False)
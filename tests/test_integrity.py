@@ -0,0 +1,33 @@
+from benchmarks.synthetic import DAY_MS, FakeOHLCVExchange, synthetic_ohlcv
+from candle_store import CandleStore
+from integrity import backfill_gaps, backfill_ranges, scan_series
+
+def test_scan_finds_each_gap_and_backfill_fetches_only_the_missing_bars(tmp_path):
+    df = synthetic_ohlcv(100, seed=8)
+    store = CandleStore(str(tmp_path))
+    store.replace('AAA', '1d', df.drop(df.index[[10, 11, 12, 50]]))
+    first = df.index.as_unit('ms').asi8[0]
+
+    health = scan_series(store, 'AAA', '1d', now_ms=first + 100 * DAY_MS)
+    assert (health.status, health.missing_bars, health.misaligned, health.behind) == ('gaps', 4, 0, 1)
+    assert health.gaps == [(first + 10 * DAY_MS, first + 12 * DAY_MS), (first + 50 * DAY_MS, first + 50 * DAY_MS)]
+    assert backfill_ranges(health, limit=2) == [(first + 10 * DAY_MS, 2), (first + 12 * DAY_MS, 1), (first + 50 * DAY_MS, 1)]
+
+    exchange = FakeOHLCVExchange(new_bars=5)
+    results = backfill_gaps({'AAA': 0}, ['1d'], str(tmp_path), exchange=exchange, limit=2, backoff=0)
+    result = results[('AAA', '1d')]
+    # Bars the exchange returned past each range are not written
+    assert (result.requested_bars, result.rows, result.requests, result.remaining_bars) == (4, 4, 3, 0)
+    assert store.length('AAA', '1d') == 100
+    assert store.load_df('AAA', '1d').index.equals(df.index)
+
+def test_duplicated_and_out_of_order_bars_are_rewritten_in_order(tmp_path):
+    df = synthetic_ohlcv(30, seed=9)
+    store = CandleStore(str(tmp_path))
+    store.replace('AAA', '1d', df.iloc[[*range(20), 5, *range(29, 19, -1)]])
+    health = scan_series(store, 'AAA', '1d')
+    assert (health.status, health.duplicates, health.out_of_order, health.missing_bars) == ('corrupt', 1, 10, 0)
+
+    results = backfill_gaps({'AAA': 0}, ['1d'], str(tmp_path), exchange=FakeOHLCVExchange())
+    assert results[('AAA', '1d')].reordered and results[('AAA', '1d')].requests == 0
+    assert store.load_df('AAA', '1d').index.equals(df.index)
@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import synthetic_ohlcv
+from panel import panel_signals, panel_volatility
+from strategy import loose_pants_trend
+from volatility_metrics import create_volatility_metrics
+
+@pytest.fixture
+def frames() -> dict[str, pd.DataFrame]:
+    """Coin frames with the panel's usual shapes: full history, late listing, delisting and holes."""
+    full = synthetic_ohlcv(300, seed=1)
+    return {
+        'FULL': full,
+        'LATE': synthetic_ohlcv(300, seed=2).iloc[120:],
+        'GONE': synthetic_ohlcv(300, seed=3).iloc[:250],
+        'HOLES': synthetic_ohlcv(300, seed=4).drop(full.index[[40, 41, 100, 180, 181, 182, 260]]),
+    }
+
+@pytest.fixture
+def close(frames) -> pd.DataFrame:
+    close = pd.concat({coin: df['close'] for coin, df in frames.items()}, axis=1).sort_index()
+    # Like a panel loaded from the store; pandas mis-aligns slices of a daily-freq index when concatenating them
+    close.index.freq = None
+    return close
+
+def test_panel_functions_match_each_coin_on_its_own_bars(frames, close):
+    signals, volatility = panel_signals(close), panel_volatility(close)
+    for coin, df in frames.items():
+        own = loose_pants_trend(create_volatility_metrics(df))
+        pd.testing.assert_series_equal(signals[coin].dropna(), own['signal'].dropna(), check_names=False, check_freq=False)
+        pd.testing.assert_series_equal(volatility[coin].reindex(df.index), own['volatility'], check_names=False, check_freq=False)
@@ -0,0 +1,40 @@
+import pandas as pd
+
+from benchmarks.synthetic import FakeExchange, FakeInfo, build_store
+from dataframe_loader import load_candles
+from forecast import forecast_weights, panel_forecast
+from panel import last_valid, load_panel
+from rebalance import generate_target_weights, plan_rebalance, rebalance_portfolio
+from volatility_metrics import create_volatility_metrics
+
+def test_coin_without_mid_fails_alone_before_any_order():
+    info, exchange = FakeInfo(['AAA', 'BBB']), FakeExchange()
+    reports = rebalance_portfolio(info, exchange, '0xwallet', {'GONE': 500.0, 'AAA': 1000.0},
+                                  {'AAA': 2000.0, 'BBB': 1000.0, 'NEW': 1000.0})
+    by_coin = {report.coin: report for report in reports}
+    assert by_coin['GONE'].status == by_coin['NEW'].status == 'error'
+    assert 'No mid' in by_coin['GONE'].error
+    assert by_coin['AAA'].status == by_coin['BBB'].status == 'filled'
+    # The missing coins were dropped from the batches, not sent
+    assert exchange.requests == 2
+
+def test_plan_orders_phases_and_skips_small_changes():
+    plan = plan_rebalance({'AAA': 1000.0, 'BBB': -500.0, 'CCC': 300.0, 'DDD': 1000.0},
+                          {'AAA': 500.0, 'BBB': -1000.0, 'CCC': 305.0, 'EEE': 200.0})
+    assert plan == {
+        'close': [('DDD', -1000.0)],
+        'reduce': [('AAA', -500.0)],
+        'increase': [('BBB', -500.0)],
+        'open': [('EEE', 200.0)],
+    }
+
+def test_forecast_weights_use_the_full_history_volatility(tmp_path):
+    base_path = str(tmp_path / 'store')
+    coins = build_store(base_path, 6, 400)
+    weights = generate_target_weights(coins, '1d', base_path=base_path, signal_source='forecast')['clipped_weight']
+    # Reference: the forecasts and each coin's pandas inverse volatility on its whole history
+    close = load_panel(coins, '1d', base_path=base_path)
+    inv_vol = pd.Series({coin: create_volatility_metrics(load_candles(coin, '1d', base_path))['inverse_volatility'].iloc[-1]
+                         for coin in coins})
+    expected = forecast_weights(last_valid(panel_forecast(close), close), inv_vol)
+    pd.testing.assert_series_equal(weights.sort_index(), expected.sort_index(), check_names=False, check_exact=True)
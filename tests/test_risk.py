@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import synthetic_ohlcv
+from candle_store import PRICE_COLUMNS, CandleStore
+from panel import load_panel
+from risk import EWMACovariance, load_risk_model
+
+def rebuilt(coins: list[str], base_path: str) -> pd.DataFrame:
+    model = EWMACovariance(coins)
+    model.update_panel(load_panel(coins, '1d', base_path=base_path))
+    return model.covariance()
+
+def test_saved_model_follows_new_bars_and_coins(tmp_path):
+    base_path = str(tmp_path / 'store')
+    store = CandleStore(base_path)
+    frames = {f'C{i}': synthetic_ohlcv(260, seed=i) for i in range(4)}
+    for coin in ['C0', 'C1', 'C2']:
+        store.replace(coin, '1d', frames[coin].iloc[:200])
+    load_risk_model(['C0', 'C1', 'C2'], '1d', base_path=base_path)
+
+    # Every coin gets new bars and C3 joins with its full history
+    for coin in ['C0', 'C1', 'C2']:
+        new = frames[coin].iloc[200:]
+        store.write_candles(coin, '1d', np.column_stack([new.index.as_unit('ms').asi8, new[PRICE_COLUMNS].to_numpy()]))
+    store.replace('C3', '1d', frames['C3'])
+    model = load_risk_model(list(frames), '1d', base_path=base_path)
+
+    assert model.coins == list(frames)
+    expected = rebuilt(list(frames), base_path)
+    np.testing.assert_allclose(model.covariance().to_numpy(), expected.to_numpy(), rtol=1e-12)
+
+def test_target_volatility_scales_the_whole_book_up_to_the_gross_cap():
+    close = pd.concat({f'C{i}': synthetic_ohlcv(300, seed=i)['close'] for i in range(3)}, axis=1)
+    model = EWMACovariance(list(close.columns))
+    model.update_panel(close)
+    weights = pd.Series({'C0': 0.2, 'C1': -0.1, 'C2': 0.1})
+
+    scaled = model.scale_to_target_volatility(weights, target_vol=0.1, max_gross=10.0)
+    assert model.portfolio_volatility(scaled) == pytest.approx(0.1)
+    pd.testing.assert_series_equal(scaled / weights, pd.Series(scaled['C0'] / 0.2, index=weights.index))
+    capped = model.scale_to_target_volatility(weights, target_vol=10.0, max_gross=1.0)
+    assert capped.abs().sum() == pytest.approx(1.0)
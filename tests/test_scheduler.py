@@ -0,0 +1,45 @@
+import accounts
+import scheduler
+from accounts import AccountConfig, AccountRebalanceResult
+from scheduler import PipelineConfig, ResultsStore, Stage, attempt_stage, daily_stages, run_job
+
+def test_rebalance_accounts_retries_only_the_failed_accounts(monkeypatch):
+    configs = [AccountConfig('one', '0x1'), AccountConfig('two', '0x2'), AccountConfig('three', '0x3')]
+    calls = []
+
+    def rebalance_accounts(configs, weights_df, info, execute=True, twap_horizon=0.0):
+        calls.append([config.name for config in configs])
+        # 'two' fails on its first attempt only
+        return {config.name: AccountRebalanceResult(config.name, 'failed' if config.name == 'two' and len(calls) == 1 else 'done')
+                for config in configs}
+
+    monkeypatch.setattr(accounts, 'load_account_configs', lambda path: configs)
+    monkeypatch.setattr(accounts, 'rebalance_accounts', rebalance_accounts)
+    stages = daily_stages(PipelineConfig(accounts_path='accounts.json'), get_clients=lambda: (None, None, None))
+    stage = next(stage for stage in stages if stage.name == 'rebalance_accounts')
+    stage.backoff = 0
+
+    result = attempt_stage(stage, {'target_weights': {'AAA': 0.1}})
+    assert result.status == 'done' and result.attempts == 2
+    assert calls == [['one', 'two', 'three'], ['two']]
+    assert list(result.result) == ['one', 'two', 'three']
+    assert all(account['status'] == 'done' for account in result.result.values())
+
+def test_rerun_with_another_config_reruns_every_stage(tmp_path):
+    calls = []
+    stages = [Stage('weights', lambda inputs: calls.append('weights') or {'AAA': 0.1})]
+    paths = {'results_path': str(tmp_path / 'results.sqlite'), 'lock_path': str(tmp_path / 'pipeline.lock')}
+    run_job('day', PipelineConfig(sizing='inverse_vol'), stages=stages, **paths)
+    run_job('day', PipelineConfig(sizing='inverse_vol'), stages=stages, **paths)
+    assert calls == ['weights']
+    run_job('day', PipelineConfig(sizing='target_vol'), stages=stages, **paths)
+    assert calls == ['weights', 'weights']
+    assert ResultsStore(paths['results_path']).latest_run()['config']['sizing'] == 'target_vol'
+
+def test_account_stage_fails_without_a_wallet_address(monkeypatch):
+    monkeypatch.setattr(scheduler, 'load_dotenv', lambda: None)
+    monkeypatch.delenv('WALLET_ADDRESS', raising=False)
+    stage = next(stage for stage in daily_stages(PipelineConfig(), get_clients=lambda: (None, None, None)) if stage.name == 'account')
+    stage.max_retries = 1
+    result = attempt_stage(stage, {})
+    assert result.status == 'failed' and 'WALLET_ADDRESS' in result.error
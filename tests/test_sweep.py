@@ -0,0 +1,22 @@
+import glob
+
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_ohlcv
+from sweep import run_sweep
+
+def test_results_are_only_resumed_for_the_same_configuration(tmp_path, capsys):
+    close = pd.concat({f'C{i}': synthetic_ohlcv(200, seed=i)['close'] for i in range(3)}, axis=1)
+    path = str(tmp_path / 'sweep_results.csv')
+    grid = {'lookback': [3, 5]}
+    free = run_sweep(close, grid, path, max_workers=1)
+    assert run_sweep(close, grid, path, max_workers=1).equals(free)
+    assert '2 already done' in capsys.readouterr().out
+
+    # Fees, or a shorter history, change every result: nothing is reused
+    charged = run_sweep(close, grid, path, max_workers=1, fee_rate=0.001)
+    shorter = run_sweep(close.iloc[:150], grid, path, max_workers=1)
+    assert capsys.readouterr().out.count('0 already done') == 2
+    assert len(glob.glob(str(tmp_path / 'sweep_results_*.csv'))) == 3
+    assert (charged.set_index('lookback')['total_return'] < free.set_index('lookback')['total_return']).all()
+    assert not shorter.set_index('lookback')['total_return'].equals(free.set_index('lookback')['total_return'])
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import synthetic_ohlcv
+from candle_store import PRICE_COLUMNS, CandleStore
+from timeframes import STITCH_GAPS, load_timeframe
+
+HOUR_MS = 3_600_000
+AGGREGATIONS = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'}
+
+def daily(hourly: pd.DataFrame) -> pd.DataFrame:
+    # Drops the first day, which the hourly history only covers from 05:00
+    return hourly.resample('1D').agg(AGGREGATIONS).iloc[1:]
+
+def test_daily_bars_derived_from_hourly_follow_appends_and_revisions(tmp_path):
+    hourly = synthetic_ohlcv(24 * 40, seed=5, start='2015-01-01 05:00', bar_ms=HOUR_MS)
+    store = CandleStore(str(tmp_path))
+    store.replace('AAA', '1h', hourly.iloc[:24 * 30])
+    pd.testing.assert_frame_equal(load_timeframe(store, 'AAA', '1d'), daily(hourly.iloc[:24 * 30]), check_freq=False)
+
+    # Revise the last stored hour and append the rest: only the buckets from that hour on are rebuilt
+    new = hourly.iloc[24 * 30 - 1:].copy()
+    new.iloc[0, new.columns.get_loc('close')] *= 1.2
+    store.write_candles('AAA', '1h', np.column_stack([new.index.as_unit('ms').asi8, new[PRICE_COLUMNS].to_numpy()]))
+    revised = pd.concat([hourly.iloc[:24 * 30 - 1], new])
+    pd.testing.assert_frame_equal(load_timeframe(store, 'AAA', '1d'), daily(revised), check_freq=False)
+    pd.testing.assert_frame_equal(load_timeframe(store, 'AAA', '1d', tail=5), daily(revised).iloc[-5:], check_freq=False)
+
+def test_older_daily_history_is_stitched_in_front_only_without_a_gap(tmp_path):
+    hourly = synthetic_ohlcv(24 * 20, seed=6, start='2015-01-01 05:00', bar_ms=HOUR_MS)
+    legacy = synthetic_ohlcv(40, seed=7, start='2014-11-23')
+    store = CandleStore(str(tmp_path))
+    store.replace('AAA', '1h', hourly)
+    store.replace('AAA', '1d', legacy)
+
+    stitched = load_timeframe(store, 'AAA', '1d')
+    # The legacy bars run up to the first complete hourly day, so they are kept in front of it
+    pd.testing.assert_frame_equal(stitched.iloc[:40], legacy[PRICE_COLUMNS], check_freq=False)
+    pd.testing.assert_frame_equal(stitched.iloc[40:], daily(hourly), check_freq=False)
+
+    store.replace('AAA', '1d', legacy.iloc[:35])
+    pd.testing.assert_frame_equal(load_timeframe(store, 'AAA', '1d'), daily(hourly), check_freq=False)
+    assert STITCH_GAPS[(store.base_path, 'AAA', '1d', '1d')] == (legacy.index[34], pd.Timestamp('2015-01-02'))
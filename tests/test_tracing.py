@@ -0,0 +1,27 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.tracing import Tracer, submit
+
+def test_runs_on_different_threads_keep_their_own_totals():
+    tracer = Tracer(enabled=True)
+    totals = {}
+
+    def session(name: str, spans: int):
+        run = tracer.start_run()
+        for _ in range(spans):
+            with tracer.span('stage'):
+                pass
+        # Work handed to a pool still counts towards the run that submitted it
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            for future in [submit(pool, tracer.record, 'pooled', 0.01) for _ in range(spans)]:
+                future.result()
+        totals[name] = {row['stage']: row['calls'] for row in tracer.slowest(run=run)}
+
+    threads = [threading.Thread(target=session, args=args) for args in [('one', 3), ('two', 5)]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert totals == {'one': {'stage': 3, 'pooled': 3}, 'two': {'stage': 5, 'pooled': 5}}
+    assert tracer.histograms['stage'].count == 8
@@ -0,0 +1,32 @@
+from benchmarks.synthetic import FakeInfo
+from universe import DAY_MS, UniverseManager, load_top_coins, read_changes, select_top
+
+SCORES = {f'C{i}': 100.0 - i for i in range(20)}
+
+def test_members_near_the_cutoff_stay_until_they_leave_the_exit_band():
+    # C5 ranks 6th: a member inside the exit rank keeps its place over C4, a newcomer outside the entry rank
+    assert select_top(SCORES, 5, ['C0', 'C1', 'C2', 'C3', 'C5'], entry_rank=4, exit_rank=6) == ['C0', 'C1', 'C2', 'C3', 'C5']
+    # C6 ranks 7th, out of the band: its slot goes to the best newcomer
+    assert select_top(SCORES, 5, ['C0', 'C1', 'C2', 'C3', 'C6'], entry_rank=4, exit_rank=6) == ['C0', 'C1', 'C2', 'C3', 'C4']
+    # A newcomer inside the entry rank pushes out the worst-ranked member
+    assert select_top(SCORES, 5, ['C1', 'C2', 'C3', 'C4', 'C5'], entry_rank=4, exit_rank=6) == ['C0', 'C1', 'C2', 'C3', 'C4']
+
+def test_only_membership_changes_are_published(tmp_path):
+    coins = ['A', 'B', 'C', 'D', 'E', 'F']
+    volumes = {'A': 80.0, 'B': 70.0, 'C': 60.0, 'D': 50.0, 'E': 40.0, 'F': 30.0}
+    manager = UniverseManager(size=4, entry_rank=3, exit_rank=5, path=str(tmp_path / 'top_coins.json'),
+                              changes_path=str(tmp_path / 'changes.jsonl'), base_path=str(tmp_path / 'store'))
+    diffs = []
+    manager.subscribe(diffs.append)
+
+    first = manager.update(FakeInfo(coins, volumes=volumes), now_ms=DAY_MS)
+    assert first.added == ('A', 'B', 'C', 'D') and not first.removed
+    # E's 30-day average climbs to 5th, inside the exit band but not the entry band: nothing changes
+    assert not manager.update(FakeInfo(coins, volumes=volumes | {'E': 58.0}), now_ms=2 * DAY_MS)
+    change = manager.update(FakeInfo(coins, volumes=volumes | {'E': 300.0}), now_ms=3 * DAY_MS)
+    assert (change.added, change.removed) == (('E',), ('D',))
+    # Members keep their order and the newcomer is appended
+    assert list(load_top_coins(manager.path)) == ['A', 'B', 'C', 'E']
+    assert load_top_coins(manager.path)['E'] == 4
+    assert diffs == [first, change]
+    assert [(c['added'], c['removed']) for c in read_changes(manager.changes_path)] == [(['A', 'B', 'C', 'D'], []), (['E'], ['D'])]
@@ -0,0 +1,246 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+from candle_store import CandleStore, PRICE_COLUMNS
+
+# Resolution fetched from the exchange; every coarser timeframe is derived from it
+BASE_TIMEFRAME = '1h'
+SUPPORTED_TIMEFRAMES = ['1h', '4h', '1d', '1w']
+
+# Buckets are aligned to a Monday midnight UTC so weekly bars start on Mondays like the exchange's
+BUCKET_ORIGIN_MS = int(pd.Timestamp('1970-01-05').value // 1_000_000)
+UNIT_MS = {'m': 60_000, 'h': 3_600_000, 'd': 86_400_000, 'w': 7 * 86_400_000}
+
+def timeframe_ms(timeframe: str) -> int:
+  return int(timeframe[:-1]) * UNIT_MS[timeframe[-1]]
+
+def resample_columns(columns: dict[str, np.ndarray], timeframe: str) -> dict[str, np.ndarray]:
+  """
+  Aggregates OHLCV column arrays into `timeframe` buckets in one vectorized pass. Empty buckets are skipped.
+  """
+  dates = np.asarray(columns['date'])
+  if len(dates) == 0:
+    return {col: np.asarray(values)[:0] for col, values in columns.items()}
+  size = timeframe_ms(timeframe)
+  buckets = (dates - BUCKET_ORIGIN_MS) // size
+  starts = np.flatnonzero(np.append(True, buckets[1:] != buckets[:-1]))
+  ends = np.append(starts[1:], len(dates)) - 1
+  return {
+    'date': buckets[starts] * size + BUCKET_ORIGIN_MS,
+    'open': np.asarray(columns['open'])[starts],
+    'high': np.maximum.reduceat(columns['high'], starts),
+    'low': np.minimum.reduceat(columns['low'], starts),
+    'close': np.asarray(columns['close'])[ends],
+    'volume': np.add.reduceat(columns['volume'], starts),
+  }
+
+def _columns_to_df(columns: dict[str, np.ndarray]) -> pd.DataFrame:
+  index = pd.DatetimeIndex(np.asarray(columns['date']).view('datetime64[ms]'), name='date')
+  return pd.DataFrame({col: columns[col] for col in PRICE_COLUMNS}, index=index, copy=False)
+
+class DerivedCandles:
+  """
+  In-memory cache of timeframes resampled from a finer stored series.
+
+  Entries remember the generation of the source series they were built from. When the source only had
+  bars appended or revised since, just the buckets from the first changed bar onwards are recomputed.
+  Nothing derived is written to disk. Like the data cache, entries are bounded by their total size and
+  the least recently used ones are evicted first.
+  """
+
+  def __init__(self, max_bytes: int = 256 * 1024 ** 2):
+    self.max_bytes = max_bytes
+    self.entries: OrderedDict[tuple, tuple[int, dict[str, np.ndarray]]] = OrderedDict() # key -> (source generation, columns)
+    self.total_bytes = 0
+    self.lock = threading.Lock()
+
+  def get(self, store: CandleStore, symbol: str, source_timeframe: str, timeframe: str) -> dict[str, np.ndarray]:
+    key = (store.base_path, symbol, source_timeframe, timeframe)
+    generation = store.generation(symbol, source_timeframe)
+    with self.lock:
+      cached = self.entries.get(key)
+      if cached is not None:
+        self.entries.move_to_end(key)
+    if cached is not None and cached[0] == generation:
+      return cached[1]
+
+    source = store.read_columns(symbol, source_timeframe)
+    changed_from = store.changed_from(symbol, source_timeframe)
+    if cached is not None and cached[0] == generation - 1 and changed_from is not None and len(cached[1]['date']):
+      # Recompute from the bucket holding the first changed bar, keep everything before it
+      derived = cached[1]
+      size = timeframe_ms(timeframe)
+      bucket_start = (changed_from - BUCKET_ORIGIN_MS) // size * size + BUCKET_ORIGIN_MS
+      keep = int(np.searchsorted(derived['date'], bucket_start))
+      source_start = int(np.searchsorted(source['date'], bucket_start))
+      tail = resample_columns({col: values[source_start:] for col, values in source.items()}, timeframe)
+      columns = {col: np.concatenate([derived[col][:keep], tail[col]]) for col in derived}
+    else:
+      columns = resample_columns(source, timeframe)
+
+    self._put(key, generation, columns)
+    return columns
+
+  def _put(self, key: tuple, generation: int, columns: dict[str, np.ndarray]):
+    size = sum(values.nbytes for values in columns.values())
+    with self.lock:
+      if key in self.entries:
+        self.total_bytes -= sum(values.nbytes for values in self.entries.pop(key)[1].values())
+      if size > self.max_bytes:
+        return
+      self.entries[key] = (generation, columns)
+      self.total_bytes += size
+      while self.total_bytes > self.max_bytes:
+        _, (_, evicted) = self.entries.popitem(last=False)
+        self.total_bytes -= sum(values.nbytes for values in evicted.values())
+
+DERIVED_CANDLES = DerivedCandles()
+
+def source_timeframes(store: CandleStore, symbol: str, timeframe: str) -> list[str]:
+  """
+  Stored timeframes of a coin that `timeframe` can be derived from, finest first.
+  """
+  target = timeframe_ms(timeframe)
+  stored = [tf for tf in SUPPORTED_TIMEFRAMES if store.exists(symbol, tf)]
+  return sorted((tf for tf in stored if target % timeframe_ms(tf) == 0), key=timeframe_ms)
+
+def _load_source_tail(store: CandleStore, symbol: str, source_timeframe: str, timeframe: str, tail: int) -> pd.DataFrame:
+  # Resamples just enough of the source's last rows for `tail` complete-or-current buckets
+  ratio = timeframe_ms(timeframe) // timeframe_ms(source_timeframe)
+  rows = store.length(symbol, source_timeframe)
+  start = max(rows - (tail + 1) * ratio, 0)
+  source = store.read_columns(symbol, source_timeframe, tail=rows - start)
+  derived = resample_columns(source, timeframe)
+  if len(derived['date']):
+    # The first bucket is partial if its bucket began before the rows read, or (at the start of the
+    # history) if the source starts off a bucket boundary, as in _load_source
+    size = timeframe_ms(timeframe)
+    first = int(source['date'][0])
+    if start:
+      before = int(store.read_columns(symbol, source_timeframe, tail=rows - start + 1)['date'][0])
+      partial = (before - BUCKET_ORIGIN_MS) // size == (first - BUCKET_ORIGIN_MS) // size
+    else:
+      partial = first != derived['date'][0]
+    if partial:
+      derived = {col: values[1:] for col, values in derived.items()}
+  return _columns_to_df({col: values[-tail:] for col, values in derived.items()})
+
+def _load_source(store: CandleStore, symbol: str, source_timeframe: str, timeframe: str, tail: int | None = None) -> pd.DataFrame:
+  if source_timeframe == timeframe:
+    return store.load_df(symbol, timeframe, tail)
+  if tail is not None:
+    return _load_source_tail(store, symbol, source_timeframe, timeframe, tail)
+  derived = DERIVED_CANDLES.get(store, symbol, source_timeframe, timeframe)
+  if len(derived['date']):
+    # The first bucket is partial unless the source starts exactly on a bucket boundary
+    first_source = int(store.read_columns(symbol, source_timeframe)['date'][0])
+    if first_source != derived['date'][0]:
+      derived = {col: values[1:] for col, values in derived.items()}
+  return _columns_to_df(derived)
+
+def _stitch_gap(older_last: pd.Timestamp, finer_first: pd.Timestamp, timeframe: str) -> bool:
+  return (finer_first - older_last) / pd.Timedelta(milliseconds=timeframe_ms(timeframe)) > 1
+
+# (base_path, symbol, timeframe, source) -> (last older bar, first finer bar) of every rejected stitch
+STITCH_GAPS: dict[tuple, tuple[pd.Timestamp, pd.Timestamp]] = {}
+
+def _report_stitch_gap(store: CandleStore, symbol: str, timeframe: str, source_timeframe: str,
+                       older_last: pd.Timestamp, finer_first: pd.Timestamp):
+  key = (store.base_path, symbol, timeframe, source_timeframe)
+  if STITCH_GAPS.get(key) != (older_last, finer_first):
+    print(f"Not stitching {symbol} {source_timeframe} history in front of the {timeframe} bars: "
+          f"missing bars between {older_last} and {finer_first}")
+  STITCH_GAPS[key] = (older_last, finer_first)
+
+def load_timeframe(store: CandleStore, symbol: str, timeframe: str, tail: int | None = None) -> pd.DataFrame | None:
+  """
+  Loads `timeframe` candles for a coin, derived from the finest stored series that divides it.
+
+  Coarser stored series usually reach further back (e.g. a legacy daily series next to a recent hourly
+  base), so their bars before the first complete bucket of the finer source are kept in front, as long as
+  they run up to it: a stitch that would leave missing bars between the two is rejected and reported, and
+  only the finer history is returned, so no rolling window spans the hole.
+  With `tail`, only the last `tail` bars are returned, and only the rows needed for them are read:
+  the store's fixed-width columns are indexed from the end, so the cost doesn't grow with the history.
+  Returns None if no stored series can produce the timeframe.
+  """
+  sources = source_timeframes(store, symbol, timeframe)
+  if not sources:
+    return None
+  df = _load_source(store, symbol, sources[0], timeframe, tail)
+  for source_timeframe in sources[1:]:
+    if tail is not None and len(df) >= tail:
+      break
+    # Only reached with `tail` when the finer source is shorter than the tail, so the older bars are read in full
+    older = _load_source(store, symbol, source_timeframe, timeframe)
+    if len(df):
+      older = older[older.index < df.index[0]]
+      if len(older) and _stitch_gap(older.index[-1], df.index[0], timeframe):
+        _report_stitch_gap(store, symbol, timeframe, source_timeframe, older.index[-1], df.index[0])
+        break
+    if len(older):
+      df = pd.concat([older, df])
+  return df if tail is None else df.iloc[-tail:]
+
+def timeframe_version(store: CandleStore, symbol: str, timeframe: str) -> tuple | None:
+  """
+  Data version of a (possibly derived) timeframe: the versions of every stored series it is built from.
+  """
+  sources = source_timeframes(store, symbol, timeframe)
+  if not sources:
+    return None
+  return tuple((tf, store.version(symbol, tf)) for tf in sources)
+
+def source_generations(store: CandleStore, symbol: str, timeframe: str) -> dict[str, int]:
+  """
+  Write generation of every stored series `timeframe` is built from, saved with state derived from the
+  candles (trend states, the risk model) so `changed_since` can tell what was rewritten under it.
+  """
+  return {tf: store.generation(symbol, tf) for tf in source_timeframes(store, symbol, timeframe)}
+
+def changed_since(store: CandleStore, symbol: str, timeframe: str, generations: dict[str, int]) -> int | None:
+  """
+  Start of the oldest `timeframe` bar changed by writes since `generations` (from `source_generations`),
+  or None if nothing changed. 0 when the change point is unknown, so callers rebuild from scratch.
+  """
+  current = source_generations(store, symbol, timeframe)
+  if current == generations:
+    return None
+  if current.keys() != generations.keys():
+    return 0
+  size = timeframe_ms(timeframe)
+  oldest = None
+  for tf, generation in current.items():
+    if generation == generations[tf]:
+      continue
+    changed = store.oldest_change_since(symbol, tf, generations[tf])
+    if changed is None:
+      return 0
+    bucket_start = (changed - BUCKET_ORIGIN_MS) // size * size + BUCKET_ORIGIN_MS
+    oldest = bucket_start if oldest is None else min(oldest, bucket_start)
+  return oldest
+
+def bars_since(store: CandleStore, symbol: str, timeframe: str, timestamp: int) -> int | None:
+  """
+  Number of `timeframe` bars from the one holding `timestamp` onwards, counted on the finest source's
+  stored timestamps, i.e. the `tail` that reads them. None if that source starts after `timestamp` and an
+  older, coarser series may hold the bars before it, so the history has to be read in full.
+  """
+  sources = source_timeframes(store, symbol, timeframe)
+  if not sources:
+    return None
+  size = timeframe_ms(timeframe)
+  bucket_start = (timestamp - BUCKET_ORIGIN_MS) // size * size + BUCKET_ORIGIN_MS
+  dates = store.read_columns(symbol, sources[0])['date']
+  if not len(dates) or dates[0] > bucket_start:
+    if len(sources) > 1 or not len(dates):
+      return None
+    bucket_start = int(dates[0]) # The whole history is newer
+  since = np.asarray(dates[int(np.searchsorted(dates, bucket_start)):])
+  return len(np.unique((since - BUCKET_ORIGIN_MS) // size))
+
+def available_timeframes(symbol: str, base_path='store') -> list[str]:
+  store = CandleStore(base_path)
+  return [tf for tf in SUPPORTED_TIMEFRAMES if source_timeframes(store, symbol, tf)]
@@ -0,0 +1,243 @@
+import heapq
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Callable, Iterable
+
+import numpy as np
+
+from utils.file_lock import FileLock
+
+if TYPE_CHECKING:
+  from hyperliquid.info import Info
+
+TOP_COINS_PATH = 'top_coins.json'
+CHANGES_PATH = 'universe_changes.jsonl'
+UNIVERSE_SIZE = 50
+HISTORY_DAYS = 30
+DAY_MS = 86_400_000
+
+class VolumeHistory:
+  """
+  Rolling window of daily notional volume per coin: a days x coins float32 ring buffer indexed by day
+  number, so recording a day overwrites the row of the day `days` ago instead of growing the history.
+  Recording the same day again replaces that day's values (`dayNtlVlm` is a rolling 24h figure).
+  """
+
+  def __init__(self, days: int = HISTORY_DAYS):
+    self.days = days
+    self.coins: list[str] = []
+    self.column: dict[str, int] = {}
+    self.volumes = np.full((days, 0), np.nan, dtype=np.float32)
+    self.row_day = np.full(days, -1, dtype=np.int64) # day number held by each row, -1 when empty
+
+  def record(self, day: int, volumes: dict[str, float]):
+    new_coins = [coin for coin in volumes if coin not in self.column]
+    if new_coins:
+      for coin in new_coins:
+        self.column[coin] = len(self.coins)
+        self.coins.append(coin)
+      self.volumes = np.hstack([self.volumes, np.full((self.days, len(new_coins)), np.nan, dtype=np.float32)])
+    row = day % self.days
+    if self.row_day[row] != day:
+      self.volumes[row] = np.nan
+      self.row_day[row] = day
+    self.volumes[row, [self.column[coin] for coin in volumes]] = list(volumes.values())
+
+  def scores(self) -> dict[str, float]:
+    """
+    Average daily volume of every coin over the recorded days of the window. Days a coin was not listed
+    count as zero, so a new listing has to sustain its volume before it outranks established coins.
+    """
+    if not self.coins or self.row_day.max() < 0:
+      return {}
+    rows = self.row_day > self.row_day.max() - self.days
+    average = np.nan_to_num(self.volumes[rows]).mean(axis=0, dtype=np.float64)
+    return dict(zip(self.coins, average.tolist()))
+
+  def save(self, path: str):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+      np.savez(f, coins=np.array(self.coins, dtype=str), volumes=self.volumes, row_day=self.row_day)
+    os.replace(tmp_path, path)
+
+  @classmethod
+  def load(cls, path: str, days: int = HISTORY_DAYS) -> 'VolumeHistory':
+    with np.load(path) as data:
+      history = cls(len(data['row_day']))
+      history.coins = data['coins'].tolist()
+      history.column = {coin: i for i, coin in enumerate(history.coins)}
+      history.volumes, history.row_day = data['volumes'], data['row_day']
+    if history.days != days:
+      # Window changed: replay the stored days into a buffer of the new length
+      resized = cls(days)
+      for row in np.argsort(history.row_day):
+        if history.row_day[row] >= 0:
+          values = history.volumes[row]
+          resized.record(int(history.row_day[row]), {c: float(v) for c, v in zip(history.coins, values) if not np.isnan(v)})
+      return resized
+    return history
+
+def select_top(scores: dict[str, float], size: int, members: Iterable[str] = (), entry_rank: int | None = None,
+               exit_rank: int | None = None) -> list[str]:
+  """
+  The `size` coins to hold, best score first, with hysteresis bands around the cutoff: a member stays
+  while it ranks within `exit_rank` and a newcomer needs to rank within `entry_rank` to push one out
+  (defaults: 20% of `size` either side). Free slots go to the best-ranked newcomers. Only the top
+  `exit_rank` coins are ranked, a partial heap selection instead of sorting the whole universe.
+  """
+  entry_rank = entry_rank if entry_rank is not None else size - size // 5
+  exit_rank = exit_rank if exit_rank is not None else size + size // 5
+  ranked = [coin for coin, _ in heapq.nlargest(max(size, exit_rank), scores.items(), key=lambda item: item[1])]
+  members = set(members)
+  selected = [coin for rank, coin in enumerate(ranked, 1)
+              if (coin in members and rank <= exit_rank) or (coin not in members and rank <= entry_rank)]
+  if len(selected) > size:
+    # Too many survivors: the worst-ranked members go first, newcomers all rank above them
+    selected = selected[:size]
+  chosen = set(selected)
+  for coin in ranked:
+    if len(chosen) >= size:
+      break
+    chosen.add(coin)
+  return [coin for coin in ranked if coin in chosen]
+
+@dataclass(frozen=True)
+class MembershipDiff:
+  added: tuple[str, ...] = ()
+  removed: tuple[str, ...] = ()
+  members: dict[str, int] = field(default_factory=dict) # coin -> perp asset id after the change
+
+  def __bool__(self) -> bool:
+    return bool(self.added or self.removed)
+
+def write_top_coins(members: dict[str, int], path: str = TOP_COINS_PATH):
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump(members, f, indent=2)
+  os.replace(tmp_path, path)
+
+_top_coins_cache: dict[str, tuple[tuple, dict[str, int]]] = {}
+
+def load_top_coins(path: str = TOP_COINS_PATH) -> dict[str, int]:
+  """
+  Current universe as coin -> perp asset id, re-read only when the file has changed since the last call.
+  """
+  stat = os.stat(path)
+  version = (stat.st_mtime_ns, stat.st_size)
+  cached = _top_coins_cache.get(path)
+  if cached is None or cached[0] != version:
+    with open(path, 'r') as f:
+      cached = _top_coins_cache[path] = (version, json.load(f))
+  return dict(cached[1])
+
+class UniverseManager:
+  """
+  Keeps the traded universe: the top `size` coins by average daily notional volume, with hysteresis so
+  coins near the cutoff don't flip in and out. Each `update` records today's volumes, reselects, and
+  only if membership changed rewrites top_coins.json (members keep their order, newcomers are appended),
+  appends the diff to universe_changes.jsonl and passes it to the subscribers. Updates hold a lock file
+  in `base_path`, so the scheduler and the dashboard never interleave their read-modify-write.
+  """
+
+  def __init__(self, size: int = UNIVERSE_SIZE, entry_rank: int | None = None, exit_rank: int | None = None,
+               history_days: int = HISTORY_DAYS, path: str = TOP_COINS_PATH, changes_path: str = CHANGES_PATH,
+               base_path: str = 'store'):
+    self.size = size
+    self.entry_rank = entry_rank
+    self.exit_rank = exit_rank
+    self.history_days = history_days
+    self.path = path
+    self.changes_path = changes_path
+    self.history_path = os.path.join(base_path, 'universe_volume.npz')
+    self.lock_path = os.path.join(base_path, 'universe.lock')
+    self.subscribers: list[Callable[[MembershipDiff], None]] = []
+
+  def subscribe(self, callback: Callable[[MembershipDiff], None]):
+    """Calls `callback` with every non-empty membership diff."""
+    self.subscribers.append(callback)
+
+  def members(self) -> dict[str, int]:
+    return load_top_coins(self.path) if os.path.exists(self.path) else {}
+
+  def load_history(self) -> VolumeHistory:
+    if os.path.exists(self.history_path):
+      return VolumeHistory.load(self.history_path, self.history_days)
+    return VolumeHistory(self.history_days)
+
+  def update(self, info: 'Info', now_ms: int | None = None) -> MembershipDiff:
+    meta, ctxs = info.meta_and_asset_ctxs()
+    asset_ids, volumes = {}, {}
+    for asset_id, (meta_item, ctx) in enumerate(zip(meta['universe'], ctxs)):
+      if meta_item.get('isDelisted'):
+        continue
+      asset_ids[meta_item['name']] = asset_id
+      volumes[meta_item['name']] = float(ctx.get('dayNtlVlm', 0))
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+
+    with FileLock(self.lock_path):
+      history = self.load_history()
+      history.record(now_ms // DAY_MS, volumes)
+      os.makedirs(os.path.dirname(self.history_path) or '.', exist_ok=True)
+      history.save(self.history_path)
+
+      # Delisted coins are not candidates even though their volume history is kept
+      scores = history.scores()
+      current = self.members()
+      selected = select_top({coin: scores[coin] for coin in asset_ids}, self.size, current, self.entry_rank, self.exit_rank)
+      selected_set = set(selected)
+      kept = {coin: asset_ids[coin] for coin in current if coin in selected_set}
+      members = kept | {coin: asset_ids[coin] for coin in selected if coin not in kept}
+      diff = MembershipDiff(
+        added=tuple(coin for coin in members if coin not in current),
+        removed=tuple(coin for coin in current if coin not in selected_set),
+        members=members,
+      )
+      if diff or members != current:
+        write_top_coins(members, self.path)
+      if diff:
+        with open(self.changes_path, 'a') as f:
+          f.write(json.dumps({'time': now_ms, 'added': diff.added, 'removed': diff.removed}) + '\n')
+
+    if diff:
+      print(f"Universe: +{', '.join(diff.added) or '-'} / -{', '.join(diff.removed) or '-'}")
+      for callback in self.subscribers:
+        callback(diff)
+    return diff
+
+def drop_coin_state(diff: MembershipDiff, base_path: str = 'store'):
+  """
+  Subscriber freeing the state derived for coins that left the universe: their persisted trend states and
+  their rows and columns in every saved risk model. Their candles are kept. Coins that joined get their
+  state built from their own history the next time weights are computed, once their candles are fetched.
+  """
+  if not diff.removed:
+    return
+  from candle_store import CandleStore
+  from risk import drop_risk_coins
+  from timeframes import SUPPORTED_TIMEFRAMES
+  store = CandleStore(base_path)
+  for coin in diff.removed:
+    for timeframe in SUPPORTED_TIMEFRAMES:
+      state_path = os.path.join(store.series_path(coin, timeframe), 'trend_state.json')
+      if os.path.exists(state_path):
+        os.remove(state_path)
+  drop_risk_coins(diff.removed, base_path)
+
+def read_changes(path: str = CHANGES_PATH, since_ms: int = 0) -> list[dict]:
+  """Published membership diffs newer than `since_ms`, oldest first."""
+  if not os.path.exists(path):
+    return []
+  with open(path, 'r') as f:
+    changes = [json.loads(line) for line in f if line.strip()]
+  return [change for change in changes if change['time'] > since_ms]
+
+
+###### TESTING OR MANUALLY RUNNING FILE
+
+if __name__ == '__main__':
+  from account import get_account_data
+  _, _, info = get_account_data()
+  diff = UniverseManager().update(info)
+  print(f'{len(diff.members)} coins, added {list(diff.added)}, removed {list(diff.removed)}')
@@ -0,0 +1,43 @@
+import os
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+class FileLock:
+    """
+    Blocking exclusive lock on `path`, shared by every process that locks the same file. Each `with`
+    block opens its own descriptor, so threads of one process exclude each other too. The OS releases
+    the lock when its holder exits, so a crash never leaves a stale lock behind.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        f = open(self.path, 'a+')
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        except BaseException:
+            f.close()
+            raise
+        self._file = f
+        return self
+
+    def __exit__(self, *exc):
+        f, self._file = self._file, None
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        f.close()
+        return False
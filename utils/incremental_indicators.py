@@ -0,0 +1,199 @@
+import json
+import math
+import os
+import threading
+from collections import deque
+
+class RollingExtreme:
+    """
+    Rolling max (or min) over a fixed window using a monotonic deque, O(1) amortized per value.
+    """
+
+    def __init__(self, window: int, is_max: bool = True):
+        self.window = window
+        self.is_max = is_max
+        self.values = deque() # (bar index, value), values strictly monotonic from the front
+
+    def push(self, i: int, value: float):
+        if self.is_max:
+            while self.values and self.values[-1][1] <= value:
+                self.values.pop()
+        else:
+            while self.values and self.values[-1][1] >= value:
+                self.values.pop()
+        self.values.append((i, value))
+        while self.values[0][0] <= i - self.window:
+            self.values.popleft()
+
+    def value(self, count: int) -> float:
+        # Same as pandas rolling with min_periods=window: undefined until the window is full
+        return self.values[0][1] if count >= self.window else math.nan
+
+class RollingVariance:
+    """
+    Rolling sample variance over a fixed window with Welford updates and Kahan compensation.
+
+    Replicates the add/remove steps of pandas' `rolling().var()` so the results are bit-for-bit equal.
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.values = deque() # last `window` inputs, NaN included, so they can be removed again
+        self.nobs = 0.0
+        self.mean = 0.0
+        self.ssqdm = 0.0
+        self.compensation_add = 0.0
+        self.compensation_remove = 0.0
+        self.num_consecutive_same_value = 0
+        self.prev_value = math.nan
+
+    def _add(self, value: float):
+        if value != value:
+            return
+        self.nobs += 1
+        if value == self.prev_value:
+            self.num_consecutive_same_value += 1
+        else:
+            self.num_consecutive_same_value = 1
+        self.prev_value = value
+        prev_mean = self.mean - self.compensation_add
+        y = value - self.compensation_add
+        t = y - self.mean
+        self.compensation_add = t + self.mean - y
+        self.mean = self.mean + t / self.nobs if self.nobs else 0.0
+        self.ssqdm = self.ssqdm + (value - prev_mean) * (value - self.mean)
+
+    def _remove(self, value: float):
+        if value != value:
+            return
+        self.nobs -= 1
+        if self.nobs:
+            prev_mean = self.mean - self.compensation_remove
+            y = value - self.compensation_remove
+            t = y - self.mean
+            self.compensation_remove = t + self.mean - y
+            self.mean = self.mean - t / self.nobs
+            self.ssqdm = self.ssqdm - (value - prev_mean) * (value - self.mean)
+        else:
+            self.mean = 0.0
+            self.ssqdm = 0.0
+
+    def push(self, value: float):
+        if len(self.values) == self.window:
+            self._remove(self.values.popleft())
+        self.values.append(value)
+        self._add(value)
+
+    def std(self) -> float:
+        if self.nobs < self.window or self.nobs <= 1:
+            return math.nan
+        if self.num_consecutive_same_value >= self.nobs:
+            return 0.0
+        var = self.ssqdm / (self.nobs - 1)
+        return math.sqrt(var) if var > 0 else 0.0
+
+class TrendState:
+    """
+    Incremental state for one coin and timeframe of the `loose_pants_trend` breakout rule and the
+    `create_volatility_metrics` inverse volatility. Each new bar is folded in in constant time.
+
+    `update` appends a bar, or revises the last one when called again with the same timestamp.
+    Outputs match the pandas implementations exactly.
+    """
+
+    def __init__(self, lookback: int = 5, channel: int = 20, vol_window: int = 20):
+        self.lookback = lookback
+        self.channel = channel
+        self.vol_window = vol_window
+        self.count = 0
+        self.last_timestamp = None
+        self.last_close = math.nan
+        self.raw_signal = math.nan  # unshifted breakout value on the last bar
+        self.signal = math.nan      # breakout value of the previous bar, as in loose_pants_trend
+        self.volatility = math.nan
+        self.lookback_high = RollingExtreme(lookback, is_max=True)
+        self.lookback_low = RollingExtreme(lookback, is_max=False)
+        self.channel_high = RollingExtreme(channel, is_max=True)
+        self.channel_low = RollingExtreme(channel, is_max=False)
+        self.returns = RollingVariance(vol_window)
+        self.sources = {}           # generations of the stored series folded in, set by the loader
+        self._before_last_bar = None
+
+    @property
+    def inverse_volatility(self) -> float:
+        if self.volatility != self.volatility:
+            return math.nan
+        return 1 / self.volatility if self.volatility else math.inf
+
+    def update(self, timestamp: int, close: float):
+        if self.last_timestamp is not None and timestamp == self.last_timestamp:
+            self.restore(self._before_last_bar)
+        elif self.last_timestamp is not None and timestamp < self.last_timestamp:
+            raise ValueError(f"Bar at {timestamp} is older than the last bar at {self.last_timestamp}")
+        before = self.to_dict(include_revision=False)
+
+        i = self.count
+        self.count += 1
+        if self.last_close == 0:
+            self.returns.push(math.copysign(math.inf, close) - 1 if close else math.nan)
+        else:
+            self.returns.push(close / self.last_close - 1)
+        self.volatility = self.returns.std() * math.sqrt(365)
+        for extreme in (self.lookback_high, self.lookback_low, self.channel_high, self.channel_low):
+            extreme.push(i, close)
+
+        long_signal = int(self.lookback_high.value(self.count) >= self.channel_high.value(self.count))
+        short_signal = int(self.lookback_low.value(self.count) <= self.channel_low.value(self.count)) * -1
+        self.signal = self.raw_signal
+        self.raw_signal = long_signal + short_signal
+        self.last_close = close
+        self.last_timestamp = timestamp
+        self._before_last_bar = before
+
+    def to_dict(self, include_revision: bool = True) -> dict:
+        state = {
+            'lookback': self.lookback, 'channel': self.channel, 'vol_window': self.vol_window,
+            'count': self.count, 'last_timestamp': self.last_timestamp, 'last_close': self.last_close,
+            'raw_signal': self.raw_signal, 'signal': self.signal, 'volatility': self.volatility,
+            'returns': {k: (list(v) if k == 'values' else v) for k, v in vars(self.returns).items()},
+        }
+        if include_revision:
+            state['before_last_bar'] = self._before_last_bar
+            state['sources'] = self.sources
+        for name in ('lookback_high', 'lookback_low', 'channel_high', 'channel_low'):
+            state[name] = [list(item) for item in getattr(self, name).values]
+        return state
+
+    def restore(self, state: dict):
+        self.lookback, self.channel, self.vol_window = state['lookback'], state['channel'], state['vol_window']
+        self.count, self.last_timestamp, self.last_close = state['count'], state['last_timestamp'], state['last_close']
+        self.raw_signal, self.signal, self.volatility = state['raw_signal'], state['signal'], state['volatility']
+        self.returns = RollingVariance(self.vol_window)
+        for k, v in state['returns'].items():
+            setattr(self.returns, k, deque(v) if k == 'values' else v)
+        for name, window, is_max in (('lookback_high', self.lookback, True), ('lookback_low', self.lookback, False),
+                                     ('channel_high', self.channel, True), ('channel_low', self.channel, False)):
+            extreme = RollingExtreme(window, is_max)
+            extreme.values = deque(tuple(item) for item in state[name])
+            setattr(self, name, extreme)
+        self._before_last_bar = state.get('before_last_bar')
+        self.sources = state.get('sources', self.sources)
+
+    @classmethod
+    def from_dict(cls, state: dict) -> 'TrendState':
+        trend_state = cls()
+        trend_state.restore(state)
+        return trend_state
+
+    def save(self, path: str):
+        # NaN/inf are written as the JSON extensions Python's json module reads back
+        # Temp file per writer, the dashboard and the scheduler may save the same state at once
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'TrendState':
+        with open(path, 'r') as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,220 @@
+import bisect
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Returned by every span while tracing is off, so a disabled span costs one attribute check
+_NULL_SPAN = nullcontext()
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram with count, sum and max, in seconds.
+    """
+
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile, capped at the largest observation."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+class TraceRun:
+    """
+    Calls and seconds per stage recorded during one run, e.g. a dashboard rerun of one session or one scheduler job.
+    """
+
+    def __init__(self):
+        self.stages: dict[str, list] = {} # stage -> [calls, seconds]
+        self.lock = threading.Lock()
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            calls = self.stages.setdefault(name, [0, 0.0])
+            calls[0] += 1
+            calls[1] += seconds
+
+# The run of the current context; each thread starts without one, see `submit`
+_CURRENT_RUN: contextvars.ContextVar[TraceRun | None] = contextvars.ContextVar('trace_run', default=None)
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'start')
+
+    def __init__(self, tracer: 'Tracer', name: str):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, time.perf_counter() - self.start)
+        return False
+
+class Tracer:
+    """
+    Collects wall time per named stage into latency histograms.
+
+    `span(name)` times a block and `traced(name)` a function. While disabled both do nothing but check
+    `enabled`. Besides the process-wide histograms, every sample is added to the TraceRun of the current
+    context (see `start_run`), so concurrent dashboard sessions and scheduler jobs each see their own totals.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.histograms: dict[str, Histogram] = {}
+        self.lock = threading.Lock()
+
+    def span(self, name: str):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+        run = _CURRENT_RUN.get()
+        if run is not None:
+            run.record(name, seconds)
+
+    def start_run(self) -> TraceRun:
+        """
+        Starts a new run in the current context (thread, or task) and returns it. Work handed to a thread
+        pool through `submit` records into the same run.
+        """
+        run = TraceRun()
+        _CURRENT_RUN.set(run)
+        return run
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def slowest(self, n: int = 10, run: TraceRun | None = None) -> list[dict]:
+        """
+        Stages of `run` (default: the current context's) by total time, with their all-time p50/p95 for comparison.
+        """
+        run = run or _CURRENT_RUN.get()
+        if run is None:
+            return []
+        with run.lock:
+            stages = {name: list(calls) for name, calls in run.stages.items()}
+        with self.lock:
+            rows = [{
+                'stage': name,
+                'calls': calls,
+                'total_ms': seconds * 1000,
+                'p50_ms': self.histograms[name].quantile(0.5) * 1000,
+                'p95_ms': self.histograms[name].quantile(0.95) * 1000,
+            } for name, (calls, seconds) in stages.items()]
+        return sorted(rows, key=lambda row: row['total_ms'], reverse=True)[:n]
+
+    def summary(self) -> dict[str, dict]:
+        with self.lock:
+            return {name: {
+                'count': h.count,
+                'sum_s': h.total,
+                'max_s': h.max,
+                'p50_s': h.quantile(0.5),
+                'p95_s': h.quantile(0.95),
+                'buckets': dict(zip([*map(str, h.buckets), '+Inf'], h.counts)),
+            } for name, h in self.histograms.items()}
+
+    def to_prometheus(self) -> str:
+        """Histograms in the Prometheus text exposition format, one `stage` label per span name."""
+        lines = [
+            '# HELP stage_latency_seconds Wall time of traced pipeline stages.',
+            '# TYPE stage_latency_seconds histogram',
+        ]
+        with self.lock:
+            for name, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip([*map(str, h.buckets), '+Inf'], h.counts):
+                    cumulative += count
+                    lines.append(f'stage_latency_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'stage_latency_seconds_sum{{stage="{name}"}} {h.total}')
+                lines.append(f'stage_latency_seconds_count{{stage="{name}"}} {h.count}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path: str):
+        """
+        Writes the histograms to `path`: Prometheus text if it ends in `.prom` (e.g. for the node exporter's
+        textfile collector), JSON otherwise. The file is swapped in atomically.
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.summary(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def serve(self, port: int, host: str = '127.0.0.1'):
+        """
+        Serves `to_prometheus()` at http://host:port/metrics from a daemon thread. Returns the server.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = tracer.to_prometheus().encode()
+                self.send_response(200 if self.path == '/metrics' else 404)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+# Off unless TRACING=1; the dashboard turns it on for its Performance panel
+TRACER = Tracer(enabled=os.getenv('TRACING', '0') == '1')
+
+def submit(pool, fn, *args, **kwargs):
+    """`pool.submit` running `fn` in a copy of the caller's context, so its spans count towards the caller's run."""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+def traced(name: str):
+    """Decorator timing every call of a function as stage `name` while TRACER is enabled."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return fn(*args, **kwargs)
+            with _Span(TRACER, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
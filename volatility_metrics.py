@@ -1,9 +1,21 @@
 import pandas as pd
 import numpy as np
 
-def create_volatility_metrics(df: pd.DataFrame):
+from utils.incremental_indicators import RollingVariance
+from utils.tracing import traced
+
+@traced('create_volatility_metrics')
+def create_volatility_metrics(df: pd.DataFrame, backend: str = 'pandas'):
     df = df.copy()
-    df['volatility'] = df['close'].pct_change().rolling(20).std() * np.sqrt(365)
+    if backend == 'incremental':
+        returns = RollingVariance(20)
+        volatility = []
+        for ret in df['close'].pct_change().to_numpy():
+            returns.push(ret)
+            volatility.append(returns.std() * np.sqrt(365))
+        df['volatility'] = pd.Series(volatility, index=df.index, dtype=float)
+    else:
+        df['volatility'] = df['close'].pct_change().rolling(20).std() * np.sqrt(365)
     df['inverse_volatility'] = 1 / df['volatility']
 
     return df